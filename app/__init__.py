@@ -18,6 +18,19 @@ mongo = PyMongo(app)
 def get_locale():
     return 'de'
 
+
+def _preload_translations():
+    """Loads the translation catalogues when the worker boots instead of on the first request."""
+    from flask_babel import force_locale, get_translations
+
+    with app.test_request_context():
+        for language in app.config['LANGUAGES']:
+            with force_locale(language):
+                get_translations()
+
+
+_preload_translations()
+
 @app.context_processor
 def utility_processor():
     def EUR(decimal):
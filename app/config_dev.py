@@ -3,4 +3,50 @@ SECRET_KEY = 'dev'
 CERT_PIN = '123456'
 MONGO_URI = 'mongodb://localhost:27017/steuerlotse'
 LANGUAGES = ['de']
-SESSION_TTL_SECONDS = 10 * 60
\ No newline at end of file
+SESSION_TTL_SECONDS = 10 * 60
+# One of 'memory', 'sqlite' or 'mongodb'. If not set, 'mongodb' is used in production and 'memory' otherwise.
+SESSION_BACKEND = None
+SESSION_SQLITE_PATH = 'sessions.sqlite3'
+# Per-worker limit for the sessions cached in front of MongoDB, measured by the size of their JSON
+SESSION_CACHE_MAX_BYTES = 16 * 1024 * 1024
+# Reading a session only refreshes its TTL if it is older than this fraction of `SESSION_TTL_SECONDS`
+SESSION_TTL_REFRESH_FRACTION = 0.25
+# Remaining TTL refreshes are written to MongoDB in batches
+SESSION_TTL_FLUSH_INTERVAL_SECONDS = 5
+SESSION_TTL_FLUSH_BATCH_SIZE = 100
+# Limit for the in-memory session store, measured by the size of the encoded sessions
+SESSION_MEMORY_MAX_BYTES = 64 * 1024 * 1024
+SESSION_MEMORY_COMPRESS = False
+# Validate with ERiC in the background once the summary is shown
+ELSTER_SPECULATIVE_VALIDATION = True
+# How long sending waits for a running background validation of the same data
+ELSTER_VALIDATION_WAIT_SECONDS = 10
+# Deadlines for the phases of an ERiC run, the ERiC client is killed when one is exceeded
+ELSTER_PHASE_TIMEOUT_SECONDS = {
+    'initialise': 10,
+    'create_th': 10,
+    'validate': 30,
+    'send': 60,
+    'print': 30,
+}
+# Retries of transient ERiC failures with jittered exponential backoff
+ELSTER_RETRY_MAX_ATTEMPTS = 3
+ELSTER_RETRY_BASE_DELAY_SECONDS = 0.5
+ELSTER_RETRY_MAX_DELAY_SECONDS = 5
+# Every submission adds this many retries to the per-worker retry budget, up to its maximum
+ELSTER_RETRY_BUDGET_RATIO = 0.1
+ELSTER_RETRY_BUDGET_MAX = 10
+# Host-wide limit for concurrent ERiC runs. Further submissions wait in a bounded queue
+# and are rejected with `Retry-After` once it is full or they waited too long.
+ELSTER_MAX_CONCURRENT_RUNS = 4
+ELSTER_ADMISSION_QUEUE_SIZE = 16
+ELSTER_ADMISSION_WAIT_SECONDS = 20
+ELSTER_RETRY_AFTER_SECONDS = 30
+# Runs ERiC on the gateway (`pyeric/gateway.py`) listening at `unix:/path` or `host:port`
+# instead of starting the ERiC client for every run. Use a Unix socket in production, as
+# the gateway does not authenticate clients and only listens on loopback addresses for TCP.
+ELSTER_GATEWAY_ADDRESS = None
+# Checks the generated XML against the ELSTER schemas in this folder before running ERiC,
+# if `lxml` is installed (see `pyeric/README.md`)
+ELSTER_SCHEMA_CHECK = True
+ELSTER_SCHEMA_FOLDER = 'pyeric/schemas'
@@ -0,0 +1,58 @@
+from app import app
+from flask import make_response, render_template, request
+from flask_babel import get_locale
+
+import os
+
+# Maps the cache key to a tuple `(template_mtime, rendered_output)`
+_RENDER_CACHE = {}
+
+
+def _placeholder(name):
+    return '__render_cache_%s__' % name
+
+
+def _template_mtime(template_name):
+    filename = app.jinja_env.get_or_select_template(template_name).filename
+    return os.path.getmtime(filename) if filename else None
+
+
+def render_cached(template_name, context_factory=None, substitutions=None, key_extra=None):
+    """Renders the given template like `render_template`, but caches the output
+    for the current endpoint, view arguments, locale and template modification time.
+    Hence, this must only be used for pages whose output only depends on these.
+
+    The `context_factory` is only called when the template actually needs to be
+    rendered. Values that differ per user (e.g. the session identifier within URLs)
+    can be passed as `substitutions`. They are replaced by placeholders in the
+    cached output and substituted back for every request.
+
+    The returned response carries an ETag and answers conditional requests with 304.
+    """
+    substitutions = {name: value for name, value in (substitutions or {}).items() if value}
+
+    key = (
+        request.endpoint,
+        tuple(sorted((request.view_args or {}).items())),
+        key_extra,
+        str(get_locale()),
+        template_name,
+    )
+    mtime = _template_mtime(template_name)
+
+    cached = _RENDER_CACHE.get(key)
+    if cached and cached[0] == mtime:
+        output = cached[1]
+    else:
+        context = context_factory() if context_factory else {}
+        output = render_template(template_name, **context)
+        for name, value in substitutions.items():
+            output = output.replace(value, _placeholder(name))
+        _RENDER_CACHE[key] = (mtime, output)
+
+    for name, value in substitutions.items():
+        output = output.replace(_placeholder(name), value)
+
+    response = make_response(output)
+    response.add_etag()
+    return response.make_conditional(request)
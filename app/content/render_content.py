@@ -1,8 +1,12 @@
-from flask import render_template
+from app.content.render_cache import render_cached
 from flask_babel import _
 
 
 def render_how_it_works():
+    return render_cached('content/howitworks.html', context_factory=_how_it_works_context)
+
+
+def _how_it_works_context():
     accordeon = {
         'one': {
             'heading': _('howitworks.card-1.heading'),
@@ -45,4 +49,4 @@ def render_how_it_works():
             'list-items': None,
         },
     }
-    return render_template('content/howitworks.html', accordeon=accordeon)
+    return dict(accordeon=accordeon)
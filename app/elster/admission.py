@@ -0,0 +1,97 @@
+"""Host-wide admission control for ERiC runs. Every run spawns a process that loads
+ERiC, so their number is limited across all `gunicorn` workers of a host. A run
+needs one of `ELSTER_MAX_CONCURRENT_RUNS` slots, which are lock files held with
+`flock`. Callers that do not get a slot right away wait in a queue, which is
+bounded the same way. When the queue is full, callers are rejected right away.
+
+The gauge `elster_admission_queue_depth` holds the callers waiting in this process,
+so the depth of the host-wide queue is its sum over all workers.
+"""
+from app import app, metrics
+from contextlib import contextmanager
+
+import fcntl
+import os
+import threading
+import time
+
+_ADMISSION_FOLDER = os.path.join('pyeric', 'instances', 'admission')
+_POLL_INTERVAL_SECONDS = 0.05
+
+# The number of callers waiting in the queue in this process
+_waiting = 0
+_WAITING_LOCK = threading.Lock()
+
+
+class SubmissionRejected(Exception):
+    """Raised if there is no capacity for another ERiC run. Callers should be
+    asked to retry after `retry_after` seconds."""
+
+    def __init__(self, retry_after):
+        super(SubmissionRejected, self).__init__("no capacity for ERiC runs, retry after %ds" % retry_after)
+        self.retry_after = retry_after
+
+
+def _lock_path(kind, index):
+    return os.path.join(_ADMISSION_FOLDER, '%s_%d.lock' % (kind, index))
+
+
+def _try_lock(kind, count):
+    """Returns the opened file of the first lock file that could be locked or `None`.
+    The lock is released when the file is closed."""
+    os.makedirs(_ADMISSION_FOLDER, exist_ok=True)
+    for index in range(count):
+        lock_file = open(_lock_path(kind, index), 'a')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return lock_file
+        except BlockingIOError:
+            lock_file.close()
+    return None
+
+
+def _add_waiting(delta):
+    """Counts callers entering or leaving the queue without touching the lock files,
+    which would make them look taken to concurrent callers."""
+    global _waiting
+    with _WAITING_LOCK:
+        _waiting += delta
+        metrics.set_gauge('elster_admission_queue_depth', _waiting)
+
+
+def _reject():
+    metrics.inc('elster_admission_rejected')
+    raise SubmissionRejected(app.config['ELSTER_RETRY_AFTER_SECONDS'])
+
+
+@contextmanager
+def eric_slot(queue=True):
+    """Holds one of the host-wide slots for an ERiC run. Without a free slot, the
+    caller waits in the queue for up to `ELSTER_ADMISSION_WAIT_SECONDS`, unless
+    `queue` is `False`. Raises `SubmissionRejected` if no slot could be acquired.
+    """
+    max_runs, queue_size = app.config['ELSTER_MAX_CONCURRENT_RUNS'], app.config['ELSTER_ADMISSION_QUEUE_SIZE']
+
+    slot = _try_lock('slot', max_runs)
+    if slot is None:
+        waiter = _try_lock('waiter', queue_size) if queue else None
+        if waiter is None:
+            _reject()
+
+        _add_waiting(1)
+        try:
+            deadline = time.monotonic() + app.config['ELSTER_ADMISSION_WAIT_SECONDS']
+            while slot is None:
+                if time.monotonic() >= deadline:
+                    _reject()
+                time.sleep(_POLL_INTERVAL_SECONDS)
+                slot = _try_lock('slot', max_runs)
+        finally:
+            _add_waiting(-1)
+            waiter.close()
+
+    metrics.inc('elster_admission_admitted')
+    try:
+        yield
+    finally:
+        slot.close()
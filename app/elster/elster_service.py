@@ -1,10 +1,36 @@
-from app.elster import elster_xml, est_mapping, pyeric_dispatcher
-from app import app
+from app.elster import admission, elster_xml, eric_results, est_mapping, plausibility, pyeric_dispatcher, xml_schema
+from app import app, metrics
 
+from collections import namedtuple
 from datetime import datetime
 
+import hashlib
+import os
+import subprocess
+import threading
+import time
+
 _DEFAULT_PIN = app.config['CERT_PIN']
 
+# Speculative validations run in a separate folder, so they never touch the files of a submission
+_VALIDATION_SESSION_SUFFIX = '_validation'
+
+# Maps the session identifier to `(fingerprint, thread)` of validations running in this process
+_RUNNING_VALIDATIONS = {}
+_RUNNING_VALIDATIONS_LOCK = threading.Lock()
+
+# The outcomes a submission is classified into
+OUTCOME_SUCCESS = 'success'
+OUTCOME_TIMEOUT = 'timeout'
+OUTCOME_TRANSPORT_ERROR = 'transport_error'
+OUTCOME_PLAUSIBILITY_ERROR = 'plausibility_error'
+OUTCOME_SCHEMA_ERROR = 'schema_error'  # the generated XML is broken and never reached ERiC
+
+ValidationResult = namedtuple(
+    'ValidationResult',
+    ['fingerprint', 'result_code', 'errors']
+)
+
 
 def _t4g_vorsatz(steuernummer, year):
     """Creates a `Vorsatz` for Elster XML with defaults set for T4G."""
@@ -25,25 +51,203 @@ def _t4g_vorsatz(steuernummer, year):
         Copyright='(C) 2009 ELSTER, (C) 2020 T4G',
     )
 
-def validate_with_elster(form_data, session_id, year=2019):
-    return send_with_elster(form_data, session_id, year, only_validate=True)
+def generate_entries(form_data, year=2019):
+    """Translates our form data structure into the fields from the Elster
+    specification (see `Jahresdokumentation_10_2019.xml`). The functions below take
+    the result as `entries`, so that one request maps the form data only once."""
+    return est_mapping._check_and_generate_entries(form_data, year)
 
-def send_with_elster(form_data, session_id, year=2019, only_validate=False):
+
+def validate_with_elster(form_data, session_id, year=2019, wait_for_slot=True, entries=None):
+    return send_with_elster(form_data, session_id, year, only_validate=True, wait_for_slot=wait_for_slot,
+                            entries=entries)
+
+def send_with_elster(form_data, session_id, year=2019, only_validate=False, wait_for_slot=True, entries=None):
     """The overarching method that is being called from the web backend. It
     will map the form data to Elster field identifiers, then generate the XML,
     and processes and sends it in a sub-process using ERiC.
+
+    Returns one of the `OUTCOME_*` constants, which is also stored for the session.
+    Raises `admission.SubmissionRejected` if the host has no capacity for ERiC runs.
     """
     verfahren = 'ESt_%s' % str(year)
+    fields = entries if entries is not None else generate_entries(form_data, year)
 
-    # Translate our form data structure into the fields from
-    # the Elster specification (see `Jahresdokumentation_10_2019.xml`)
-    fields = est_mapping._check_and_generate_entries(form_data)
-
-    # Generate the full XML from this
+    # Generate the XML from this, the TransferHeader is added by ERiC in the sub-process
     vorsatz = _t4g_vorsatz(steuernummer=form_data['steuernummer'], year=year)
-    xml = elster_xml.generate_full_xml(vorsatz, fields)
+    xml = elster_xml.generate_xml_without_th(vorsatz, fields)
+
+    rule_errors = plausibility.check(fields)
+    schema_errors = not rule_errors and xml_schema.check(xml, verfahren)
+    if rule_errors:
+        # ERiC would reject the data just as well, but only after a full run
+        metrics.inc('elster_rule_rejections')
+        pyeric_dispatcher.clear_results(session_id)
+        outcome = OUTCOME_PLAUSIBILITY_ERROR
+    elif schema_errors:
+        app.logger.error("generated XML does not match the schema: %s", schema_errors)
+        pyeric_dispatcher.clear_results(session_id)
+        outcome = OUTCOME_SCHEMA_ERROR
+    else:
+        outcome = _run_pyeric(xml, session_id, verfahren, only_validate, wait_for_slot)
+
+    metrics.inc('elster_outcome_' + outcome)
+    pyeric_dispatcher.save_outcome(session_id, outcome)
+    return outcome
+
+
+def _run_pyeric(xml, session_id, verfahren, only_validate, wait_for_slot):
+    """Hands the XML over to PyERiC outside this process and returns the outcome.
+    Transient failures of submissions are retried."""
+    # Validations neither add to nor draw from the retry budget, so that speculative
+    # validations cannot use up the retries of submissions. A failed validation is
+    # repeated by the submission anyway.
+    if not only_validate:
+        eric_results.record_call()
+    attempt = 0
+    while True:
+        outcome, transient = _run_pyeric_once(xml, session_id, verfahren, only_validate, wait_for_slot)
+        if not transient or only_validate or not eric_results.may_retry(attempt):
+            return outcome
+        attempt += 1
+        metrics.inc('elster_retries')
+        time.sleep(eric_results.backoff_delay(attempt))
+
+
+def _run_pyeric_once(xml, session_id, verfahren, only_validate, wait_for_slot):
+    """Returns the outcome of one ERiC run and whether it failed transiently."""
+    try:
+        with admission.eric_slot(queue=wait_for_slot):
+            pyeric_dispatcher.run_pyeric(xml, session_id, _DEFAULT_PIN, verfahren, only_validate, create_th=True)
+    except pyeric_dispatcher.EricTimeoutError as e:
+        app.logger.warning("ERiC timed out", exc_info=True)
+        # The data might have reached ELSTER once sending started
+        return OUTCOME_TIMEOUT, e.phase != 'send'
+    except pyeric_dispatcher.EricSchemaError as e:
+        app.logger.error("XML with TransferHeader does not match the schema: %s", e.errors)
+        return OUTCOME_SCHEMA_ERROR, False
+    except (subprocess.CalledProcessError, pyeric_dispatcher.EricGatewayError):
+        app.logger.warning("ERiC failed", exc_info=True)
+        return OUTCOME_TRANSPORT_ERROR, False
+
+    result_code = pyeric_dispatcher.get_result_code(session_id)
+    category = eric_results.classify(result_code)
+    if category == eric_results.CATEGORY_OK:
+        if only_validate or pyeric_dispatcher.was_successful(session_id):
+            return OUTCOME_SUCCESS, False
+    if category == eric_results.CATEGORY_PLAUSIBILITY or \
+            pyeric_dispatcher.get_plausibility_errors(pyeric_dispatcher.get_eric_response(session_id)):
+        return OUTCOME_PLAUSIBILITY_ERROR, False
+
+    app.logger.warning("ERiC returned %s: %s", result_code, pyeric_dispatcher.get_result_text(session_id))
+    return OUTCOME_TRANSPORT_ERROR, category == eric_results.CATEGORY_TRANSIENT
+
+
+def print_with_elster(session_id, year=2019):
+    """Returns the path to the PDF of a successful submission. It is only created by
+    ERiC when first requested and then kept next to the other files of the submission.
+    Returns `None` if the submission was not successful.
+    """
+    if not pyeric_dispatcher.was_successful(session_id):
+        return None
+
+    pdf_path = pyeric_dispatcher.get_pdf_path(session_id)
+    if os.path.exists(pdf_path):
+        metrics.inc('elster_pdf_cache_hits')
+        return pdf_path
+
+    transfer_ticket = pyeric_dispatcher.get_transfer_ticket(pyeric_dispatcher.get_server_response(session_id))
+    metrics.inc('elster_pdf_prints')
+    with admission.eric_slot():
+        return pyeric_dispatcher.run_pyeric_print(
+            session_id, 'ESt_%s' % str(year), footer='Transferticket: %s' % transfer_ticket)
+
+
+def check_plausibility(form_data, year=2019, entries=None):
+    """Returns the `plausibility.RuleError`s of the form data. They are found without
+    running ERiC, the step to correct each of them in is resolved with `field_index`."""
+    return plausibility.check(entries if entries is not None else generate_entries(form_data, year))
+
+
+def form_data_fingerprint(form_data, year=2019, entries=None):
+    """Returns a hash over the parts of the form data that are sent to ELSTER. Hence,
+    e.g. the confirmations given after the summary do not change the fingerprint."""
+    fields = entries if entries is not None else generate_entries(form_data, year)
+    content = repr((year, form_data['steuernummer'], sorted(fields.items())))
+    return hashlib.sha256(content.encode()).hexdigest()
+
+
+def start_speculative_validation(form_data, session_id, year=2019, entries=None):
+    """Validates the form data with ERiC in a background thread, unless a result or
+    a running validation for the same data exists. The result can be retrieved with
+    `get_validation_result`.
+    """
+    try:
+        fingerprint = form_data_fingerprint(form_data, year, entries)
+    except Exception:  # intentional generic catch: incomplete data cannot be validated
+        return
 
-    # Handover to PyERiC outside this process for sending
-    response = pyeric_dispatcher.run_pyeric(xml, session_id, _DEFAULT_PIN, verfahren, only_validate)
+    validation_session = session_id + _VALIDATION_SESSION_SUFFIX
+    with _RUNNING_VALIDATIONS_LOCK:
+        if session_id in _RUNNING_VALIDATIONS:
+            return  # a newer validation is started when the summary is shown again
+        stored = pyeric_dispatcher.get_validation_result(validation_session)
+        if stored and stored['fingerprint'] == fingerprint:
+            return
 
-    return response
+        thread = threading.Thread(
+            target=_run_speculative_validation,
+            args=(form_data, session_id, fingerprint, year, entries),
+            daemon=True)
+        _RUNNING_VALIDATIONS[session_id] = (fingerprint, thread)
+
+    metrics.inc('elster_speculative_validations')
+    thread.start()
+
+
+def _run_speculative_validation(form_data, session_id, fingerprint, year, entries):
+    validation_session = session_id + _VALIDATION_SESSION_SUFFIX
+    try:
+        # Validations are optional and thus never wait for a free slot
+        outcome = validate_with_elster(form_data, validation_session, year, wait_for_slot=False, entries=entries)
+        if outcome not in (OUTCOME_SUCCESS, OUTCOME_PLAUSIBILITY_ERROR):
+            return  # nothing is known about the data itself
+        errors = pyeric_dispatcher.get_plausibility_errors(
+            pyeric_dispatcher.get_eric_response(validation_session))
+        pyeric_dispatcher.save_validation_result(validation_session, {
+            'fingerprint': fingerprint,
+            'result_code': pyeric_dispatcher.get_result_code(validation_session),
+            'errors': [error._asdict() for error in errors],
+        })
+    except admission.SubmissionRejected:
+        metrics.inc('elster_speculative_validations_rejected')
+    except Exception:  # intentional generic catch: the submission validates again
+        app.logger.warning("speculative validation failed", exc_info=True)
+    finally:
+        with _RUNNING_VALIDATIONS_LOCK:
+            _RUNNING_VALIDATIONS.pop(session_id, None)
+
+
+def get_validation_result(form_data, session_id, timeout=0, year=2019, entries=None):
+    """Returns the `ValidationResult` of a speculative validation of exactly this
+    form data or `None`. Waits up to `timeout` seconds for a validation of the same
+    data that is still running in this process.
+    """
+    try:
+        fingerprint = form_data_fingerprint(form_data, year, entries)
+    except Exception:  # intentional generic catch
+        return None
+
+    with _RUNNING_VALIDATIONS_LOCK:
+        running = _RUNNING_VALIDATIONS.get(session_id)
+    if running and running[0] == fingerprint and timeout:
+        running[1].join(timeout)
+
+    stored = pyeric_dispatcher.get_validation_result(session_id + _VALIDATION_SESSION_SUFFIX)
+    if not stored or stored['fingerprint'] != fingerprint:
+        return None
+    return ValidationResult(
+        fingerprint=stored['fingerprint'],
+        result_code=stored['result_code'],
+        errors=[pyeric_dispatcher.PlausibilityError(**error) for error in stored['errors']],
+    )
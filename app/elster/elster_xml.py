@@ -4,6 +4,7 @@ from collections import namedtuple
 from xml.etree.ElementTree import Element, SubElement, Comment, tostring, XML
 from xml.dom import minidom
 
+import threading
 import xml.etree.ElementTree as ET
 
 Vorsatz = namedtuple(
@@ -30,6 +31,8 @@ _TEST_TH_FIELDS = TransferHeaderFields(
     datenLieferant='Softwaretester ERiC',
 )
 
+_ERIC_LOCK = threading.Lock()
+
 
 def _pretty(xml, remove_decl=True):
     """Pretty prints a etree xml object."""
@@ -94,10 +97,9 @@ _BASE_XML = """<Elster xmlns="http://www.elster.de/elsterxml/schema/v11"></Elste
 """
 
 
-def generate_full_xml(vorsatz, fields, nutzdaten_ticket="default_nutzdaten_ticket", empfaenger="9198", th_fields=_TEST_TH_FIELDS):
-    """Generates the full XML for the given `vorsatz` and `fields`. In a first step the
-    <Nutzdaten> part is generated before the ERiC library is called for generating the
-    proper <TransferHeader>.
+def generate_xml_without_th(vorsatz, fields, nutzdaten_ticket="default_nutzdaten_ticket", empfaenger="9198"):
+    """Generates the XML for the given `vorsatz` and `fields` without the <TransferHeader>,
+    which ERiC adds in `add_transfer_header`.
     """
 
     # Generate the content bits
@@ -110,17 +112,30 @@ def generate_full_xml(vorsatz, fields, nutzdaten_ticket="default_nutzdaten_ticke
     datenteil_xml.append(nutzdaten)
     base_xml.append(datenteil_xml)
 
-    # Generate TransferHeader using ERiC
-    xml_string = _pretty(base_xml, remove_decl=False)
+    return _pretty(base_xml, remove_decl=False)
 
-    eric = EricApi(debug=False)
-    try:
-        eric.initialise()
-        xml_string_with_th = eric.create_th(
-            xml_string,
-            datenart=th_fields.datenart, testmerker=th_fields.testmerker,
-            herstellerId=th_fields.herstellerId, datenLieferant=th_fields.datenLieferant)
-    finally:
-        eric.shutdown()
 
+def add_transfer_header(eric, xml_string, th_fields=_TEST_TH_FIELDS):
+    """Generates the <TransferHeader> for the given XML using the initialised `eric`."""
+    xml_string_with_th = eric.create_th(
+        xml_string,
+        datenart=th_fields.datenart, testmerker=th_fields.testmerker,
+        herstellerId=th_fields.herstellerId, datenLieferant=th_fields.datenLieferant)
     return xml_string_with_th.decode()
+
+
+def generate_full_xml(vorsatz, fields, nutzdaten_ticket="default_nutzdaten_ticket", empfaenger="9198", th_fields=_TEST_TH_FIELDS):
+    """Generates the full XML for the given `vorsatz` and `fields`. In a first step the
+    <Nutzdaten> part is generated before the ERiC library is called for generating the
+    proper <TransferHeader>.
+    """
+    xml_string = generate_xml_without_th(vorsatz, fields, nutzdaten_ticket, empfaenger)
+
+    # ERiC must not be initialised twice within one process at the same time
+    with _ERIC_LOCK:
+        eric = EricApi(debug=False)
+        try:
+            eric.initialise()
+            return add_transfer_header(eric, xml_string, th_fields)
+        finally:
+            eric.shutdown()
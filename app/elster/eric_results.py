@@ -0,0 +1,96 @@
+"""Classification of the result codes returned by ERiC and the retry policy for
+transient failures. The codes are defined in `eric_fehlercodes.h` of the ERiC SDK.
+"""
+from app import app, metrics
+
+import random
+import threading
+
+ERIC_OK = 0
+ERIC_GLOBAL_UNKNOWN = 610001001
+ERIC_GLOBAL_PRUEF_FEHLER = 610001002
+ERIC_GLOBAL_HINWEISE = 610001003
+ERIC_GLOBAL_NICHT_GENUEGEND_ARBEITSSPEICHER = 610001013
+ERIC_TRANSFER_COM_ERROR = 610101200
+ERIC_TRANSFER_ERR_XML_THEADER = 610101210
+ERIC_TRANSFER_ERR_SEND = 610101292
+ERIC_TRANSFER_ERR_PROXYCONNECT = 610101294
+ERIC_TRANSFER_ERR_CONNECTSERVER = 610101295
+ERIC_TRANSFER_ERR_NORESPONSE = 610101296
+ERIC_TRANSFER_ERR_SEND_INIT = 610101298
+ERIC_TRANSFER_ERR_TIMEOUT = 610101299
+
+CATEGORY_OK = 'ok'
+CATEGORY_PLAUSIBILITY = 'plausibility'  # the data has to be corrected
+CATEGORY_TRANSIENT = 'transient'  # nothing reached ELSTER, so trying again is safe
+CATEGORY_PERMANENT = 'permanent'
+
+# Codes that are not listed are permanent. Failures after the data may have
+# reached ELSTER (e.g. `ERIC_TRANSFER_ERR_NORESPONSE`) are permanent as well,
+# as retrying them could submit the same declaration twice.
+_CATEGORIES = {
+    ERIC_OK: CATEGORY_OK,
+    ERIC_GLOBAL_PRUEF_FEHLER: CATEGORY_PLAUSIBILITY,
+    ERIC_GLOBAL_HINWEISE: CATEGORY_PLAUSIBILITY,
+    ERIC_GLOBAL_NICHT_GENUEGEND_ARBEITSSPEICHER: CATEGORY_TRANSIENT,
+    ERIC_TRANSFER_COM_ERROR: CATEGORY_TRANSIENT,
+    ERIC_TRANSFER_ERR_PROXYCONNECT: CATEGORY_TRANSIENT,
+    ERIC_TRANSFER_ERR_CONNECTSERVER: CATEGORY_TRANSIENT,
+    ERIC_TRANSFER_ERR_SEND_INIT: CATEGORY_TRANSIENT,
+}
+
+
+def classify(result_code):
+    """Returns the `CATEGORY_*` of the given result code."""
+    return _CATEGORIES.get(result_code, CATEGORY_PERMANENT)
+
+
+class RetryBudget(object):
+    """Limits retries to a fraction of the calls, so that an ELSTER outage does not
+    multiply the load. Every call deposits `ratio` tokens up to `max_tokens` and
+    every retry withdraws one token.
+    """
+
+    def __init__(self, ratio, max_tokens):
+        self.ratio = ratio
+        self.max_tokens = max_tokens
+        self.tokens = max_tokens
+        self._lock = threading.Lock()
+
+    def deposit(self):
+        with self._lock:
+            self.tokens = min(self.max_tokens, self.tokens + self.ratio)
+
+    def withdraw(self):
+        """Returns whether a retry is allowed."""
+        with self._lock:
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+
+_RETRY_BUDGET = RetryBudget(app.config['ELSTER_RETRY_BUDGET_RATIO'], app.config['ELSTER_RETRY_BUDGET_MAX'])
+
+
+def backoff_delay(attempt):
+    """Returns the delay before the given retry, exponential in the number of
+    attempts and fully jittered, so that retries of many users spread out."""
+    max_delay = min(app.config['ELSTER_RETRY_MAX_DELAY_SECONDS'],
+                    app.config['ELSTER_RETRY_BASE_DELAY_SECONDS'] * 2 ** attempt)
+    return random.uniform(0, max_delay)
+
+
+def may_retry(attempt):
+    """Returns whether a transient failure after `attempt` retries shall be retried."""
+    if attempt + 1 >= app.config['ELSTER_RETRY_MAX_ATTEMPTS']:
+        return False
+    if not _RETRY_BUDGET.withdraw():
+        metrics.inc('elster_retries_denied')
+        return False
+    return True
+
+
+def record_call():
+    """Is called once per submission (not per retry or validation) and adds to the retry budget."""
+    _RETRY_BUDGET.deposit()
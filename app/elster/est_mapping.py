@@ -80,7 +80,8 @@ _FULL_EURO_FIELDS = {
 
 def _elsterify(key, value):
     if "_religion" in key:
-        return _RELIGION_LOOKUP[value]
+        # Unknown values are passed on and reported by `plausibility._check_religion`
+        return _RELIGION_LOOKUP.get(value, value)
 
     if isinstance(value, str):
         if not value:
@@ -0,0 +1,70 @@
+"""Maps ELSTER field numbers to the form key and the step of the Lotse flow they are
+entered in, so that errors reported for a field (by ERiC or `plausibility`) can link to
+the step that corrects it. The index is built once at startup (see `routes.py`), or on
+the first lookup if the routes are not loaded.
+"""
+from app.elster.est_mapping import _EXTRA_FIELDS, _FORM_STEUERM_TO_FIELDS, _FORM_TO_FIELD
+
+from collections import namedtuple
+
+FieldLocation = namedtuple(
+    'FieldLocation',
+    ['form_key', 'step']
+)
+
+# Maps field numbers that have no 1:1 correspondence in the form to their form key
+_EXTRA_FIELD_KEYS = {
+    _EXTRA_FIELDS['married_since']: 'familienstand_date',
+    _EXTRA_FIELDS['widowed_since']: 'familienstand_date',
+    _EXTRA_FIELDS['divorced_since']: 'familienstand_date',
+    _EXTRA_FIELDS['separated_since']: 'familienstand_date',
+    _EXTRA_FIELDS['zusammen_veranlagung']: 'familienstand',
+}
+
+# ERiC may append the index of repeated fields to the 7 digit field number, e.g. `0107207-2`
+_FIELD_NR_LENGTH = 7
+
+# Maps field numbers to their `FieldLocation`
+_INDEX = {}
+
+
+def _get_field_keys():
+    field_keys = {nr: key for key, nr in _FORM_TO_FIELD.items()}
+    field_keys.update((nr, key) for key, nrs in _FORM_STEUERM_TO_FIELDS.items() for nr in nrs)
+    field_keys.update(_EXTRA_FIELD_KEYS)
+    return field_keys
+
+
+def build(steps):
+    """Builds the index for the given step classes of a flow. A field belongs to the
+    first step whose form has its key."""
+    form_steps = [step for step in steps if hasattr(step, 'Form')]
+
+    index = {}
+    for nr, key in _get_field_keys().items():
+        step = next((step for step in form_steps if hasattr(step.Form, key)), None)
+        if step:
+            index[nr] = FieldLocation(key, step)
+
+    _INDEX.clear()
+    _INDEX.update(index)
+
+
+def lookup(field_id):
+    """Returns the `FieldLocation` of the given field number or `None` if it is unknown."""
+    if not field_id:
+        return None
+    if not _INDEX:
+        from app.forms.lotse.flow_lotse import LotseMultiStepFlow
+        build(LotseMultiStepFlow(None).steps.values())
+    return _INDEX.get(field_id[:_FIELD_NR_LENGTH])
+
+
+def link_errors(errors, url_for_step):
+    """Returns a list of the form `[(error_text, step_url or None), ...]` for errors
+    with a `field_id` and `text`, e.g. `PlausibilityError`s."""
+    links = []
+    for error in errors:
+        location = lookup(error.field_id)
+        links.append((error.text, url_for_step(location.step, _link_overview=True) if location else None))
+    return links
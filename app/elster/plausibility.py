@@ -0,0 +1,114 @@
+"""A fast pre-check of the mapped ELSTER fields (see `est_mapping._check_and_generate_entries`)
+for simple rules ERiC would reject a submission for. The rules are compiled into an
+index by field number once, so a check only runs the rules of the fields present.
+"""
+from app.elster.est_mapping import _EXTRA_FIELDS, _FORM_STEUERM_TO_FIELDS, _FORM_TO_FIELD, _RELIGION_LOOKUP
+
+from collections import namedtuple
+from datetime import datetime
+from flask_babel import lazy_gettext as _l
+
+import re
+
+RuleError = namedtuple(
+    'RuleError',
+    ['field_id', 'text']
+)
+
+# Fields with dates in the format `TT.MM.JJJJ`
+_DATE_FIELDS = (
+    _FORM_TO_FIELD['person_a_dob'],
+    _FORM_TO_FIELD['person_b_dob'],
+    _EXTRA_FIELDS['married_since'],
+    _EXTRA_FIELDS['widowed_since'],
+    _EXTRA_FIELDS['divorced_since'],
+    _EXTRA_FIELDS['separated_since'],
+)
+
+_RELIGION_FIELDS = (
+    _FORM_TO_FIELD['person_a_religion'],
+    _FORM_TO_FIELD['person_b_religion'],
+)
+
+_PLZ_FIELDS = (
+    _FORM_TO_FIELD['person_a_plz'],
+    _FORM_TO_FIELD['person_b_plz'],
+)
+
+# Amounts in full Euros and the maximum ELSTER accepts for them
+_AMOUNT_FIELDS = {
+    field_id: 99999999999
+    for key in ('haushaltsnahe_summe', 'handwerker_summe', 'handwerker_lohn_etc_summe')
+    for field_id in _FORM_STEUERM_TO_FIELDS[key]
+}
+
+# Fields that require further fields, e.g. a joint assessment requires the data of person B
+_REQUIRED_WITH = {
+    _EXTRA_FIELDS['zusammen_veranlagung']: (
+        _FORM_TO_FIELD['person_b_last_name'],
+        _FORM_TO_FIELD['person_b_first_name'],
+        _FORM_TO_FIELD['person_b_dob'],
+        _EXTRA_FIELDS['married_since'],
+    ),
+}
+
+_PLZ_PATTERN = re.compile(r'^[0-9]{5}$')
+_AMOUNT_PATTERN = re.compile(r'^[0-9]+$')
+
+
+def _check_date(field_id, value, fields):
+    try:
+        datetime.strptime(value, '%d.%m.%Y')
+    except ValueError:
+        return [(field_id, _l('form.lotse.rule-date'))]
+    return []
+
+
+def _check_religion(field_id, value, fields):
+    if value not in _RELIGION_LOOKUP.values():
+        return [(field_id, _l('form.lotse.rule-religion'))]
+    return []
+
+
+def _check_plz(field_id, value, fields):
+    if not _PLZ_PATTERN.match(value):
+        return [(field_id, _l('form.lotse.rule-plz'))]
+    return []
+
+
+def _check_amount(field_id, value, fields):
+    if not _AMOUNT_PATTERN.match(value) or int(value) > _AMOUNT_FIELDS[field_id]:
+        return [(field_id, _l('form.lotse.rule-amount'))]
+    return []
+
+
+def _check_required_with(field_id, value, fields):
+    return [(required, _l('form.lotse.rule-required')) for required in _REQUIRED_WITH[field_id]
+            if required not in fields]
+
+
+def _compile_rules():
+    """Returns a dict that maps field numbers to the rules for their values."""
+    rules = {}
+    for field_ids, rule in ((_DATE_FIELDS, _check_date),
+                            (_RELIGION_FIELDS, _check_religion),
+                            (_PLZ_FIELDS, _check_plz),
+                            (_AMOUNT_FIELDS, _check_amount),
+                            (_REQUIRED_WITH, _check_required_with)):
+        for field_id in field_ids:
+            rules.setdefault(field_id, []).append(rule)
+    return rules
+
+
+_RULES = _compile_rules()
+
+
+def check(fields):
+    """Returns the `RuleError`s of the given ELSTER fields, e.g. a missing date of birth
+    of person B for a joint assessment. Their steps are found with `field_index`."""
+    errors = []
+    for field_id, value in fields.items():
+        for rule in _RULES.get(field_id, ()):
+            errors += [RuleError(error_field_id, str(text))
+                       for error_field_id, text in rule(field_id, value, fields)]
+    return errors
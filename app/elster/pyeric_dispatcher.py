@@ -1,15 +1,25 @@
+import fcntl
+import json
+import selectors
 import shutil
+import socket
 import subprocess
 import os
 import time
 
-from app import app
+from app import app, metrics
+from app.elster import elster_xml, xml_schema
+from app.utils import pretty_xml
 from collections import namedtuple
+from pyeric.gateway import GatewayClient
+from pyeric.schema import SchemaError
 from xml.dom.minidom import parseString
 
 _INSTANCES_FOLDER = os.path.join('pyeric', 'instances')
 _BLUEPRINT_FOLDER = os.path.join(_INSTANCES_FOLDER, 'blueprint')
 _SESSION_FOLDER_PREFIX = 'session_'
+_PHASE_PREFIX = b'phase:'
+_SCHEMA_ERRORS_FILE = 'schema_errors.json'
 
 
 def clean_old_folders(lifetime=None):
@@ -35,11 +45,82 @@ PyEricResponse = namedtuple(
 )
 
 
+class EricTimeoutError(Exception):
+    """Raised if the ERiC client exceeded the deadline of its current phase and was killed."""
+
+    def __init__(self, phase):
+        super(EricTimeoutError, self).__init__("ERiC timed out in phase '%s'" % phase)
+        self.phase = phase
+
+
+class EricGatewayError(Exception):
+    """Raised if the ERiC gateway could not be reached or failed to run a job."""
+
+
+class EricSchemaError(Exception):
+    """Raised if the XML with <TransferHeader> does not match the envelope schema."""
+
+    def __init__(self, errors):
+        super(EricSchemaError, self).__init__("XML does not match the envelope schema: %s" % (errors,))
+        self.errors = errors
+
+
+def _count_timeout(phase):
+    metrics.inc('elster_timeouts')
+    metrics.inc('elster_timeouts_' + phase)
+
+
+def _run_eric_client(args):
+    """Runs the ERiC client and watches it. The client announces each phase on stdout
+    and is killed as soon as it exceeds the deadline configured for its current phase
+    (`ELSTER_PHASE_TIMEOUT_SECONDS`). Every call runs in a fresh process, so a killed
+    client is simply replaced by the next call."""
+    deadlines = app.config['ELSTER_PHASE_TIMEOUT_SECONDS']
+    phase, phase_start = 'initialise', time.monotonic()
+
+    def remaining():
+        return deadlines[phase] - (time.monotonic() - phase_start)
+
+    process = subprocess.Popen(args, stdout=subprocess.PIPE)
+    try:
+        # Read the raw pipe, as buffered reads would hide lines from `select`
+        with selectors.DefaultSelector() as selector:
+            selector.register(process.stdout, selectors.EVENT_READ)
+            output = b''
+            while True:
+                if remaining() <= 0 or not selector.select(remaining()):
+                    raise EricTimeoutError(phase)
+                chunk = os.read(process.stdout.fileno(), 4096)
+                if not chunk:
+                    break
+                *lines, output = (output + chunk).split(b'\n')
+                for line in lines:
+                    if line.startswith(_PHASE_PREFIX):
+                        phase, phase_start = line[len(_PHASE_PREFIX):].decode().strip(), time.monotonic()
+
+        try:
+            returncode = process.wait(max(remaining(), 0))
+        except subprocess.TimeoutExpired:
+            raise EricTimeoutError(phase)
+    except EricTimeoutError:
+        process.kill()
+        process.wait()
+        _count_timeout(phase)
+        raise
+    finally:
+        process.stdout.close()
+
+    if returncode:
+        raise subprocess.CalledProcessError(returncode, args)
+
+
 def _get_session_folder(session_id):
     return os.path.abspath(os.path.join(_INSTANCES_FOLDER, _SESSION_FOLDER_PREFIX + session_id))
 
 
-def run_pyeric(input_xml, session_id, cert_pin, verfahren, only_validate=False):
+def run_pyeric(input_xml, session_id, cert_pin, verfahren, only_validate=False, create_th=False):
+    """Runs the ERiC client for the given XML. With `create_th` the client first adds
+    the <TransferHeader>, so that this phase is covered by the watchdog, too."""
     session_folder = _get_session_folder(session_id)
     if not os.path.exists(session_folder):
         os.mkdir(session_folder)
@@ -48,6 +129,16 @@ def run_pyeric(input_xml, session_id, cert_pin, verfahren, only_validate=False):
     with open(os.path.join(session_folder, 'input.xml'), 'w') as f:
         f.write(input_xml)
 
+    if app.config['ELSTER_GATEWAY_ADDRESS']:
+        _run_gateway_job(session_folder, {
+            'op': 'validate' if only_validate else 'send',
+            'xml': input_xml,
+            'verfahren': verfahren,
+            'create_th': create_th,
+            'th_fields': elster_xml._TEST_TH_FIELDS._asdict(),
+        })
+        return PyEricResponse(session_folder)
+
     shutil.copyfile(
         os.path.join(_BLUEPRINT_FOLDER, 'cert.pfx'),
         os.path.join(session_folder, 'cert.pfx'))
@@ -59,13 +150,151 @@ def run_pyeric(input_xml, session_id, cert_pin, verfahren, only_validate=False):
             '--verfahren', verfahren]
     if only_validate:
         args.append('--only-validate')
-    subprocess.check_call(args)
+    if create_th:
+        args.append('--create-th')
+        if xml_schema.schema_folder():
+            args += ['--schema-folder', xml_schema.schema_folder()]
+    try:
+        _run_eric_client(args)
+    except subprocess.CalledProcessError:
+        schema_errors_path = os.path.join(session_folder, _SCHEMA_ERRORS_FILE)
+        if os.path.exists(schema_errors_path):
+            with open(schema_errors_path, 'r') as f:
+                raise EricSchemaError([SchemaError(*error) for error in json.load(f)])
+        raise
 
     return PyEricResponse(session_folder)
 
 
+def run_pyeric_print(session_id, verfahren, footer=None):
+    """Creates the `print.pdf` for a submission that was sent by `run_pyeric` before,
+    unless it exists already. Concurrent calls for the same session only print once."""
+    session_folder = _get_session_folder(session_id)
+    pdf_path = get_pdf_path(session_id)
+
+    with open(os.path.join(session_folder, 'print.lock'), 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        if os.path.exists(pdf_path):
+            return pdf_path
+
+        if app.config['ELSTER_GATEWAY_ADDRESS']:
+            with open(os.path.join(session_folder, 'input.xml'), 'r') as f:
+                input_xml = f.read()
+            _run_gateway_job(session_folder, {
+                'op': 'print',
+                'xml': input_xml,
+                'verfahren': verfahren,
+                'footer': footer,
+            })
+            return pdf_path
+
+        args = ['python3', 'pyeric/eric_client.py',
+                '--work-dir', session_folder,
+                '--verfahren', verfahren,
+                '--print']
+        if footer:
+            args += ['--print-footer', footer]
+        _run_eric_client(args)
+
+    return pdf_path
+
+
+def _run_gateway_job(session_folder, job):
+    """Runs the job on the ERiC gateway and stores its results in the session folder
+    the same way the ERiC client does."""
+    deadlines = app.config['ELSTER_PHASE_TIMEOUT_SECONDS']
+    phases = (['create_th'] if job.get('create_th') else []) + [job['op']]
+    job['deadlines'] = {phase: deadlines[phase] for phase in phases}
+
+    # The gateway enforces the deadlines itself, this only covers an unresponsive gateway
+    client = GatewayClient(app.config['ELSTER_GATEWAY_ADDRESS'], timeout=sum(job['deadlines'].values()) + 5)
+    try:
+        reply, parts = client.request(job)
+    except socket.timeout:
+        _count_timeout(phases[-1])
+        raise EricTimeoutError(phases[-1])
+    except OSError as e:
+        raise EricGatewayError("ERiC gateway not available: %r" % e)
+
+    if reply.get('error') == 'timeout':
+        _count_timeout(reply['phase'])
+        raise EricTimeoutError(reply['phase'])
+    if reply.get('error') == 'schema':
+        _remove_results(session_folder)
+        raise EricSchemaError([SchemaError(*error) for error in reply['schema_errors']])
+    if reply.get('error'):
+        raise EricGatewayError("ERiC gateway failed in phase '%s': %s" % (reply['phase'], reply['error']))
+
+    if job['op'] == 'print':
+        if 'pdf' not in parts:
+            raise EricGatewayError("printing failed with result code %d" % reply['result_code'])
+        tmp_path = os.path.join(session_folder, 'print.pdf.%d' % os.getpid())
+        with open(tmp_path, 'wb') as f:
+            f.write(parts['pdf'])
+        os.replace(tmp_path, os.path.join(session_folder, 'print.pdf'))
+        return
+
+    _remove_results(session_folder)
+    if 'xml' in parts:
+        with open(os.path.join(session_folder, 'input.xml'), 'wb') as f:
+            f.write(parts['xml'])
+    with open(os.path.join(session_folder, 'result_code.txt'), 'w') as f:
+        f.write(str(reply['result_code']))
+    if reply['result_text']:
+        with open(os.path.join(session_folder, 'result_text.txt'), 'w') as f:
+            f.write(reply['result_text'])
+    for name in ('eric_response', 'server_response'):
+        if parts.get(name):
+            with open(os.path.join(session_folder, name + '.xml'), 'w') as f:
+                f.write(pretty_xml(parts[name].decode()))
+
+
+def _remove_results(session_folder):
+    for output_file_name in ('eric_response.xml', 'server_response.xml', 'print.pdf', 'result_code.txt',
+                             'result_text.txt', _SCHEMA_ERRORS_FILE):
+        path = os.path.join(session_folder, output_file_name)
+        if os.path.isfile(path):
+            os.remove(path)
+
+
+def clear_results(session):
+    """Removes the results of earlier ERiC runs for the session, e.g. if the current
+    XML is rejected before it reaches ERiC."""
+    session_folder = _get_session_folder(session)
+    os.makedirs(session_folder, exist_ok=True)
+    _remove_results(session_folder)
+
+
+def get_gateway_status():
+    """Returns the status reply of the ERiC gateway or `None` if it is not reachable."""
+    try:
+        reply, _ = GatewayClient(app.config['ELSTER_GATEWAY_ADDRESS'], timeout=2).request({'op': 'status'})
+    except OSError:
+        return None
+    return reply
+
+
+def is_ready():
+    """Returns whether ERiC runs are served without a warm-up delay. Only the gateway
+    warms up its instances, the ERiC client always starts from scratch."""
+    if not app.config['ELSTER_GATEWAY_ADDRESS']:
+        return True
+    status = get_gateway_status()
+    return bool(status and status['ready'])
+
+
+def get_gateway_metrics():
+    """Returns the metrics of the ERiC gateway's pool, e.g. how many workers it recycled."""
+    if not app.config['ELSTER_GATEWAY_ADDRESS']:
+        return {}
+    status = get_gateway_status()
+    return status['metrics'] if status else {}
+
+
 def was_successful(session):
-    return os.path.exists(get_pdf_path(session))
+    """A submission was successful if ERiC sent it without errors. Validations
+    do not get a server response and thus never count as successful."""
+    return get_result_code(session) == 0 and bool(get_server_response(session))
 
 
 def get_pdf_path(session):
@@ -73,6 +302,84 @@ def get_pdf_path(session):
     return os.path.join(session_folder, 'print.pdf')
 
 
+def save_outcome(session, outcome):
+    """Stores the classified outcome of the last submission for the session."""
+    with open(os.path.join(_get_session_folder(session), 'outcome.txt'), 'w') as f:
+        f.write(outcome)
+
+
+def get_outcome(session):
+    """Returns the outcome stored by `save_outcome` for the session or `None`."""
+    try:
+        with open(os.path.join(_get_session_folder(session), 'outcome.txt'), 'r') as f:
+            return f.read()
+    except Exception:  # intentional generic catch
+        return None
+
+
+def get_result_code(session):
+    """Returns the result code of the last ERiC run for the session or `None`."""
+    session_folder = _get_session_folder(session)
+    try:
+        with open(os.path.join(session_folder, 'result_code.txt'), 'r') as f:
+            return int(f.read())
+    except Exception:  # intentional generic catch
+        return None
+
+
+def get_result_text(session):
+    """Returns the text ERiC provided for a failed run of the session or `None`."""
+    session_folder = _get_session_folder(session)
+    try:
+        with open(os.path.join(session_folder, 'result_text.txt'), 'r') as f:
+            return f.read()
+    except Exception:  # intentional generic catch
+        return None
+
+
+PlausibilityError = namedtuple(
+    'PlausibilityError',
+    ['field_id', 'text']
+)
+
+
+def get_plausibility_errors(eric_response):
+    """Returns the `PlausibilityError`s listed in the given ERiC response."""
+    try:
+        xml = parseString(eric_response)
+    except Exception:  # intentional generic catch
+        return []
+
+    def text_of(element, tag_name):
+        nodes = element.getElementsByTagName(tag_name)
+        return nodes[0].childNodes[0].nodeValue if nodes and nodes[0].childNodes else None
+
+    return [
+        PlausibilityError(text_of(error, 'Feldidentifikator'), text_of(error, 'Text'))
+        for error in xml.documentElement.getElementsByTagName('FehlerRegelpruefung')
+    ]
+
+
+def save_validation_result(session, result):
+    """Stores the given dict as validation result for the session. Other processes
+    only ever see a complete file."""
+    session_folder = _get_session_folder(session)
+    tmp_path = os.path.join(session_folder, 'validation_result.json.%d' % os.getpid())
+    with open(tmp_path, 'w') as f:
+        json.dump(result, f)
+    os.replace(tmp_path, os.path.join(session_folder, 'validation_result.json'))
+
+
+def get_validation_result(session):
+    """Returns the dict stored by `save_validation_result` for the session or `None`."""
+    session_folder = _get_session_folder(session)
+    try:
+        with open(os.path.join(session_folder, 'validation_result.json'), 'r') as f:
+            return json.load(f)
+    except Exception:  # intentional generic catch
+        return None
+
+
 def get_transfer_ticket(server_response):
     try:
         xml = parseString(server_response)
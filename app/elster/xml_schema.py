@@ -0,0 +1,33 @@
+"""Checks the generated XML against the XML schemas of ELSTER before it is handed to
+ERiC, so that structurally broken documents (e.g. from mapping bugs) are caught within
+microseconds instead of a full ERiC run. The check needs `lxml` and the schemas in
+`ELSTER_SCHEMA_FOLDER` (see `pyeric/README.md`) and is skipped without them.
+
+Only the declarations are checked here. The <Elster> envelope is checked by the ERiC
+client or gateway right after ERiC added the <TransferHeader> (see `schema_folder`).
+"""
+from app import app
+from pyeric import schema
+
+import os
+
+SchemaError = schema.SchemaError
+
+
+def is_available():
+    """Returns whether the check runs at all."""
+    return schema.is_available() and app.config['ELSTER_SCHEMA_CHECK']
+
+
+def schema_folder():
+    """Returns the absolute path of the schema folder for the ERiC client, or `None`
+    if the schema check is disabled."""
+    return os.path.abspath(app.config['ELSTER_SCHEMA_FOLDER']) if is_available() else None
+
+
+def check(xml_string, verfahren):
+    """Returns the `SchemaError`s of the declarations in the given XML, which are
+    checked against the schema of `verfahren`."""
+    if not is_available():
+        return []
+    return schema.check_declarations(xml_string, app.config['ELSTER_SCHEMA_FOLDER'], verfahren)
@@ -1,5 +1,6 @@
 from app.forms import SteuerlotseBaseForm
 from app.forms.multistep_flow import MultiStepFlow, FormStep, DisplayStep, RenderInfo
+from app.forms.session_manager import SignedTokenSessionManager
 from app.forms.fields import EuroField, EntriesField
 
 from collections import namedtuple
@@ -87,7 +88,7 @@ class DemoMultiStepFlow(MultiStepFlow):
 
     def __init__(self, endpoint):
         super(DemoMultiStepFlow, self).__init__(
-            title=_('form.demo.title'),
+            title=_l('form.demo.title'),
             steps=[
                 StepHello,
                 StepEuro,
@@ -96,6 +97,8 @@ class DemoMultiStepFlow(MultiStepFlow):
                 StepEnd
             ],
             endpoint=endpoint,
+            # The few answers fit into the URL and do not need server-side storage
+            sessions=SignedTokenSessionManager(),
         )
 
     def debug_data(self):
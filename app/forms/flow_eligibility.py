@@ -1,5 +1,6 @@
 from app.forms import SteuerlotseBaseForm
 from app.forms.multistep_flow import MultiStepFlow, FormStep, DisplayStep, RenderInfo
+from app.forms.session_manager import SignedTokenSessionManager
 from app.forms.fields import YesNoField
 
 from collections import namedtuple
@@ -103,7 +104,7 @@ class EligibilityMultiStepFlow(MultiStepFlow):
 
     def __init__(self, endpoint):
         super(EligibilityMultiStepFlow, self).__init__(
-            title=_('form.eligibility.title'),
+            title=_l('form.eligibility.title'),
             steps=[
                 EligibilityStepStart,
                 EligibilityStepIncomes,
@@ -111,4 +112,6 @@ class EligibilityMultiStepFlow(MultiStepFlow):
                 EligibilityStepSuccess,
             ],
             endpoint=endpoint,
+            # The few answers fit into the URL and do not need server-side storage
+            sessions=SignedTokenSessionManager(),
         )
@@ -4,58 +4,81 @@ from app.forms.lotse.subflow_02_personal_data import *
 from app.forms.lotse.subflow_03_steuerminderungen import *
 from app.forms.lotse.subflow_04_confirmations import *
 
+# after the star imports, which also export the `app` package
+from app import app
+from collections import namedtuple
 from decimal import Decimal
 from flask import render_template
-from flask_babel import _
+from flask_babel import _, get_locale
+from flask_babel import lazy_gettext as _l
 
 import datetime
 
 
+# The summary structure of a section, with its step titles already resolved
+SummarySection = namedtuple(
+    typename='SummarySection',
+    field_names=['step', 'title', 'steps']
+)
+
+_SUMMARY_MODELS = {}
+
+
 class StepSummary(DisplayStep):
     name = 'summary'
 
+    sections = [
+        StepSectionEinwilligung,
+        StepSectionMeineDaten,
+        StepSectionSteuerminderung,
+        StepSectionConfirmation,
+    ]
+    ignore = [
+        StepVorsorge,
+        StepAussergBela,
+        StepHaushaltsnahe,
+        StepHandwerker,
+        StepReligion,
+        StepSpenden,
+    ]
+
     def __init__(self, **kwargs):
         super(StepSummary, self).__init__(
             title=_('form.lotse.summary-title'),
             intro=_('form.lotse.summary-intro'),
             **kwargs,
         )
-        self.flow = LotseMultiStepFlow(None)
-        self.sections = [
-            StepSectionEinwilligung,
-            StepSectionMeineDaten,
-            StepSectionSteuerminderung,
-            StepSectionConfirmation,
-        ]
-        self.ignore = [
-            StepVorsorge,
-            StepAussergBela,
-            StepHaushaltsnahe,
-            StepHandwerker,
-            StepReligion,
-            StepSpenden,
-        ]
 
-    def render(self, data, render_info):
-        # dict of the form `{ section: (section_url, [(step1, url1), ...]), ...}`
-        sections_steps = {}
-        flow = self.flow
+    @classmethod
+    def _get_model(cls):
+        """Returns the list of `SummarySection`s. It only depends on the locale and
+        the steps of the flow and is thus computed once and cached."""
+        flow = _get_summary_flow()
+        key = (str(get_locale()), tuple(flow.steps.keys()))
+
+        model = _SUMMARY_MODELS.get(key)
+        if model is None:
+            model = cls._build_model(flow)
+            _SUMMARY_MODELS[key] = model
+        return model
+
+    @classmethod
+    def _build_model(cls, flow):
+        model = []
         curr_section, curr_section_steps = None, []
 
         for step in flow.steps.values():
-            if step in self.ignore:
+            if step in cls.ignore:
                 continue
 
             # If we hit a section header, save current (if any) and start new section
-            if step in self.sections:
+            if step in cls.sections:
                 if curr_section:
-                    sections_steps[flow._load_step(curr_section.name)] = (
-                        self.url_for_step(curr_section, _link_overview=True),
-                        [
-                            (flow._load_step(s.name), self.url_for_step(s))
-                            for s in curr_section_steps
-                        ]
-                    )
+                    model.append(SummarySection(
+                        step=curr_section,
+                        title=str(flow._load_step(curr_section.name).title),
+                        steps=[(s, str(flow._load_step(s.name).title)) for s in curr_section_steps]
+                    ))
 
                 curr_section = step
                 curr_section_steps = []
@@ -64,8 +87,40 @@ class StepSummary(DisplayStep):
             # Otherwise it's a normal step and we add it to the current section
             curr_section_steps.append(step)
 
+        return model
+
+    def render(self, data, render_info):
+        from app.elster.elster_service import check_plausibility, generate_entries, get_validation_result, \
+            start_speculative_validation
+        from app.elster.field_index import link_errors
+
+        # Simple rules are checked right away. Otherwise, the data is usually complete
+        # here, so ERiC can validate it while the user reviews the summary. `StepSending`
+        # then reuses the result.
+        entries = generate_entries(data)
+        errors = check_plausibility(data, entries=entries)
+        if not errors and app.config['ELSTER_SPECULATIVE_VALIDATION']:
+            start_speculative_validation(data, render_info.session, entries=entries)
+            validation = get_validation_result(data, render_info.session, entries=entries)
+            if validation:
+                errors = validation.errors
+
+        # list of the form `[(error_text, step_url or None), ...]`
+        validation_errors = link_errors(errors, self.url_for_step)
+
+        # list of the form `[(section_title, section_url, [(step_title, step_url), ...]), ...]`
+        sections_steps = [
+            (
+                section.title,
+                self.url_for_step(section.step, _link_overview=True),
+                [(title, self.url_for_step(step)) for step, title in section.steps]
+            )
+            for section in self._get_model()
+        ]
+
         return render_template('lotse/display_summary.html',
-                               render_info=render_info, sections_steps=sections_steps)
+                               render_info=render_info, sections_steps=sections_steps,
+                               validation_errors=validation_errors)
 
 _DEBUG_DATA = (
             StepSummary,
@@ -113,7 +168,7 @@ class LotseMultiStepFlow(MultiStepFlow):
 
     def __init__(self, endpoint):
         super(LotseMultiStepFlow, self).__init__(
-            title=_('form.lotse.title'),
+            title=_l('form.lotse.title'),
             endpoint=endpoint,
             steps=[
                 StepSectionEinwilligung,
@@ -177,3 +232,14 @@ class LotseMultiStepFlow(MultiStepFlow):
 
     def debug_data(self):
         return _DEBUG_DATA
+
+
+_SUMMARY_FLOW = None
+
+
+def _get_summary_flow():
+    global _SUMMARY_FLOW
+
+    if not _SUMMARY_FLOW:
+        _SUMMARY_FLOW = LotseMultiStepFlow(None)
+    return _SUMMARY_FLOW
@@ -36,7 +36,7 @@ class StepSteuernummer(FormStep):
 
     def __init__(self, **kwargs):
         super(StepSteuernummer, self).__init__(
-            title=_l('form.lotse.steuernummer-title'),
+            title=_('form.lotse.steuernummer-title'),
             form=self.Form,
             **kwargs,
             template='form_label.html'
@@ -68,7 +68,7 @@ class StepFamilienstand(FormStep):
 
     def __init__(self, **kwargs):
         super(StepFamilienstand, self).__init__(
-            title=_l('form.lotse.familienstand-title'),
+            title=_('form.lotse.familienstand-title'),
             form=self.Form,
             **kwargs,
             template='lotse/form_familienstand.html'
@@ -184,8 +184,8 @@ class StepIban(FormStep):
 
     def __init__(self, **kwargs):
         super(StepIban, self).__init__(
-            title=_l('form.lotse.iban-title'),
-            intro=_l('form.lotse.iban-intro'),
+            title=_('form.lotse.iban-title'),
+            intro=_('form.lotse.iban-intro'),
             form=self.Form,
             **kwargs,
             template='form_label.html'
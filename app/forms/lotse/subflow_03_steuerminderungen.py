@@ -40,8 +40,8 @@ class StepSteuerminderungYesNo(FormStep):
 
     def __init__(self, **kwargs):
         super(StepSteuerminderungYesNo, self).__init__(
-            title=_l('form.lotse.steuerminderung-title'),
-            intro=_l('form.lotse.steuerminderung-intro'),
+            title=_('form.lotse.steuerminderung-title'),
+            intro=_('form.lotse.steuerminderung-intro'),
             form=self.Form,
             template='lotse/form_steuerminderung_yesno.html',
             **kwargs,
@@ -85,13 +85,14 @@ class StepVorsorge(FormStep):
             template='lotse/form_aufwendungen_with_list.html',
             **kwargs,
         )
-
-    def render(self, form, data, render_info):
-        return render_template(self.template, form=form, render_info=render_info, list_items=[
+        self.list_items = [
             _('form.lotse.vorsorge-list-item-1'),
             _('form.lotse.vorsorge-list-item-2'),
             _('form.lotse.vorsorge-list-item-3'),
-        ])
+        ]
+
+    def render(self, form, data, render_info):
+        return render_template(self.template, form=form, render_info=render_info, list_items=self.list_items)
 
 
 class StepAussergBela(FormStep):
@@ -143,14 +144,15 @@ class StepHaushaltsnahe(FormStep):
             template='lotse/form_aufwendungen_with_list.html',
             **kwargs,
         )
-
-    def render(self, form, data, render_info):
-        return render_template(self.template, form=form, render_info=render_info, list_items=[
+        self.list_items = [
             _('form.lotse.haushaltsnahe-list-item-1'),
             _('form.lotse.haushaltsnahe-list-item-2'),
             _('form.lotse.haushaltsnahe-list-item-3'),
             _('form.lotse.haushaltsnahe-list-item-4'),
-        ])
+        ]
+
+    def render(self, form, data, render_info):
+        return render_template(self.template, form=form, render_info=render_info, list_items=self.list_items)
 
 
 class StepHandwerker(FormStep):
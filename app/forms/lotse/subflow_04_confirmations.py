@@ -1,4 +1,6 @@
 from flask.globals import session
+from app import app
+from app.elster.admission import SubmissionRejected
 from app.forms import SteuerlotseBaseForm
 from app.forms.multistep_flow import FormStep, DisplayStep, FlowNavItem, SectionHeaderWithList
 from app.forms.fields import ConfirmationField
@@ -50,11 +52,27 @@ class StepSending(DisplayStep):
 
     def render(self, data, render_info):
         try:
-            from app.elster.elster_service import send_with_elster
-            send_with_elster(data, render_info.session)
+            from app.elster.elster_service import check_plausibility, generate_entries, get_validation_result, \
+                send_with_elster
+
+            # Sending unchanged data that already failed the checks on the summary
+            # would only fail again, so the user is sent back to the errors instead.
+            entries = generate_entries(data)
+            failed = bool(check_plausibility(data, entries=entries))
+            if not failed:
+                validation = get_validation_result(
+                    data, render_info.session, timeout=app.config['ELSTER_VALIDATION_WAIT_SECONDS'], entries=entries)
+                failed = bool(validation and validation.errors)
+            if failed:
+                from app.forms.lotse.flow_lotse import StepSummary
+                return redirect(self.url_for_step(StepSummary))
+
+            send_with_elster(data, render_info.session, entries=entries)
+        except SubmissionRejected:
+            raise  # answered with 503 and `Retry-After`
         except Exception:
-            # we ignore it here and let the next page handle this
-            pass
+            # the next page shows the failure
+            app.logger.warning("sending failed", exc_info=True)
 
         return redirect(render_info.next_url)
 
@@ -66,16 +84,26 @@ class StepAck(DisplayStep):
         super(StepAck, self).__init__(title=_('form.lotse.ack-title'), **kwargs)
 
     def render(self, data, render_info):
-        from app.elster.pyeric_dispatcher import was_successful, get_transfer_ticket, get_eric_response, get_server_response
+        from app.elster.elster_service import OUTCOME_PLAUSIBILITY_ERROR
+        from app.elster.field_index import link_errors
+        from app.elster.pyeric_dispatcher import was_successful, get_outcome, get_result_text, get_transfer_ticket, \
+            get_eric_response, get_server_response, get_plausibility_errors
 
         eric_data = {}
         eric_data['was_successful'] = was_successful(render_info.session)
+        eric_data['outcome'] = get_outcome(render_info.session)
+        eric_data['result_text'] = get_result_text(render_info.session)
         eric_data['pdf_link'] = url_for('download_pdf', session=render_info.session)
         eric_data['eric_response'] = get_eric_response(render_info.session)
         eric_data['server_response'] = get_server_response(render_info.session)
 
         eric_data['transfer_ticket'] = get_transfer_ticket(eric_data['server_response'])
 
+        # list of the form `[(error_text, step_url or None), ...]`
+        eric_data['errors'] = []
+        if eric_data['outcome'] == OUTCOME_PLAUSIBILITY_ERROR:
+            eric_data['errors'] = link_errors(get_plausibility_errors(eric_data['eric_response']), self.url_for_step)
+
         return render_template('lotse/display_ack.html', render_info=render_info, eric_data=eric_data)
 
 
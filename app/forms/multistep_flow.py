@@ -1,8 +1,11 @@
 from collections import namedtuple
-from flask import redirect, request, render_template, url_for
+from flask import abort, jsonify, redirect, request, render_template, url_for
+from flask_babel import get_locale
 
-from app.forms.session_manager import InMemorySessionManager, MongoDbSessionManager
-from app import app
+from app.content.render_cache import render_cached
+from app.forms.session_manager import get_session_manager
+
+import copy
 
 # The RenderInfo is provided to all templates
 RenderInfo = namedtuple(
@@ -27,12 +30,15 @@ class MultiStepFlow(object):
     in the browser. The current state is maintained via a `SessionManager`.
     """
 
-    def __init__(self, title, steps, endpoint, overview_step=None):
+    def __init__(self, title, steps, endpoint, overview_step=None, sessions=None):
         """Creates a new MultistepFlow for the given configuration.
 
         The steps are a list of `FormStep` subclasses.
         This allows to initialise only the steps necessary and to use the
         the declared ordering for initializing `prev_step` and `next_step`.
+
+        Flows hold no per-request state and are meant to be created once per
+        process. The `prev_step` and `next_step` links are thus computed here.
         """
         self.title = title
         self.steps = {s.name: s for s in steps}
@@ -41,20 +47,32 @@ class MultiStepFlow(object):
 
         self.endpoint = endpoint
 
-        if app.env == 'production':
-            self.sessions = MongoDbSessionManager()
-        else:
-            self.sessions = InMemorySessionManager()
+        # By default set `prev_step` and `next_step` in order of definition
+        self._step_links = {
+            step.name: (
+                steps[idx - 1] if idx > 0 else '',
+                steps[idx + 1] if idx < len(steps) - 1 else '',
+            )
+            for idx, step in enumerate(steps)
+        }
 
-    def _load_step(self, step_name):
-        step_names, step_types = list(self.steps.keys()), list(self.steps.values())
-        idx = step_names.index(step_name)
+        self.sessions = sessions or get_session_manager()
 
-        # By default set `prev_step` and `next_step` in order of definition
-        return self.steps[step_name](
-            prev_step=step_types[idx - 1] if idx > 0 else '',
-            next_step=step_types[idx + 1] if idx < len(step_types) - 1 else ''
-        )
+        # Maps `(locale, step_name)` to an already constructed step
+        self._step_prototypes = {}
+
+    def _load_step(self, step_name):
+        """Returns a new instance of the step with the given name. Steps resolve their
+        texts through `gettext` when being constructed, which only depends on the
+        locale. Hence, each step is only constructed once per locale and copied afterwards.
+        """
+        key = (str(get_locale()), step_name)
+        prototype = self._step_prototypes.get(key)
+        if prototype is None:
+            prev_step, next_step = self._step_links[step_name]
+            prototype = self.steps[step_name](prev_step=prev_step, next_step=next_step)
+            self._step_prototypes[key] = prototype
+        return copy.copy(prototype)
 
     def _get_flow_nav(self, active_step):
         """Implementer can override this function to show a navigation on top of the
@@ -62,29 +80,38 @@ class MultiStepFlow(object):
         return None
 
     def handle(self, step_name):
-        session = request.args.get('session')
+        session_id = request.args.get('session')
         link_overview = request.args.get('link_overview', False) == 'True'
 
-        def url_for_step(step, _session=session, _link_overview=link_overview):
+        def url_for_step(step, _session=session_id, _link_overview=link_overview):
             """Generate URL for given step and current session."""
 
             # show overview buttons if explicitely requested or if shown for current request
             return url_for(self.endpoint, step=step.name, session=_session, link_overview=_link_overview)
 
-        if step_name == 'start' or not self.sessions.has_session(session):
+        # The session is loaded exactly once per request and only written back
+        # if anything changed while handling the step.
+        session = self.sessions.load(session_id) if step_name != 'start' else None
+
+        if session is None:
 
             # Implementers can override `debug_data` to return a `step_name`
             # and `form_data` to use while testing
             dbg = self.debug_data()
             if dbg:
-                session, data = self.sessions.get_or_create(None, dbg[1])
-                return redirect(url_for_step(dbg[0], _session=session))
+                session = self.sessions.create(dbg[1])
+                return redirect(url_for_step(dbg[0], _session=session.identifier))
             else:
-                session, data = self.sessions.get_or_create(None)
-                return redirect(url_for_step(step=self.first_step, _session=session))
+                session = self.sessions.create()
+                return redirect(url_for_step(step=self.first_step, _session=session.identifier))
+
+        response = self._handle_step(step_name, session, url_for_step, link_overview)
+        session.commit()
+        return response
 
+    def _handle_step(self, step_name, session, url_for_step, link_overview):
         step = self._load_step(step_name)
-        _, data = self.sessions.get_or_create(session)
+        data = session.data
 
         prev_step = step.prev_step(data)
 
@@ -101,7 +128,7 @@ class MultiStepFlow(object):
             next_url=url_for_step(display_next_step) if display_next_step else None,
             submit_url=url_for_step(step),
             flow_nav=self._get_flow_nav(step),
-            session=session,
+            session=session.identifier,
             overview_url=url_for_step(self.overview_step) if link_overview and self.overview_step else None,
         )
 
@@ -113,16 +140,37 @@ class MultiStepFlow(object):
             form = step.create_form(data, request)
             if request.method == 'POST' and form.validate():
 
-                # Merge new form data with existing data
-                merged_data = data
-                merged_data.update(form.data)
-                self.sessions.update(session, merged_data)
+                # Merge new form data with existing data. As the identifier
+                # might change when writing, commit before building the URL.
+                session.update(form.data)
+                session.commit()
 
                 next_step = step.next_step(data)
-                return redirect(url_for_step(next_step))
+                return redirect(url_for_step(next_step, _session=session.identifier))
 
             return step.render(form, data, render_info)
 
+    def validate(self, step_name):
+        """Validates the submitted fields of a form step and returns their errors
+        as JSON, without storing anything. Fields that were not submitted are taken
+        from the session, so that validators depending on other fields still work.
+        Only errors of submitted fields are returned.
+        """
+        if step_name not in self.steps:
+            abort(404)
+        step = self._load_step(step_name)
+        if not isinstance(step, FormStep):
+            abort(404)
+
+        session = self.sessions.load(request.args.get('session'))
+        form = step.create_form(session.data if session else {}, request)
+        valid = form.validate()
+
+        errors = {name: [str(error) for error in field_errors]
+                  for name, field_errors in form.errors.items()
+                  if name in request.form}
+        return jsonify(valid=valid, errors=errors)
+
     def debug_data(self):
         return None
 
@@ -204,7 +252,10 @@ class SectionHeaderWithList(DisplayStep):
         self.list_items = list_items
 
     def render(self, data, render_info):
-        return render_template(
+        # The output only depends on the step, the overview link and the session
+        # which is substituted into the cached page.
+        return render_cached(
             'lotse/section_header_with_list.html',
-            render_info=render_info,
-            list_items=self.list_items)
+            context_factory=lambda: dict(render_info=render_info, list_items=self.list_items),
+            substitutions={'session': render_info.session},
+            key_extra=render_info.overview_url is not None)
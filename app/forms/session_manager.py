@@ -1,55 +1,124 @@
-from app import app
+from app import app, metrics
 from app.utils import gen_random_key
-from cachetools import TTLCache
-from datetime import date, datetime
+from cachetools import LRUCache, TTLCache
+from datetime import date, datetime, timedelta
 from decimal import Decimal
+from itsdangerous import BadSignature, URLSafeTimedSerializer
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError
 
 import decimal
 import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+
+_MAX_CREATE_ATTEMPTS = 3
+
+
+class SessionKeyCollision(KeyError):
+    """Raised when a newly generated session identifier is already in use."""
+    pass
 
 
 class SessionManager(object):
     """The SessionManager allows to keep a form state for a given identifier. It
     uses the TLL value to remove old entries (usually 10 min). This here
-    is an abstract class. The application either uses `InMemorySessionManager`
-    or the `MongoDbSessionManager`.
+    is an abstract class. `get_session_manager` selects the implementation used
+    by default, flows can also choose their own.
     """
 
+    def load(self, identifier):
+        """Returns a request-scoped `Session` for the given `identifier` or `None`
+        if there is no such entry. This is a single lookup in the store, which
+        also resets the TTL countdown.
+        """
+        if not identifier:
+            return None
+
+        data = self._load_data(identifier)
+        if data == None:
+            return None
+        return Session(self, identifier, data)
+
+    def create(self, default_data={}):
+        """Creates a new entry with a copy of `default_data` and returns it as `Session`."""
+        identifier, data = self._create(dict(default_data))
+        return Session(self, identifier, data)
+
     def get_or_create(self, identifier, default_data={}):
         """Returns the data associated with the `identifier`. If the
         identifier is unknown, a new entry will be created with the
         given `default_data` and returned. In each case the TTL countdown
         will be reset.
         """
-        if identifier:
-            json = self._load_session(identifier)
-            if json != None:
-                return identifier, self._from_json(json)
-
-        # If no identifier provided or no entry
-        # -> create new one with empty data
-        identifier = gen_random_key()
-        if self._has_session(identifier):
-            # TODO handle properly
-            raise KeyError("key collision")
-
-        data = default_data
-        json = self._to_json(data)
-        self._save_session(identifier, json)
+        session = self.load(identifier) or self.create(default_data)
+        return session.identifier, session.data
+
+    def _create(self, data):
+        """Inserts the data under a new random key. Instead of looking up the key
+        beforehand, this relies on the store rejecting duplicate keys and retries."""
+        for _ in range(_MAX_CREATE_ATTEMPTS):
+            identifier = gen_random_key()
+            try:
+                self._insert_data(identifier, data)
+                return identifier, data
+            except SessionKeyCollision:
+                metrics.inc('session_key_collisions')
+
+        raise SessionKeyCollision("key collision")
+
+    def update(self, identifier, data, changed_keys=None):
+        """Updates the data for the given identifier and returns the identifier
+        under which the data can be loaded from now on. If `changed_keys` are
+        given, stores may only write these keys. Keys that are missing in `data`
+        are removed."""
+        if changed_keys is None:
+            written = self._save_data(identifier, data)
+        else:
+            written = self._patch_data(identifier, data, changed_keys)
+
+        metrics.inc('session_bytes_written', written)
+        app.logger.debug("session update: %d bytes written", written)
+        return identifier
+
+    def has_session(self, identifier):
+        return self._has_session(identifier)
+
+    def clean_expired(self):
+        """Removes expired entries. Only needed for stores that do not expire entries by themselves."""
+        pass
 
-        return identifier, data
+    def _load_data(self, identifier):
+        json = self._load_session(identifier)
+        if json == None:
+            return None
+        return self._from_json(json)
 
-    def update(self, identifier, data):
-        """Updates the data for the given identifier."""
+    def _save_data(self, identifier, data):
+        """Saves the full data and returns the number of bytes written."""
         json = self._to_json(data)
         self._save_session(identifier, json)
+        return len(json)
 
-    def has_session(self, identifier):
-        return self._has_session(identifier)
+    def _patch_data(self, identifier, data, changed_keys):
+        """Saves the `changed_keys` of `data` and returns the number of bytes written.
+        By default, this writes the full data."""
+        return self._save_data(identifier, data)
+
+    def _insert_data(self, identifier, data):
+        self._insert_session(identifier, self._to_json(data))
 
     def _load_session(self, identifier):
         raise NotImplementedError()
 
+    def _insert_session(self, identifier, json):
+        """Saves a new entry and raises `SessionKeyCollision` if the identifier already exists."""
+        raise NotImplementedError()
+
     def _save_session(self, identifier, json):
         raise NotImplementedError()
 
@@ -65,6 +134,38 @@ class SessionManager(object):
         return json.loads(j, cls=_JsonDecoder)
 
 
+class Session(object):
+    """A request-scoped view on the data of one entry of a `SessionManager`. The
+    data is loaded once and changes are only tracked in memory. Calling `commit`
+    writes them back to the store, but only if anything has actually changed.
+    """
+
+    def __init__(self, manager, identifier, data):
+        self.manager = manager
+        self.identifier = identifier
+        self.data = data
+        self.changed_keys = set()
+
+    @property
+    def is_dirty(self):
+        return len(self.changed_keys) > 0
+
+    def update(self, new_data):
+        """Merges `new_data` into the session data and marks the keys whose value differs."""
+        for key, value in new_data.items():
+            if key not in self.data or self.data[key] != value:
+                self.data[key] = value
+                self.changed_keys.add(key)
+
+    def commit(self):
+        """Writes the data back to the store if there are any changes. Afterwards
+        `identifier` might have changed, e.g. for the `SignedTokenSessionManager`."""
+        if not self.is_dirty:
+            return
+        self.identifier = self.manager.update(self.identifier, self.data, self.changed_keys)
+        self.changed_keys = set()
+
+
 class _JsonEncoder(json.JSONEncoder):
     """JsonEncoder allowing serialising `Decimal` and `datetime.date` objects."""
 
@@ -100,26 +201,62 @@ class _JsonDecoder(json.JSONDecoder):
             return decimal.Decimal(obj['v'])
 
 
+class _SizedTTLCache(TTLCache):
+    """A `TTLCache` that counts the entries it has to evict because of its size limit."""
+
+    def popitem(self):
+        item = super(_SizedTTLCache, self).popitem()
+        metrics.inc('session_memory_evictions')
+        return item
+
+
 _GLOBAL_CACHE = None
 
 
 class InMemorySessionManager(SessionManager):
     """An in-memory session manager implementation that uses a simple `TTLCache`.
     It will not work in production, as `gunicorn` spawns separate processes that
-    do not share the same memory."""
+    do not share the same memory.
+
+    The cache is limited by `SESSION_MEMORY_MAX_BYTES`, where each entry counts
+    with the size of its encoded data. With `SESSION_MEMORY_COMPRESS` the data
+    is stored zlib-compressed."""
 
     def __init__(self):
         global _GLOBAL_CACHE
 
         if not _GLOBAL_CACHE:
-            _GLOBAL_CACHE = TTLCache(maxsize=100_000, ttl=app.config['SESSION_TTL_SECONDS'])
+            _GLOBAL_CACHE = _SizedTTLCache(
+                maxsize=app.config['SESSION_MEMORY_MAX_BYTES'],
+                ttl=app.config['SESSION_TTL_SECONDS'],
+                getsizeof=len)
         self.cache = _GLOBAL_CACHE
+        self.compress = app.config['SESSION_MEMORY_COMPRESS']
 
     def _load_session(self, identifier):
-        return self.cache.get(identifier)
+        encoded = self.cache.get(identifier)
+        if encoded is None:
+            metrics.inc('session_memory_misses')
+            return None
+
+        metrics.inc('session_memory_hits')
+        if self.compress:
+            encoded = zlib.decompress(encoded)
+        return encoded.decode('utf-8')
 
     def _save_session(self, identifier, json):
-        self.cache[identifier] = json
+        encoded = json.encode('utf-8')
+        if self.compress:
+            encoded = zlib.compress(encoded)
+        self.cache[identifier] = encoded
+
+        metrics.set_gauge('session_memory_bytes', self.cache.currsize)
+        metrics.set_gauge('session_memory_entries', len(self.cache))
+
+    def _insert_session(self, identifier, json):
+        if identifier in self.cache:
+            raise SessionKeyCollision(identifier)
+        self._save_session(identifier, json)
 
     def _has_session(self, identifier):
         return identifier in self.cache
@@ -128,42 +265,360 @@ class InMemorySessionManager(SessionManager):
 class MongoDbSessionManager(SessionManager):
     """A session manager implementation that uses MongoDB. The expiration of items
     is ensured through an index with the `expireAfterSeconds` property.
+
+    Decoded sessions are additionally kept in a per-worker LRU cache with a hard
+    limit in bytes. Every document carries a `version` that is incremented on each
+    write. A cached entry is only used if a cheap projection query confirms that
+    its version is still current, which skips both the transfer of the document
+    and the decoding of its JSON.
+
+    Each value is stored as separate JSON in the `fields` sub-document, so that
+    updates only need to `$set` and `$unset` the keys that have changed.
     """
 
-    def __init__(self):
+    def __init__(self, cache_max_bytes=None):
         from app import mongo
-        self._ensure_database(mongo)
         self.collection = mongo.db.sessions
 
-    def _ensure_database(self, mongo):
+        if cache_max_bytes is None:
+            cache_max_bytes = app.config['SESSION_CACHE_MAX_BYTES']
+        # Maps the identifier to a tuple `(version, data, size)`
+        self.cache = LRUCache(maxsize=cache_max_bytes, getsizeof=lambda entry: entry[2])
+        self._cache_lock = threading.Lock()
+
+        # Reading a session only refreshes its TTL if the stored timestamp is older
+        # than the given fraction of the TTL. These refreshes are collected and
+        # written in one `bulk_write` per flush interval.
+        self.ttl_refresh_age = timedelta(
+            seconds=app.config['SESSION_TTL_SECONDS'] * app.config['SESSION_TTL_REFRESH_FRACTION'])
+        self.ttl_flush_interval = app.config['SESSION_TTL_FLUSH_INTERVAL_SECONDS']
+        self.ttl_flush_batch_size = app.config['SESSION_TTL_FLUSH_BATCH_SIZE']
+        self._pending_refreshes = {}
+        self._pending_lock = threading.Lock()
+
+    @staticmethod
+    def ensure_database():
+        """Creates the TTL index. This is called once on startup, not per request."""
+        from app import mongo
         mongo.db.sessions.create_index("last_update", expireAfterSeconds=app.config['SESSION_TTL_SECONDS'])
 
-    def _load_session(self, identifier):
+    def _load_data(self, identifier):
+        with self._cache_lock:
+            cached = self.cache.get(identifier)
+
+        if cached:
+            res = self.collection.find_one({'_id': identifier}, {'version': 1, 'last_update': 1})
+            if res and res.get('version') == cached[0]:
+                metrics.inc('session_cache_hits')
+                self._refresh_ttl(identifier, res['last_update'])
+                return dict(cached[1])
+
+            metrics.inc('session_cache_stale')
+            self._evict(identifier)
+            if not res:
+                return None
+        else:
+            metrics.inc('session_cache_misses')
+
         res = self.collection.find_one({'_id': identifier})
-        if not res:
+        if not res or 'fields' not in res:
+            # Entries written before values were stored per field are treated as expired
             return None
 
-        self.collection.update_one(
-            {'_id': identifier},
-            {"$set": {'last_update': datetime.utcnow()}
-             })
-        return res['json']
+        self._refresh_ttl(identifier, res['last_update'])
+        fields = res['fields']
+        data = {key: self._from_json(value) for key, value in fields.items()}
+        self._remember(identifier, res.get('version'), data, self._size(fields))
+        return data
 
-    def _save_session(self, identifier, json):
-        if self._has_session(identifier):
-            self.collection.update_one(
-                {'_id': identifier},
-                {"$set": {
-                    'json': json,
+    def _encode_fields(self, data, keys):
+        return {key: self._to_json(data[key]) for key in keys}
+
+    def _size(self, fields):
+        return sum(len(key) + len(value) for key, value in fields.items())
+
+    def _save_data(self, identifier, data):
+        fields = self._encode_fields(data, data.keys())
+        res = self.collection.find_one_and_update(
+            {'_id': identifier},
+            {
+                "$set": {
+                    'fields': fields,
                     'last_update': datetime.utcnow()
-                }}
-            )
+                },
+                "$inc": {'version': 1},
+            },
+            projection={'version': 1},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        size = self._size(fields)
+        self._remember(identifier, res['version'], data, size)
+        return size
+
+    def _patch_data(self, identifier, data, changed_keys):
+        fields = self._encode_fields(data, [key for key in changed_keys if key in data])
+        update = {
+            "$set": dict(
+                {'fields.' + key: value for key, value in fields.items()},
+                last_update=datetime.utcnow()),
+            "$inc": {'version': 1},
+        }
+        removed_keys = [key for key in changed_keys if key not in data]
+        if removed_keys:
+            update["$unset"] = {'fields.' + key: '' for key in removed_keys}
+
+        res = self.collection.find_one_and_update(
+            {'_id': identifier}, update,
+            projection={'version': 1},
+            return_document=ReturnDocument.AFTER,
+        )
+        if not res:
+            # The entry has expired in the meantime and the patch would be incomplete
+            return self._save_data(identifier, data)
+
+        size = self._size(fields)
+        with self._cache_lock:
+            cached = self.cache.get(identifier)
+        if cached and res['version'] == cached[0] + 1:
+            # Over-estimates the size, which only makes the cache limit stricter
+            self._remember(identifier, res['version'], data, cached[2] + size)
         else:
+            # Another worker might have patched other keys since the cached version
+            self._evict(identifier)
+        return size
+
+    def _insert_data(self, identifier, data):
+        fields = self._encode_fields(data, data.keys())
+        try:
             self.collection.insert_one({
                 '_id': identifier,
-                'json': json,
+                'fields': fields,
+                'version': 1,
                 'last_update': datetime.utcnow()
             })
+        except DuplicateKeyError:
+            raise SessionKeyCollision(identifier)
+        self._remember(identifier, 1, data, self._size(fields))
+
+    def _refresh_ttl(self, identifier, last_update):
+        now = datetime.utcnow()
+        if now - last_update < self.ttl_refresh_age:
+            metrics.inc('session_ttl_refreshes_skipped')
+            return
+
+        with self._pending_lock:
+            if not self._pending_refreshes:
+                # Make sure that the refreshes are written even if no further request arrives
+                timer = threading.Timer(self.ttl_flush_interval, self.flush_ttl_refreshes)
+                timer.daemon = True
+                timer.start()
+            self._pending_refreshes[identifier] = now
+            flush_now = len(self._pending_refreshes) >= self.ttl_flush_batch_size
+
+        if flush_now:
+            self.flush_ttl_refreshes()
+
+    def flush_ttl_refreshes(self):
+        """Writes all pending TTL refreshes in one `bulk_write`."""
+        with self._pending_lock:
+            pending, self._pending_refreshes = self._pending_refreshes, {}
+        if not pending:
+            return
+
+        self.collection.bulk_write([
+            UpdateOne({'_id': identifier}, {"$max": {'last_update': last_update}})
+            for identifier, last_update in pending.items()
+        ], ordered=False)
+        metrics.inc('session_ttl_refreshes_flushed', len(pending))
+
+    def _remember(self, identifier, version, data, size):
+        with self._cache_lock:
+            if size <= self.cache.maxsize:
+                self.cache[identifier] = (version, dict(data), size)
+            metrics.set_gauge('session_cache_bytes', self.cache.currsize)
+
+    def _evict(self, identifier):
+        with self._cache_lock:
+            self.cache.pop(identifier, None)
+            metrics.set_gauge('session_cache_bytes', self.cache.currsize)
 
     def _has_session(self, identifier):
         return self.collection.count_documents({'_id': identifier}) > 0
+
+
+class SqliteSessionManager(SessionManager):
+    """A session manager implementation that uses a SQLite database in WAL mode.
+    Unlike the `InMemorySessionManager` it is shared by all `gunicorn` workers on
+    the same host without requiring a MongoDB. Expired entries are ignored on
+    access and removed by `clean_expired`.
+    """
+
+    def __init__(self, path=None, ttl=None):
+        self.path = path or app.config['SESSION_SQLITE_PATH']
+        self.ttl = ttl if ttl is not None else app.config['SESSION_TTL_SECONDS']
+        self._local = threading.local()
+
+    def ensure_database(self):
+        """Creates the table and switches to WAL mode. This is called once on startup."""
+        connection = self._connection()
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute(
+            'CREATE TABLE IF NOT EXISTS sessions ('
+            'id TEXT PRIMARY KEY, json TEXT NOT NULL, last_update REAL NOT NULL)')
+        connection.execute('CREATE INDEX IF NOT EXISTS sessions_last_update ON sessions (last_update)')
+
+    def _connection(self):
+        # Connections must neither be shared between threads nor survive a fork
+        connection, pid = getattr(self._local, 'connection', (None, None))
+        if connection is None or pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection = (connection, os.getpid())
+        return connection
+
+    def _cut_off_time(self):
+        return time.time() - self.ttl
+
+    def _load_session(self, identifier):
+        connection = self._connection()
+        row = connection.execute(
+            'SELECT json, last_update FROM sessions WHERE id = ? AND last_update >= ?',
+            (identifier, self._cut_off_time())).fetchone()
+        if not row:
+            return None
+
+        # Only refresh the TTL if the stored timestamp is old enough
+        now = time.time()
+        if now - row[1] >= self.ttl * app.config['SESSION_TTL_REFRESH_FRACTION']:
+            connection.execute('UPDATE sessions SET last_update = ? WHERE id = ?', (now, identifier))
+        return row[0]
+
+    def _save_session(self, identifier, json):
+        self._connection().execute(
+            'INSERT OR REPLACE INTO sessions (id, json, last_update) VALUES (?, ?, ?)',
+            (identifier, json, time.time()))
+
+    def _patch_data(self, identifier, data, changed_keys):
+        # Apply the changed keys to the stored data within one transaction, so
+        # that concurrent updates of other keys are not lost.
+        connection = self._connection()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            row = connection.execute('SELECT json FROM sessions WHERE id = ?', (identifier,)).fetchone()
+            stored = self._from_json(row[0]) if row else dict(data)
+            for key in changed_keys:
+                if key in data:
+                    stored[key] = data[key]
+                else:
+                    stored.pop(key, None)
+
+            json = self._to_json(stored)
+            connection.execute(
+                'INSERT OR REPLACE INTO sessions (id, json, last_update) VALUES (?, ?, ?)',
+                (identifier, json, time.time()))
+            connection.execute('COMMIT')
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+        return len(json)
+
+    def _insert_session(self, identifier, json):
+        try:
+            self._connection().execute(
+                'INSERT INTO sessions (id, json, last_update) VALUES (?, ?, ?)',
+                (identifier, json, time.time()))
+        except sqlite3.IntegrityError:
+            raise SessionKeyCollision(identifier)
+
+    def _has_session(self, identifier):
+        row = self._connection().execute(
+            'SELECT 1 FROM sessions WHERE id = ? AND last_update >= ?',
+            (identifier, self._cut_off_time())).fetchone()
+        return row is not None
+
+    def clean_expired(self):
+        self._connection().execute('DELETE FROM sessions WHERE last_update < ?', (self._cut_off_time(),))
+
+
+class _TokenSerializer(object):
+    """Allows `itsdangerous` to (de)serialise session data including `Decimal` and `datetime.date`."""
+
+    @staticmethod
+    def dumps(obj):
+        return json.dumps(obj, cls=_JsonEncoder, separators=(',', ':'))
+
+    @staticmethod
+    def loads(s):
+        return json.loads(s, cls=_JsonDecoder)
+
+
+class SignedTokenSessionManager(SessionManager):
+    """A session manager implementation that does not store anything on the server.
+    Instead, the whole data is kept in a signed (and if worthwhile compressed) token
+    that is used as identifier and thus passed along in the `session` URL parameter.
+    Consequently, the identifier changes with every update.
+
+    This is only meant for flows with little and non-personal data, as the token
+    is signed but not encrypted. Tokens expire `SESSION_TTL_SECONDS` after they
+    have been issued, i.e. after the last update.
+    """
+
+    def __init__(self, secret_key=None, ttl=None):
+        self.ttl = ttl if ttl is not None else app.config['SESSION_TTL_SECONDS']
+        self.serializer = URLSafeTimedSerializer(
+            secret_key or app.config['SECRET_KEY'],
+            salt='steuerlotse-session',
+            serializer=_TokenSerializer)
+
+    def load(self, identifier):
+        if not identifier:
+            return None
+
+        try:
+            data = self.serializer.loads(identifier, max_age=self.ttl)
+        except BadSignature:  # includes expired tokens
+            return None
+        return Session(self, identifier, data)
+
+    def _create(self, data):
+        return self.serializer.dumps(data), data
+
+    def update(self, identifier, data, changed_keys=None):
+        return self.serializer.dumps(data)
+
+    def _has_session(self, identifier):
+        return self.load(identifier) is not None
+
+
+_DEFAULT_SESSION_MANAGER = None
+
+
+def get_session_manager():
+    """Returns the process-wide default session manager. It is chosen through
+    `SESSION_BACKEND` and if that is not set, depending on the environment."""
+    global _DEFAULT_SESSION_MANAGER
+
+    if not _DEFAULT_SESSION_MANAGER:
+        backend = app.config['SESSION_BACKEND']
+        if not backend:
+            backend = 'mongodb' if app.env == 'production' else 'memory'
+
+        if backend == 'mongodb':
+            _DEFAULT_SESSION_MANAGER = MongoDbSessionManager()
+        elif backend == 'sqlite':
+            _DEFAULT_SESSION_MANAGER = SqliteSessionManager()
+        elif backend == 'memory':
+            _DEFAULT_SESSION_MANAGER = InMemorySessionManager()
+        else:
+            raise ValueError("unknown session backend: %s" % backend)
+    return _DEFAULT_SESSION_MANAGER
+
+
+@app.before_first_request
+def _ensure_session_database():
+    sessions = get_session_manager()
+    if isinstance(sessions, MongoDbSessionManager):
+        MongoDbSessionManager.ensure_database()
+    elif isinstance(sessions, SqliteSessionManager):
+        sessions.ensure_database()
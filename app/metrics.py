@@ -0,0 +1,48 @@
+"""Simple per-process counters and gauges. They are exposed as plain text under
+`/metrics`. As every `gunicorn` worker keeps its own values, each line is labelled
+with the process id.
+"""
+from collections import Counter
+
+import os
+import threading
+
+_COUNTERS = Counter()
+_GAUGES = {}
+_LOCK = threading.Lock()
+
+
+def inc(name, value=1):
+    """Increments the counter with the given `name`."""
+    with _LOCK:
+        _COUNTERS[name] += value
+
+
+def set_gauge(name, value):
+    """Sets the gauge with the given `name` to `value`."""
+    with _LOCK:
+        _GAUGES[name] = value
+
+
+def get(name):
+    """Returns the current value of the counter or gauge with the given `name`."""
+    with _LOCK:
+        if name in _GAUGES:
+            return _GAUGES[name]
+        return _COUNTERS[name]
+
+
+def snapshot():
+    """Returns a dict with the current values of all counters and gauges."""
+    with _LOCK:
+        values = dict(_COUNTERS)
+        values.update(_GAUGES)
+        return values
+
+
+def render_text():
+    pid = os.getpid()
+    return "".join(
+        '%s{pid="%d"} %s\n' % (name, pid, value)
+        for name, value in sorted(snapshot().items())
+    )
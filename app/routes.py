@@ -1,10 +1,13 @@
 from app import app, nav
+from app.content.render_cache import render_cached
 from app.content.render_content import render_how_it_works
+from app.elster import field_index
+from app.elster.admission import SubmissionRejected
 from app.forms.flow_eligibility import EligibilityMultiStepFlow
 from app.forms.flow_demo import DemoMultiStepFlow
 from app.forms.lotse.flow_lotse import LotseMultiStepFlow
 
-from flask import render_template, request, send_file
+from flask import abort, render_template, request, send_file
 from flask_babel import _
 from flask_babel import lazy_gettext as _l
 from werkzeug.exceptions import InternalServerError
@@ -32,41 +35,64 @@ nav.Bar('top', [
 
 # Multistep flows
 
+# Flows do not hold any per-request state and are thus only built once per process
+_ELIGIBILITY_FLOW = EligibilityMultiStepFlow(endpoint='eligibility')
+_DEMO_FLOW = DemoMultiStepFlow(endpoint='demo')
+_LOTSE_FLOW = LotseMultiStepFlow(endpoint='lotse')
+
+# Lets errors for ELSTER fields link to the step of the Lotse flow they are entered in
+field_index.build(_LOTSE_FLOW.steps.values())
+
 
 @app.route('/eligibility/step/<step>', methods=['GET', 'POST'])
 def eligibility(step):
-    flow = EligibilityMultiStepFlow(endpoint='eligibility')
-    return flow.handle(step_name=step)
+    return _ELIGIBILITY_FLOW.handle(step_name=step)
+
+
+@app.route('/eligibility/step/<step>/validate', methods=['POST'])
+def eligibility_validate(step):
+    return _ELIGIBILITY_FLOW.validate(step_name=step)
 
 
 @app.route('/demo/step/<step>', methods=['GET', 'POST'])
 def demo(step):
-    flow = DemoMultiStepFlow(endpoint='demo')
-    return flow.handle(step_name=step)
+    return _DEMO_FLOW.handle(step_name=step)
+
+
+@app.route('/demo/step/<step>/validate', methods=['POST'])
+def demo_validate(step):
+    return _DEMO_FLOW.validate(step_name=step)
 
 
 @app.route('/lotse/step/<step>', methods=['GET', 'POST'])
 def lotse(step):
-    flow = LotseMultiStepFlow(endpoint='lotse')
-    return flow.handle(step_name=step)
+    return _LOTSE_FLOW.handle(step_name=step)
+
+
+@app.route('/lotse/step/<step>/validate', methods=['POST'])
+def lotse_validate(step):
+    return _LOTSE_FLOW.validate(step_name=step)
 
 
 @app.route('/download_pdf/<session>/print.pdf', methods=['GET'])
 def download_pdf(session):
-    from app.elster.pyeric_dispatcher import get_pdf_path
-    return send_file(get_pdf_path(session))
+    from app.elster.elster_service import print_with_elster
+    pdf_path = print_with_elster(session)
+    if not pdf_path:
+        abort(404)
+    return send_file(pdf_path)
 
 # Content
 
 
 @app.route('/')
 def index():
-    return render_template('content/landing_page.html')
+    return render_cached('content/landing_page.html')
 
 
 @app.route('/kontakt')
 def contact():
-    return render_template('content/contact.html')
+    return render_cached('content/contact.html')
 
 
 @app.route('/sofunktionierts')
@@ -79,27 +105,27 @@ def howitworks():
 
 @app.route('/login/welcome')
 def login_welcome():
-    return render_template('login/welcome.html')
+    return render_cached('login/welcome.html')
 
 
 @app.route('/login/create')
 def login_create():
-    return render_template('login/create.html')
+    return render_cached('login/create.html')
 
 
 @app.route('/login/create-confirm')
 def login_create_confirm():
-    return render_template('login/create-confirm.html')
+    return render_cached('login/create-confirm.html')
 
 
 @app.route('/login/auth')
 def login_auth():
-    return render_template('login/auth.html')
+    return render_cached('login/auth.html')
 
 
 @app.route('/login/resume')
 def login_resume():
-    return render_template('login/resume.html')
+    return render_cached('login/resume.html')
 
 
 # General
@@ -115,8 +141,33 @@ def error_500(error):
     return render_template('error/500.html'), 500
 
 
+@app.errorhandler(SubmissionRejected)
+def error_503(error):
+    return render_template('error/503.html', retry_after=error.retry_after), 503, \
+        {'Retry-After': str(error.retry_after)}
+
+
+@app.route('/metrics')
+def metrics():
+    from app.elster.pyeric_dispatcher import get_gateway_metrics
+    from app.metrics import render_text
+    gateway_metrics = "".join(
+        'eric_gateway_%s %s\n' % (name, value) for name, value in sorted(get_gateway_metrics().items()))
+    return render_text() + gateway_metrics, 200, {'Content-Type': 'text/plain; charset=utf-8'}
+
+
+@app.route('/ready')
+def ready():
+    from app.elster.pyeric_dispatcher import is_ready
+    if not is_ready():
+        return "warming up\n", 503
+    return "ready\n"
+
+
 @app.route('/cronjob')
 def cronjob():
     from app.elster.pyeric_dispatcher import clean_old_folders
+    from app.forms.session_manager import get_session_manager
     clean_old_folders()
+    get_session_manager().clean_expired()
     return "okay\n"
@@ -1 +1 @@
-from pyeric.eric import EricApi
\ No newline at end of file
+from pyeric.eric import EricApi, EricMtApi
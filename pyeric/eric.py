@@ -7,6 +7,14 @@ EricResponse = namedtuple(
     ['result_code', 'eric_response',  'server_response']
 )
 
+# Maps result codes to the texts ERiC provides for them, they do not change during runtime
+_ERROR_TEXTS = {}
+
+
+def _plugin_path():
+    curr_dir = os.path.dirname(os.path.realpath(__file__))
+    return c_char_p(os.path.join(curr_dir, "lib/plugins2").encode())
+
 
 # As explained in the original ERiC documentation
 class eric_druck_parameter_t(Structure):
@@ -48,6 +56,13 @@ class EricApi(object):
     def _nop(self, *args):
         pass  # Used for outputting nothing if debug==False
 
+    def _function(self, name, argtypes, restype):
+        """Returns the function `name` of the library with the given signature."""
+        fun = getattr(self.eric, name)
+        fun.argtypes = argtypes
+        fun.restype = restype
+        return fun
+
     def initialise(self, log_path=None):
         """Initialises ERiC and a successful return from this method shall indicate
         that the .so file was found and loaded successfully. Where `initialise` is called,
@@ -57,12 +72,7 @@ class EricApi(object):
         fun_init.argtypes = [c_char_p, c_char_p]
         fun_init.restype = c_int
 
-        curr_dir = os.path.dirname(os.path.realpath(__file__))
-        plugin_path = c_char_p(os.path.join(curr_dir, "lib/plugins2").encode())
-
-        log_path = c_char_p(log_path.encode() if log_path else None)
-
-        res = fun_init(plugin_path, log_path)
+        res = fun_init(_plugin_path(), c_char_p(log_path.encode() if log_path else None))
         self.print("fun_init res:", res)
 
     def shutdown(self):
@@ -77,11 +87,11 @@ class EricApi(object):
         """Validate the given XML using the built-in plausibility checks."""
         return self.process(xml, data_type_version, EricApi.ERIC_VALIDIERE)
 
-    def validate_and_send(self, xml, data_type_version, cert_path, cert_pin, print_path):
+    def validate_and_send(self, xml, data_type_version, cert_path, cert_pin, print_path=None):
         """Validate and (more importantly) send the given XML using the built-in 
         plausibility checks. For this a test certificate and pin must be provided and the
         `data_type_version` shall match the XML data. When a `print_path` is given, a PDF
-        will be created under that path."""
+        will be created under that path. Use `print_pdf` to create it later on."""
 
         print_params = self.alloc_eric_druck_parameter_t(print_path)
 
@@ -99,14 +109,24 @@ class EricApi(object):
         finally:
             self.close_cert_handle(cert_handle)
 
-    def alloc_eric_druck_parameter_t(self, print_path):
+    def print_pdf(self, xml, data_type_version, print_path, footer=None):
+        """Creates the PDF for the given, already sent XML under `print_path` without
+        sending it again. The optional `footer` is printed on every page."""
+        print_params = self.alloc_eric_druck_parameter_t(print_path, footer)
+
+        return self.process(
+            xml, data_type_version,
+            EricApi.ERIC_VALIDIERE | EricApi.ERIC_DRUCKE,
+            print_params=pointer(print_params))
+
+    def alloc_eric_druck_parameter_t(self, print_path, footer=None):
         return eric_druck_parameter_t(
             version=2,
             vorschau=0,
             ersteSeite=0,
             duplexDruck=0,
             pdfName=c_char_p(print_path.encode()) if print_path else None,
-            fussText=None,
+            fussText=c_char_p(footer.encode()) if footer else None,
         )
 
     def alloc_eric_verschluesselungs_parameter_t(self, zertifikatHandle, pin):
@@ -118,9 +138,7 @@ class EricApi(object):
         )
 
     def get_cert_handle(self, cert_path):
-        fun_get_cert_handle = self.eric.EricGetHandleToCertificate
-        fun_get_cert_handle.argtypes = [c_void_p, c_void_p, c_char_p]
-        fun_get_cert_handle.restype = c_int
+        fun_get_cert_handle = self._function('EricGetHandleToCertificate', [c_void_p, c_void_p, c_char_p], c_int)
 
         cert_handle_out = c_int()
         res = fun_get_cert_handle(pointer(cert_handle_out), None, cert_path)
@@ -128,9 +146,7 @@ class EricApi(object):
         return cert_handle_out
 
     def close_cert_handle(self, cert_handle):
-        fun_close_cert_handle = self.eric.EricCloseHandleToCertificate
-        fun_close_cert_handle.argtypes = [c_int]
-        fun_close_cert_handle.restype = c_int
+        fun_close_cert_handle = self._function('EricCloseHandleToCertificate', [c_int], c_int)
 
         res = fun_close_cert_handle(cert_handle)
         self.print("fun_close_cert_handle res:", res)
@@ -145,11 +161,11 @@ class EricApi(object):
             eric_response_buffer = self.create_buffer()
             server_response_buffer = self.create_buffer()
 
-            fun_process = self.eric.EricBearbeiteVorgang
-            fun_process.argtypes = [c_char_p, c_char_p, c_uint32,
-                                    c_void_p, c_void_p, c_void_p,
-                                    c_void_p, c_void_p]
-            fun_process.restype = c_int
+            fun_process = self._function('EricBearbeiteVorgang',
+                                         [c_char_p, c_char_p, c_uint32,
+                                          c_void_p, c_void_p, c_void_p,
+                                          c_void_p, c_void_p],
+                                         c_int)
 
             res = fun_process(xml, data_type_version, flags,
                               print_params, cert_params, transfer_handle,
@@ -166,26 +182,40 @@ class EricApi(object):
             self.close_buffer(eric_response_buffer)
             self.close_buffer(server_response_buffer)
 
+    def get_error_text(self, result_code):
+        """Returns the description ERiC provides for the given result code. The
+        texts are only resolved once per process."""
+        text = _ERROR_TEXTS.get(result_code)
+        if text is not None:
+            return text
+
+        fun_get_error_text = self._function('EricHoleFehlerText', [c_int, c_void_p], c_int)
+
+        buf = self.create_buffer()
+        try:
+            res = fun_get_error_text(result_code, buf)
+            self.print("fun_get_error_text res:", res)
+            text = self.read_buffer(buf).decode()
+        finally:
+            self.close_buffer(buf)
+
+        _ERROR_TEXTS[result_code] = text
+        return text
+
     def create_buffer(self):
-        fun_create_buffer = self.eric.EricRueckgabepufferErzeugen
-        fun_create_buffer.argtypes = []
-        fun_create_buffer.restype = c_void_p
+        fun_create_buffer = self._function('EricRueckgabepufferErzeugen', [], c_void_p)
 
         res = fun_create_buffer()
         self.print("fun_create_buffer res:", res)
         return res
 
     def read_buffer(self, buffer):
-        fun_read_buffer = self.eric.EricRueckgabepufferInhalt
-        fun_read_buffer.argtypes = [c_void_p]
-        fun_read_buffer.restype = c_char_p
+        fun_read_buffer = self._function('EricRueckgabepufferInhalt', [c_void_p], c_char_p)
 
         return fun_read_buffer(buffer)
 
     def close_buffer(self, buffer):
-        fun_close_buffer = self.eric.EricRueckgabepufferFreigeben
-        fun_close_buffer.argtypes = [c_void_p]
-        fun_close_buffer.restype = int
+        fun_close_buffer = self._function('EricRueckgabepufferFreigeben', [c_void_p], c_int)
 
         res = fun_close_buffer(buffer)
         self.print("fun_close_buffer res:", res)
@@ -194,11 +224,11 @@ class EricApi(object):
     def create_th(self,
                   xml, datenart='ESt', verfahren='ElsterErklaerung', vorgang='send-Auth',
                   testmerker='700000004', herstellerId='74931', datenLieferant='Softwaretester ERiC', versionClient='1'):
-        fun_create_th = self.eric.EricCreateTH
-        fun_create_th.argtypes = [c_char_p, c_char_p, c_char_p, c_char_p,
-                                  c_char_p, c_char_p, c_char_p, c_char_p,
-                                  c_char_p, c_void_p]
-        fun_create_th.restype = int
+        fun_create_th = self._function('EricCreateTH',
+                                       [c_char_p, c_char_p, c_char_p, c_char_p,
+                                        c_char_p, c_char_p, c_char_p, c_char_p,
+                                        c_char_p, c_void_p],
+                                       c_int)
 
         buf = self.create_buffer()
         try:
@@ -211,3 +241,52 @@ class EricApi(object):
             return self.read_buffer(buf)
         finally:
             self.close_buffer(buf)
+
+
+class EricMtApi(EricApi):
+    """A wrapper for the multi-instance API of ERiC (the `EricMt*` functions). Each
+    object owns its own ERiC instance, so several objects can be used in parallel by
+    different threads of one process. A single object must only be used by one thread
+    at a time. Certificate handles stay open until `shutdown`, so repeated sends with
+    the same certificate do not read it again.
+    """
+
+    def __init__(self, debug=True):
+        super(EricMtApi, self).__init__(debug)
+        self.instance = None
+        self._cert_handles = {}
+
+    def _function(self, name, argtypes, restype):
+        """Returns the `EricMt*` variant of the function `name` bound to this instance."""
+        fun = super(EricMtApi, self)._function(
+            'EricMt' + name[len('Eric'):], [c_void_p] + argtypes, restype)
+        instance = self.instance
+        return lambda *args: fun(instance, *args)
+
+    def initialise(self, log_path=None):
+        """Creates the ERiC instance of this object."""
+        fun_create_instance = super(EricMtApi, self)._function('EricMtInstanzErzeugen', [c_char_p, c_char_p], c_void_p)
+
+        self.instance = fun_create_instance(_plugin_path(), c_char_p(log_path.encode() if log_path else None))
+        self.print("fun_create_instance res:", self.instance)
+        if not self.instance:
+            raise RuntimeError("ERiC instance could not be created")
+
+    def shutdown(self):
+        """Closes the cached certificate handles and releases the ERiC instance."""
+        for cert_handle in self._cert_handles.values():
+            super(EricMtApi, self).close_cert_handle(cert_handle)
+        self._cert_handles.clear()
+
+        fun_release_instance = super(EricMtApi, self)._function('EricMtInstanzFreigeben', [c_void_p], c_int)
+        res = fun_release_instance(self.instance)
+        self.print("fun_release_instance res:", res)
+        self.instance = None
+
+    def get_cert_handle(self, cert_path):
+        if cert_path not in self._cert_handles:
+            self._cert_handles[cert_path] = super(EricMtApi, self).get_cert_handle(cert_path)
+        return self._cert_handles[cert_path]
+
+    def close_cert_handle(self, cert_handle):
+        pass  # kept open until `shutdown`
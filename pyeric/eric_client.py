@@ -1,4 +1,5 @@
 import argparse
+import json
 import time
 
 import os
@@ -7,8 +8,14 @@ import sys
 curr_dir = os.path.dirname(os.path.abspath(__file__))
 parent_dir = os.path.dirname(curr_dir)
 sys.path.insert(0, parent_dir)
+from app.elster.elster_xml import add_transfer_header
 from app.utils import pretty_xml
-from pyeric import EricApi
+from pyeric import EricApi, schema
+
+
+def enter_phase(name):
+    """Announces the next phase to the dispatcher, which enforces a deadline per phase."""
+    print('phase:' + name, flush=True)
 
 
 if __name__ == "__main__":
@@ -23,33 +30,72 @@ if __name__ == "__main__":
                         default=False, help='Only validate, but do not actually send')
     parser.add_argument('--only-validate', dest='only_validate', action='store_const', const=True,
                         default=False, help='Enable debug output of pyeric')
+    parser.add_argument('--print', dest='print_pdf', action='store_const', const=True,
+                        default=False, help='Only create the print.pdf for the already sent input.xml')
+    parser.add_argument('--print-footer', type=str, default=None, help='Text printed at the bottom of every page')
+    parser.add_argument('--create-th', dest='create_th', action='store_const', const=True,
+                        default=False, help='Add the TransferHeader to the input.xml first')
+    parser.add_argument('--schema-folder', type=str, default=None,
+                        help='Check the input.xml with TransferHeader against the envelope schema in this folder')
 
     args = parser.parse_args()
     work_dir, cert_pin = os.path.abspath(args.work_dir), args.cert_pin
     verfahren, only_validate, verbose = args.verfahren, args.only_validate, args.verbose
 
+    enter_phase('initialise')
     eric = EricApi(debug=verbose)
     try:
         eric.initialise(log_path=work_dir)
         with open(os.path.join(work_dir, 'input.xml'), 'r') as f:
             input_xml = f.read()
 
+        if args.print_pdf:
+            # Keep the responses of the submission and only replace the PDF once it is complete
+            tmp_path = os.path.join(work_dir, 'print.pdf.%d' % os.getpid())
+            enter_phase('print')
+            response = eric.print_pdf(input_xml, verfahren, tmp_path, footer=args.print_footer)
+            if response.result_code != 0:
+                sys.exit("printing failed with result code %d" % response.result_code)
+            os.replace(tmp_path, os.path.join(work_dir, 'print.pdf'))
+            sys.exit(0)
+
         # Clean-up if neccessary
-        output_files = ('eric.log', 'eric_response.xml', 'server_response.xml', 'print.pdf',)
+        output_files = ('eric.log', 'eric_response.xml', 'server_response.xml', 'print.pdf', 'result_code.txt', 'result_text.txt',
+                        'schema_errors.json',)
         for output_file_name in output_files:
             path = os.path.join(work_dir, output_file_name)
             if os.path.isfile(path):
                 os.remove(path)
 
+        if args.create_th:
+            enter_phase('create_th')
+            input_xml = add_transfer_header(eric, input_xml)
+            with open(os.path.join(work_dir, 'input.xml'), 'w') as f:
+                f.write(input_xml)
+
+            schema_errors = schema.check_envelope(input_xml, args.schema_folder) if args.schema_folder else []
+            if schema_errors:
+                with open(os.path.join(work_dir, 'schema_errors.json'), 'w') as f:
+                    json.dump(schema_errors, f)
+                sys.exit("the XML does not match the envelope schema")
+
         if only_validate:
+            enter_phase('validate')
             response = eric.validate(input_xml, verfahren)
         else:
             # Send it over into ELSTER land \o/
+            enter_phase('send')
             response = eric.validate_and_send(
                 input_xml, verfahren,
                 cert_path=os.path.join(work_dir, "cert.pfx"),
-                cert_pin=cert_pin,
-                print_path=os.path.join(work_dir, "print.pdf"))
+                cert_pin=cert_pin)
+
+        with open(os.path.join(work_dir, 'result_code.txt'), 'w') as f:
+            f.write(str(response.result_code))
+
+        if response.result_code != 0:
+            with open(os.path.join(work_dir, 'result_text.txt'), 'w') as f:
+                f.write(eric.get_error_text(response.result_code))
 
         with open(os.path.join(work_dir, 'eric_response.xml'), 'w') as f:
             xml = pretty_xml(response.eric_response.decode())
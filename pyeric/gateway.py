@@ -0,0 +1,618 @@
+"""A gateway that owns a fixed number of initialised ERiC instances in worker processes
+and serves them over a Unix socket or TCP. Web workers then neither need the ERiC
+library and the certificate, nor pay for initialising ERiC on every run.
+
+Requests and replies consist of frames: a 4 byte big endian length followed by the
+payload. A request is a single JSON frame, e.g.
+
+    {"op": "send", "xml": "...", "verfahren": "ESt_2019", "create_th": true}
+
+where `op` is one of `create_th`, `validate`, `send` and `print`. The reply is a JSON
+frame with `result_code` and `result_text` (or `error` and `phase` if the job failed)
+and the list of `parts` that follow as one frame each, holding the raw bytes of the
+`xml` with TransferHeader, the `eric_response`, the `server_response` or the `pdf`.
+If no instance becomes idle within `--acquire-timeout`, the `error` is `no_worker`.
+With `--schema-folder`, the XML is checked against the envelope schema right after the
+<TransferHeader> is created. If it does not match, the `error` is `schema` and the reply
+holds the `schema_errors` as `[line, message]` pairs.
+
+The gateway holds the certificate and its PIN and does not authenticate its clients.
+Only the Unix socket is supported in production, TCP only listens on loopback addresses.
+
+Each instance is warmed up for the given `--verfahren` before it takes jobs. Until
+all instances are warm, the reply to `{"op": "status"}` is `{"ready": false, ...}`.
+It also holds the `metrics` of the pool, e.g. how many workers have been recycled.
+
+With `--threads` the instances run in threads of the gateway process using the
+multi-instance API of ERiC instead of in worker processes.
+
+Usage: python3 pyeric/gateway.py --listen unix:/run/eric.sock --workers 4 --cert-path cert.pfx --cert-pin 123456
+"""
+import argparse
+import functools
+import ipaddress
+import json
+import multiprocessing
+import os
+import queue
+import shutil
+import socket
+import socketserver
+import struct
+import sys
+import tempfile
+import threading
+import time
+import traceback
+
+from collections import Counter
+
+curr_dir = os.path.dirname(os.path.abspath(__file__))
+parent_dir = os.path.dirname(curr_dir)
+sys.path.insert(0, parent_dir)
+from pyeric import schema
+from pyeric.eric import EricApi, EricMtApi
+
+_LENGTH = struct.Struct('>I')
+
+_DEFAULT_DEADLINES = {'create_th': 10, 'validate': 30, 'send': 60, 'print': 30}
+
+_OPS = ('create_th', 'validate', 'send', 'print')
+
+# Workers are started from background threads while requests are handled. A plain fork
+# could copy locks held by other threads into the new worker, so they are forked from a
+# separate single-threaded server process instead.
+_MP_CONTEXT = multiprocessing.get_context('forkserver')
+
+# A declaration without any fields, which is run through ERiC while warming up
+_WARM_UP_XML = """<Elster xmlns="http://www.elster.de/elsterxml/schema/v11"><DatenTeil><Nutzdatenblock>
+<NutzdatenHeader version="11"><NutzdatenTicket>warm_up</NutzdatenTicket><Empfaenger id="F">9198</Empfaenger></NutzdatenHeader>
+<Nutzdaten><Jahressteuererklaerung version="2"><Vorsatz unterfallart="10" ordNrArt="S" vorgang="01">
+<StNr>9198011310010</StNr><Zeitraum>%s</Zeitraum><Erstelldatum>20200101</Erstelldatum><Erstellzeit>000000</Erstellzeit>
+<AbsName>Warm-up</AbsName><AbsStr>Warm-up</AbsStr><AbsPlz>10119</AbsPlz><AbsOrt>Berlin</AbsOrt>
+<Copyright>(C) 2020 T4G</Copyright><Rueckuebermittlung bescheid="nein"/></Vorsatz>
+</Jahressteuererklaerung></Nutzdaten></Nutzdatenblock></DatenTeil></Elster>
+"""
+
+
+def send_frame(sock, payload):
+    sock.sendall(_LENGTH.pack(len(payload)))
+    if payload:
+        sock.sendall(payload)
+
+
+def _recv_exact(sock, size):
+    data = bytearray()
+    while len(data) < size:
+        chunk = sock.recv(min(size - len(data), 65536))
+        if not chunk:
+            raise ConnectionError("connection closed")
+        data += chunk
+    return bytes(data)
+
+
+def recv_frame(sock):
+    length, = _LENGTH.unpack(_recv_exact(sock, _LENGTH.size))
+    return _recv_exact(sock, length)
+
+
+def parse_address(address):
+    """Returns `(family, address)` for addresses of the form `unix:/path` or `host:port`."""
+    if address.startswith('unix:'):
+        return socket.AF_UNIX, address[len('unix:'):]
+    host, port = address.rsplit(':', 1)
+    return socket.AF_INET, (host, int(port))
+
+
+class GatewayClient(object):
+    """Sends single jobs to the gateway listening on `address`."""
+
+    def __init__(self, address, timeout=None):
+        self.family, self.address = parse_address(address)
+        self.timeout = timeout
+
+    def request(self, job):
+        """Returns the reply and a dict with its parts for the given job."""
+        with socket.socket(self.family, socket.SOCK_STREAM) as sock:
+            sock.settimeout(self.timeout)
+            sock.connect(self.address)
+            send_frame(sock, json.dumps(job).encode())
+
+            reply = json.loads(recv_frame(sock))
+            parts = {name: recv_frame(sock) for name in reply['parts']}
+            return reply, parts
+
+
+# Worker processes
+
+
+def _handle_job(eric, job, work_dir, cert_path, cert_pin, schema_folder, enter_phase):
+    op, xml, parts = job['op'], job['xml'], {}
+
+    if job.get('create_th') or op == 'create_th':
+        enter_phase('create_th')
+        xml = eric.create_th(xml, **job.get('th_fields', {})).decode()
+        parts['xml'] = xml.encode()
+        schema_errors = schema.check_envelope(xml, schema_folder) if schema_folder else []
+        if schema_errors:
+            return {'error': 'schema', 'phase': 'create_th', 'schema_errors': schema_errors}, parts
+        if op == 'create_th':
+            return {'result_code': 0, 'result_text': None}, parts
+
+    enter_phase(op)
+    if op == 'validate':
+        response = eric.validate(xml, job['verfahren'])
+    elif op == 'send':
+        response = eric.validate_and_send(xml, job['verfahren'], cert_path=cert_path, cert_pin=cert_pin)
+    elif op == 'print':
+        pdf_path = os.path.join(work_dir, 'print.pdf')
+        response = eric.print_pdf(xml, job['verfahren'], pdf_path, footer=job.get('footer'))
+        if response.result_code == 0:
+            with open(pdf_path, 'rb') as f:
+                parts['pdf'] = f.read()
+            os.remove(pdf_path)
+    else:
+        raise ValueError("unknown op '%s'" % op)
+
+    parts['eric_response'] = response.eric_response or b''
+    parts['server_response'] = response.server_response or b''
+    result_text = eric.get_error_text(response.result_code) if response.result_code else None
+    return {'result_code': response.result_code, 'result_text': result_text}, parts
+
+
+def _warm_up(eric, verfahren):
+    """Runs a dummy `create_th` and validation for every Verfahren, so that ERiC loads
+    the plugins and sets up its caches before the first real job. The results of the
+    canned declaration do not matter, only that ERiC returns."""
+    for name in verfahren:
+        xml = eric.create_th(_WARM_UP_XML % name.rsplit('_', 1)[-1]).decode()
+        eric.validate(xml, name)
+
+
+def _sample_resources():
+    """Returns the RSS in kB and the number of open file descriptors of this process,
+    which include the files and sockets ERiC keeps open, or `None` without `/proc`."""
+    try:
+        with open('/proc/self/status', 'r') as f:
+            rss_kb = next(int(line.split()[1]) for line in f if line.startswith('VmRSS:'))
+        return {'rss_kb': rss_kb, 'handles': len(os.listdir('/proc/self/fd'))}
+    except (OSError, StopIteration):
+        return None
+
+
+def _worker_main(connection, eric_factory, cert_path, cert_pin, schema_folder, verfahren):
+    work_dir = tempfile.mkdtemp(prefix='eric_worker_')
+    eric = eric_factory()
+    eric.initialise(log_path=work_dir)
+    try:
+        _warm_up(eric, verfahren)
+        connection.send(('ready', None))
+        while True:
+            job = connection.recv()
+            try:
+                result = _handle_job(eric, job, work_dir, cert_path, cert_pin, schema_folder,
+                                     lambda phase: connection.send(('phase', phase)))
+                connection.send(('stats', _sample_resources()))
+                connection.send(('result', result))
+            except Exception as e:  # intentional generic catch: reported to the client
+                connection.send(('stats', _sample_resources()))
+                connection.send(('error', repr(e)))
+    except EOFError:
+        pass  # the pool has been closed
+    finally:
+        eric.shutdown()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+class _Worker(object):
+
+    def __init__(self, eric_factory, cert_path, cert_pin, schema_folder, verfahren):
+        self.jobs, self.stats = 0, None
+        self.retiring = self.retired = self.lost = False
+        self.connection, child_connection = _MP_CONTEXT.Pipe()
+        self.process = _MP_CONTEXT.Process(
+            target=_worker_main, args=(child_connection, eric_factory, cert_path, cert_pin, schema_folder, verfahren),
+            daemon=True)
+        self.process.start()
+        child_connection.close()
+
+    def close(self):
+        self.process.kill()
+        self.process.join()
+        self.connection.close()
+
+
+class _Pool(object):
+    """Holds the idle workers of a pool. Workers are started and warmed up (see
+    `_warm_up`) in the background and only become idle afterwards. The pool is
+    ready once all workers it started with are warm. A worker that cannot be started
+    is retried with a growing delay of up to `max_retry_delay` seconds, while jobs
+    wait at most `acquire_timeout` seconds for an idle worker.
+
+    A worker is recycled once it has run `max_jobs` jobs or the resources sampled
+    after a job exceed `max_rss_mb` or `max_handles`. It keeps running jobs until its
+    replacement is warm, so the capacity of the pool never drops.
+    """
+
+    retry_delay = 1
+    max_retry_delay = 60
+
+    def __init__(self, size, verfahren, max_jobs=None, max_rss_mb=None, max_handles=None, acquire_timeout=5):
+        self.verfahren = verfahren
+        self.max_jobs, self.max_rss_mb, self.max_handles = max_jobs, max_rss_mb, max_handles
+        self.acquire_timeout = acquire_timeout
+        self._idle = queue.Queue()
+        self._cold = size
+        self._closed = False
+        self._metrics = Counter()
+        self._lock = threading.Lock()
+        for _ in range(size):
+            self._replace(initial=True)
+
+    def ready(self):
+        with self._lock:
+            return self._cold == 0
+
+    def metrics(self):
+        """Returns a dict with the counters of the pool."""
+        with self._lock:
+            return dict(self._metrics, workers_idle=self._idle.qsize())
+
+    def _inc(self, name):
+        with self._lock:
+            self._metrics[name] += 1
+
+    def _acquire(self):
+        """Returns the next idle worker or `None` if none became idle in time."""
+        deadline = time.monotonic() + self.acquire_timeout
+        while True:
+            try:
+                worker = self._idle.get(timeout=max(deadline - time.monotonic(), 0))
+            except queue.Empty:
+                self._inc('jobs_without_worker')
+                return None
+            if not worker.retired:
+                return worker
+            worker.close()
+
+    def _release(self, worker):
+        if worker.retired:
+            worker.close()
+        else:
+            self._idle.put(worker)
+
+    def _retire_reason(self, worker):
+        if self.max_jobs and worker.jobs >= self.max_jobs:
+            return 'jobs'
+        if worker.stats and self.max_rss_mb and worker.stats['rss_kb'] > self.max_rss_mb * 1024:
+            return 'rss'
+        if worker.stats and self.max_handles and worker.stats['handles'] > self.max_handles:
+            return 'handles'
+        return None
+
+    def _finish_job(self, worker):
+        """Is called after every job the worker completed and recycles it if necessary."""
+        worker.jobs += 1
+        reason = self._retire_reason(worker)
+        if reason and not worker.retiring:
+            worker.retiring = True
+            self._inc('workers_recycled_' + reason)
+            self._replace(retire=worker)
+
+    def _lose(self, worker, reason):
+        """Replaces a worker that was killed, died or was abandoned, unless a replacement
+        is already starting because the worker was being recycled."""
+        self._inc('workers_' + reason)
+        with self._lock:
+            worker.lost = True
+            replace = not worker.retiring
+        if replace:
+            self._replace()
+
+    def _spawn(self):
+        """Returns a new warm worker or `None` if it could not be warmed up."""
+        raise NotImplementedError()
+
+    def _replace(self, initial=False, retire=None):
+        """Starts a new worker in the background. The worker `retire` is closed once
+        the new one is idle."""
+        threading.Thread(target=self._start_worker, args=(initial, retire), daemon=True).start()
+
+    def _start_worker(self, initial, retire):
+        delay = self.retry_delay
+        while True:
+            try:
+                worker = self._spawn()
+            except Exception:  # intentional generic catch: retried below
+                traceback.print_exc()
+                worker = None
+            if worker is not None:
+                break
+
+            self._inc('workers_failed')
+            with self._lock:
+                if retire and not retire.lost:
+                    retire.retiring = False  # tried again after its next job
+                    return
+                if self._closed:
+                    return
+            # Otherwise the pool would have lost this worker for good
+            time.sleep(delay)
+            delay = min(delay * 2, self.max_retry_delay)
+
+        with self._lock:
+            if initial:
+                self._cold -= 1
+            closed = self._closed
+            if not closed:
+                self._idle.put(worker)
+            if retire:
+                retire.retired = True  # closed when it is acquired or released next
+                self._metrics['workers_recycled'] += 1
+        if closed:
+            worker.close()
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+        while not self._idle.empty():
+            self._idle.get().close()
+
+
+class WorkerPool(_Pool):
+    """A fixed number of worker processes with one initialised ERiC instance each.
+    A worker that exceeds the deadline of its current phase is killed and replaced.
+    """
+
+    def __init__(self, size, eric_factory=None, cert_path=None, cert_pin=None, deadlines=None, verfahren=(),
+                 warm_up_timeout=120, max_jobs=None, max_rss_mb=None, max_handles=None, acquire_timeout=5,
+                 schema_folder=None, verbose=False):
+        self.eric_factory = eric_factory or functools.partial(EricApi, debug=verbose)
+        self.cert_path, self.cert_pin = cert_path, cert_pin
+        self.schema_folder = schema_folder
+        self.deadlines = deadlines or _DEFAULT_DEADLINES
+        self.warm_up_timeout = warm_up_timeout
+        super(WorkerPool, self).__init__(size, verfahren, max_jobs, max_rss_mb, max_handles, acquire_timeout)
+
+    def _spawn(self):
+        worker = _Worker(self.eric_factory, self.cert_path, self.cert_pin, self.schema_folder, self.verfahren)
+        try:
+            if worker.connection.poll(self.warm_up_timeout) and worker.connection.recv()[0] == 'ready':
+                return worker
+        except (EOFError, OSError):
+            pass  # the worker died while warming up
+        worker.close()
+        return None
+
+    def run(self, job):
+        """Runs the job on the next idle worker and returns the reply and its parts."""
+        deadlines = dict(self.deadlines, **job.get('deadlines', {}))
+        phase = 'create_th' if job.get('create_th') else job['op']
+
+        worker = self._acquire()
+        if worker is None:
+            return {'error': 'no_worker', 'phase': phase, 'parts': []}, {}
+        phase_start = time.monotonic()
+        try:
+            worker.connection.send(job)
+            while True:
+                remaining = deadlines[phase] - (time.monotonic() - phase_start)
+                if remaining <= 0 or not worker.connection.poll(remaining):
+                    worker.close()
+                    self._lose(worker, 'killed')
+                    worker = None
+                    return {'error': 'timeout', 'phase': phase, 'parts': []}, {}
+
+                kind, value = worker.connection.recv()
+                if kind == 'phase':
+                    phase, phase_start = value, time.monotonic()
+                elif kind == 'stats':
+                    worker.stats = value
+                elif kind == 'result':
+                    self._finish_job(worker)
+                    reply, parts = value
+                    reply['parts'] = list(parts)
+                    return reply, parts
+                else:
+                    self._finish_job(worker)
+                    return {'error': value, 'phase': phase, 'parts': []}, {}
+        except (EOFError, OSError):
+            worker.close()
+            self._lose(worker, 'died')
+            worker = None
+            return {'error': 'worker died', 'phase': phase, 'parts': []}, {}
+        finally:
+            if worker:
+                self._release(worker)
+
+
+class _ThreadWorker(object):
+
+    def __init__(self, eric_factory):
+        self.jobs, self.stats = 0, None
+        self.retiring = self.retired = self.lost = False
+        self.work_dir = tempfile.mkdtemp(prefix='eric_worker_')
+        self.eric = eric_factory()
+        self.eric.initialise(log_path=self.work_dir)
+
+    def close(self):
+        self.eric.shutdown()
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+
+class ThreadWorkerPool(_Pool):
+    """A fixed number of ERiC instances in this process, which run the jobs in threads
+    (see `EricMtApi`). They share the loaded library, its plugins and the memory of one
+    process. Threads cannot be killed, so a worker that exceeds the deadline of its
+    current phase is abandoned and replaced. It is released once ERiC returns.
+
+    All instances share the RSS and the file descriptors of this process, so workers
+    are only recycled after `max_jobs`.
+    """
+
+    def __init__(self, size, eric_factory=None, cert_path=None, cert_pin=None, deadlines=None, verfahren=(),
+                 max_jobs=None, acquire_timeout=5, schema_folder=None, verbose=False):
+        self.eric_factory = eric_factory or functools.partial(EricMtApi, debug=verbose)
+        self.cert_path, self.cert_pin = cert_path, cert_pin
+        self.schema_folder = schema_folder
+        self.deadlines = deadlines or _DEFAULT_DEADLINES
+        super(ThreadWorkerPool, self).__init__(size, verfahren, max_jobs, acquire_timeout=acquire_timeout)
+
+    def _spawn(self):
+        worker = _ThreadWorker(self.eric_factory)
+        try:
+            _warm_up(worker.eric, self.verfahren)
+        except Exception:
+            worker.close()
+            raise
+        return worker
+
+    def run(self, job):
+        """Runs the job on the next idle worker and returns the reply and its parts."""
+        deadlines = dict(self.deadlines, **job.get('deadlines', {}))
+        phase = 'create_th' if job.get('create_th') else job['op']
+
+        worker = self._acquire()
+        if worker is None:
+            return {'error': 'no_worker', 'phase': phase, 'parts': []}, {}
+        events = queue.Queue()
+        state = {'done': False, 'abandoned': False}
+        state_lock = threading.Lock()
+
+        def target():
+            try:
+                result = _handle_job(worker.eric, job, worker.work_dir, self.cert_path, self.cert_pin,
+                                     self.schema_folder, lambda phase: events.put(('phase', phase)))
+                events.put(('result', result))
+            except Exception as e:  # intentional generic catch: reported to the client
+                events.put(('error', repr(e)))
+            finally:
+                with state_lock:
+                    state['done'] = True
+                    if state['abandoned']:
+                        worker.close()
+
+        threading.Thread(target=target, daemon=True).start()
+        phase_start = time.monotonic()
+        while True:
+            remaining = deadlines[phase] - (time.monotonic() - phase_start)
+            try:
+                if remaining <= 0:
+                    raise queue.Empty
+                kind, value = events.get(timeout=remaining)
+            except queue.Empty:
+                with state_lock:
+                    state['abandoned'] = True
+                    if state['done']:
+                        worker.close()
+                self._lose(worker, 'abandoned')
+                return {'error': 'timeout', 'phase': phase, 'parts': []}, {}
+
+            if kind == 'phase':
+                phase, phase_start = value, time.monotonic()
+                continue
+
+            self._finish_job(worker)
+            self._release(worker)
+            if kind == 'result':
+                reply, parts = value
+                reply['parts'] = list(parts)
+                return reply, parts
+            return {'error': value, 'phase': phase, 'parts': []}, {}
+
+
+class _Handler(socketserver.BaseRequestHandler):
+
+    def handle(self):
+        try:
+            job = json.loads(recv_frame(self.request))
+        except ConnectionError:
+            return
+        except ValueError:
+            job = None
+
+        if not isinstance(job, dict) or job.get('op') not in _OPS + ('status',):
+            reply, parts = {'error': 'invalid job', 'phase': None, 'parts': []}, {}
+        elif job['op'] == 'status':
+            reply, parts = {'ready': self.server.pool.ready(), 'metrics': self.server.pool.metrics(), 'parts': []}, {}
+        else:
+            try:
+                reply, parts = self.server.pool.run(job)
+            except Exception as e:  # intentional generic catch: reported to the client
+                traceback.print_exc()
+                reply, parts = {'error': repr(e), 'phase': job['op'], 'parts': []}, {}
+        send_frame(self.request, json.dumps(reply).encode())
+        for name in reply['parts']:
+            send_frame(self.request, parts[name])
+
+
+class _UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class _TcpServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def _is_loopback(host):
+    try:
+        return host == 'localhost' or ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+def create_server(address, pool):
+    """Returns a server for the given address that runs all jobs on `pool`. Clients are
+    not authenticated, so TCP servers may only listen on loopback addresses."""
+    family, address = parse_address(address)
+    if family == socket.AF_UNIX:
+        if os.path.exists(address):
+            os.remove(address)  # left over from a previous run
+        server = _UnixServer(address, _Handler)
+    else:
+        if not _is_loopback(address[0]):
+            raise ValueError("the gateway only listens on loopback addresses or Unix sockets: %s" % address[0])
+        server = _TcpServer(address, _Handler)
+    server.pool = pool
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='ERiC gateway')
+    parser.add_argument('--listen', type=str, required=True,
+                        help='unix:/path/to/socket or host:port, where host must be a loopback address')
+    parser.add_argument('--workers', type=int, default=4, help='Number of ERiC instances')
+    parser.add_argument('--threads', action='store_true',
+                        help='Run the ERiC instances in threads of this process instead of worker processes')
+    parser.add_argument('--verfahren', action='append', default=None,
+                        help='Verfahren to warm up the instances for (default: ESt_2019), can be repeated')
+    parser.add_argument('--acquire-timeout', type=float, default=5,
+                        help='Seconds a job waits for an idle instance before it fails with no_worker')
+    parser.add_argument('--max-jobs', type=int, default=1000, help='Jobs after which an instance is recycled')
+    parser.add_argument('--max-rss-mb', type=int, default=512,
+                        help='RSS of a worker process after which it is recycled (not with --threads)')
+    parser.add_argument('--max-handles', type=int, default=256,
+                        help='Open file descriptors of a worker process after which it is recycled (not with --threads)')
+    parser.add_argument('--cert-path', type=str, help='The certificate used for sending')
+    parser.add_argument('--cert-pin', type=str, help='The PIN for the certificate.')
+    parser.add_argument('--verbose', action='store_true', help='Enable the debug output of pyeric')
+    parser.add_argument('--schema-folder', type=str,
+                        help='Folder with the ELSTER schemas to check the XML with <TransferHeader> against (needs lxml)')
+    args = parser.parse_args()
+
+    pool_args = dict(cert_path=os.path.abspath(args.cert_path) if args.cert_path else None, cert_pin=args.cert_pin,
+                     verfahren=args.verfahren or ['ESt_2019'], max_jobs=args.max_jobs,
+                     acquire_timeout=args.acquire_timeout,
+                     schema_folder=os.path.abspath(args.schema_folder) if args.schema_folder else None,
+                     verbose=args.verbose)
+    if args.threads:
+        pool = ThreadWorkerPool(args.workers, **pool_args)
+    else:
+        pool = WorkerPool(args.workers, max_rss_mb=args.max_rss_mb, max_handles=args.max_handles, **pool_args)
+    server = create_server(args.listen, pool)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        pool.close()
@@ -0,0 +1,81 @@
+"""Checks ELSTER XML against the XML schemas of ELSTER in a folder, e.g. `pyeric/schemas`
+(see `README.md`). The declarations are checked against `<Verfahren>.xsd`, the whole
+document against the schema of the <Elster> envelope, which requires the <TransferHeader>
+and can thus only be checked once ERiC has added it. Needs `lxml`, missing schemas are
+skipped.
+"""
+from collections import namedtuple
+
+import os
+import threading
+
+try:
+    from lxml import etree
+except ImportError:
+    etree = None
+
+_ELSTER_NAMESPACE = 'http://www.elster.de/elsterxml/schema/v11'
+
+# The schema of the <Elster> envelope, the declarations use `<Verfahren>.xsd`
+_ENVELOPE_SCHEMA = 'Elster'
+
+# Maps `(folder, name)` to compiled schemas, or `None` if missing. They are compiled once per process.
+_SCHEMAS = {}
+_SCHEMAS_LOCK = threading.Lock()
+
+SchemaError = namedtuple(
+    'SchemaError',
+    ['line', 'message']
+)
+
+
+def is_available():
+    return etree is not None
+
+
+def _get_schema(folder, name):
+    with _SCHEMAS_LOCK:
+        if (folder, name) not in _SCHEMAS:
+            path = os.path.join(folder, name + '.xsd')
+            _SCHEMAS[(folder, name)] = etree.XMLSchema(etree.parse(path)) if os.path.exists(path) else None
+        return _SCHEMAS[(folder, name)]
+
+
+def _validate(schema, element):
+    if schema.validate(element):
+        return []
+    return [SchemaError(error.line, error.message) for error in schema.error_log]
+
+
+def _check(xml_string, folder, check_document):
+    if not is_available():
+        return []
+    try:
+        document = etree.fromstring(xml_string.encode())
+    except etree.XMLSyntaxError as e:
+        return [SchemaError(e.lineno, e.msg)]
+    return check_document(document)
+
+
+def check_declarations(xml_string, folder, verfahren):
+    """Returns the `SchemaError`s of the <Jahressteuererklaerung>s in the given XML."""
+    def check_document(document):
+        schema = _get_schema(folder, verfahren)
+        if schema is None:
+            return []
+        errors = []
+        for declaration in document.iter('{%s}Jahressteuererklaerung' % _ELSTER_NAMESPACE):
+            errors += _validate(schema, declaration)
+        return errors
+
+    return _check(xml_string, folder, check_document)
+
+
+def check_envelope(xml_string, folder):
+    """Returns the `SchemaError`s of the given XML with <TransferHeader> against the
+    envelope schema."""
+    def check_document(document):
+        schema = _get_schema(folder, _ENVELOPE_SCHEMA)
+        return _validate(schema, document) if schema is not None else []
+
+    return _check(xml_string, folder, check_document)
@@ -0,0 +1,164 @@
+"""Benchmarks the ways of running ERiC on one host: a fresh `eric_client.py` process per
+job, the gateway's pool of worker processes and its pool of threads with one instance
+of the multi-instance API each. Every mode validates the same XML from several client
+threads and reports the throughput of the successful jobs, the failed jobs and the peak
+RSS of all involved processes. The pools are timed once all their instances are warm.
+
+Usage: python3 scripts/benchmark_eric.py [mode ...] [--instances N] [--jobs N]
+Modes are 'process', 'pool' and 'threads' (default: all). Requires `pyeric/lib`.
+"""
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+curr_dir = os.path.dirname(os.path.abspath(__file__))
+parent_dir = os.path.dirname(curr_dir)
+sys.path.insert(0, parent_dir)
+os.chdir(parent_dir)
+
+from pyeric.gateway import ThreadWorkerPool, WorkerPool
+
+_SAMPLE_XML = 'tests/app/elster/sample_with_auth.xml'
+_VERFAHREN = 'ESt_2019'
+_WARM_UP_TIMEOUT_SECONDS = 300
+
+
+def _rss_kb(pid):
+    try:
+        with open('/proc/%d/status' % pid) as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass  # the process has exited
+    return 0
+
+
+def _children(pid):
+    children = []
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open('/proc/%s/stat' % entry) as f:
+                # The command name in parentheses may contain spaces
+                ppid = int(f.read().rsplit(')', 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        if ppid == pid:
+            children.append(int(entry))
+    return children
+
+
+def _tree_rss_kb(pid):
+    return _rss_kb(pid) + sum(_tree_rss_kb(child) for child in _children(pid))
+
+
+class _RssSampler(threading.Thread):
+    """Samples the summed RSS of this process and all its descendants."""
+
+    def __init__(self):
+        super(_RssSampler, self).__init__(daemon=True)
+        self.peak_kb = 0
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(0.05):
+            self.peak_kb = max(self.peak_kb, _tree_rss_kb(os.getpid()))
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+
+
+def _run_process_job(xml, directory, index):
+    """Returns the error of the job or `None`."""
+    work_dir = os.path.join(directory, 'job_%d' % index)
+    os.mkdir(work_dir)
+    with open(os.path.join(work_dir, 'input.xml'), 'w') as f:
+        f.write(xml)
+    try:
+        subprocess.run(['python3', 'pyeric/eric_client.py', '--work-dir', work_dir, '--verfahren', _VERFAHREN,
+                        '--only-validate'], stdout=subprocess.DEVNULL, check=True)
+    except subprocess.CalledProcessError as e:
+        return 'exit code %d' % e.returncode
+    finally:
+        shutil.rmtree(work_dir)
+    return None
+
+
+def _wait_until_ready(pool):
+    deadline = time.monotonic() + _WARM_UP_TIMEOUT_SECONDS
+    while not pool.ready():
+        if time.monotonic() >= deadline:
+            sys.exit("the pool did not warm up within %ds" % _WARM_UP_TIMEOUT_SECONDS)
+        time.sleep(0.1)
+
+
+def _run(mode, instances, jobs, xml):
+    sampler = _RssSampler()
+    sampler.start()
+
+    pool = None
+    if mode == 'pool':
+        pool = WorkerPool(instances)
+    elif mode == 'threads':
+        pool = ThreadWorkerPool(instances)
+    if pool:
+        _wait_until_ready(pool)
+    directory = tempfile.mkdtemp(prefix='benchmark_eric_')
+
+    job_indexes = iter(range(jobs))
+    job_indexes_lock = threading.Lock()
+    failures = []
+
+    def client():
+        while True:
+            with job_indexes_lock:
+                index = next(job_indexes, None)
+            if index is None:
+                return
+            if pool:
+                reply, _ = pool.run({'op': 'validate', 'xml': xml, 'verfahren': _VERFAHREN})
+                error = reply.get('error')
+            else:
+                error = _run_process_job(xml, directory, index)
+            if error:
+                failures.append(error)
+
+    start_time = time.perf_counter()
+    clients = [threading.Thread(target=client) for _ in range(instances)]
+    for thread in clients:
+        thread.start()
+    for thread in clients:
+        thread.join()
+    delta_time = time.perf_counter() - start_time
+
+    sampler.stop()
+    if pool:
+        pool.close()
+    shutil.rmtree(directory, ignore_errors=True)
+
+    # Failed jobs, e.g. `no_worker` replies, do not count towards the throughput
+    print("%-8s %8.2f jobs/s  peak RSS %8.1f MB  failed %d of %d jobs%s" % (
+        mode, (jobs - len(failures)) / delta_time, sampler.peak_kb / 1024, len(failures), jobs,
+        ' (%s)' % ', '.join(sorted(set(failures))) if failures else ''))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='ERiC execution model benchmark')
+    parser.add_argument('modes', nargs='*', default=['process', 'pool', 'threads'])
+    parser.add_argument('--instances', type=int, default=4, help='Parallel ERiC instances or processes')
+    parser.add_argument('--jobs', type=int, default=100, help='Number of validations per mode')
+    args = parser.parse_args()
+
+    with open(_SAMPLE_XML, 'r') as f:
+        sample_xml = f.read()
+
+    for mode in args.modes:
+        _run(mode, args.instances, args.jobs, sample_xml)
@@ -0,0 +1,59 @@
+"""Benchmarks the schema check of the generated XML (`app/elster/xml_schema.py`) against
+the validation by ERiC for the debug data of the Lotse flow. The first check includes
+compiling the schemas, later checks use the cached ones.
+
+Usage: python3 scripts/benchmark_schema.py [--runs N]
+Requires `lxml` and `pyeric/schemas`; ERiC is only benchmarked if `pyeric/lib` exists.
+"""
+import argparse
+import os
+import sys
+import time
+
+curr_dir = os.path.dirname(os.path.abspath(__file__))
+parent_dir = os.path.dirname(curr_dir)
+sys.path.insert(0, parent_dir)
+os.chdir(parent_dir)
+
+from app.elster import elster_xml, est_mapping, xml_schema
+from app.elster.elster_service import _t4g_vorsatz
+from app.forms.lotse.flow_lotse import LotseMultiStepFlow
+from pyeric import EricApi
+
+_VERFAHREN = 'ESt_2019'
+
+
+def _generate_xml():
+    form_data = LotseMultiStepFlow(None).debug_data()[1]
+    vorsatz = _t4g_vorsatz(steuernummer=form_data['steuernummer'], year=2019)
+    return elster_xml.generate_xml_without_th(vorsatz, est_mapping._check_and_generate_entries(form_data))
+
+
+def _measure(fun, runs):
+    start_time = time.perf_counter()
+    for _ in range(runs):
+        fun()
+    return (time.perf_counter() - start_time) / runs * 1_000_000
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Schema check benchmark')
+    parser.add_argument('--runs', type=int, default=100)
+    args = parser.parse_args()
+
+    if not xml_schema.is_available():
+        sys.exit("lxml is not installed or ELSTER_SCHEMA_CHECK is disabled")
+
+    xml = _generate_xml()
+    print("schema check (first) %10.1fus" % _measure(lambda: xml_schema.check(xml, _VERFAHREN), 1))
+    print("schema check         %10.1fus  errors: %d" % (
+        _measure(lambda: xml_schema.check(xml, _VERFAHREN), args.runs), len(xml_schema.check(xml, _VERFAHREN))))
+
+    if os.path.exists('pyeric/lib/libericapi.so'):
+        eric = EricApi(debug=False)
+        eric.initialise()
+        try:
+            xml_with_th = elster_xml.add_transfer_header(eric, xml)
+            print("ERiC validation      %10.1fus" % _measure(lambda: eric.validate(xml_with_th, _VERFAHREN), args.runs))
+        finally:
+            eric.shutdown()
@@ -0,0 +1,84 @@
+"""Benchmarks the session backends under concurrent access from several processes,
+similar to the `gunicorn` workers on one host. Every process creates sessions and
+then runs a mix of loads and updates on them.
+
+Usage: python3 scripts/benchmark_sessions.py [backend ...] [--processes N] [--operations N]
+Backends are 'sqlite' and 'mongodb' (default: both). MongoDB is expected at `MONGO_URI`.
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+curr_dir = os.path.dirname(os.path.abspath(__file__))
+parent_dir = os.path.dirname(curr_dir)
+sys.path.insert(0, parent_dir)
+os.chdir(parent_dir)
+
+from app.forms.session_manager import MongoDbSessionManager, SqliteSessionManager
+
+_SAMPLE_DATA = {'person_a_first_name': 'Manfred', 'person_a_last_name': 'Mustername', 'iban': 'DE35133713370000012345'}
+
+
+def _create_manager(backend, sqlite_path):
+    if backend == 'sqlite':
+        return SqliteSessionManager(path=sqlite_path)
+    return MongoDbSessionManager()
+
+
+def _worker(backend, sqlite_path, operations, results):
+    from app import app
+    with app.app_context():
+        sessions = _create_manager(backend, sqlite_path)
+        identifiers = [sessions.create(_SAMPLE_DATA).identifier for _ in range(10)]
+
+        latencies = []
+        for i in range(operations):
+            start_time = time.perf_counter()
+            session = sessions.load(identifiers[i % len(identifiers)])
+            if i % 4 == 0:  # roughly one form POST per four page views
+                session.update({'counter': i})
+                session.commit()
+            latencies.append(time.perf_counter() - start_time)
+        results.put(latencies)
+
+
+def _run(backend, processes, operations, sqlite_path):
+    from app import app
+    with app.app_context():
+        if backend == 'sqlite':
+            SqliteSessionManager(path=sqlite_path).ensure_database()
+        else:
+            MongoDbSessionManager.ensure_database()
+
+    results = multiprocessing.Queue()
+    workers = [multiprocessing.Process(target=_worker, args=(backend, sqlite_path, operations, results))
+               for _ in range(processes)]
+
+    start_time = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    latencies = sorted(sum((results.get() for _ in workers), []))
+    for worker in workers:
+        worker.join()
+    delta_time = time.perf_counter() - start_time
+
+    def percentile(p):
+        return latencies[int(p * (len(latencies) - 1))] * 1_000_000
+
+    print("%-8s %6d ops/s  p50 %8.1fus  p99 %8.1fus" % (
+        backend, len(latencies) / delta_time, percentile(0.5), percentile(0.99)))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Session backend benchmark')
+    parser.add_argument('backends', nargs='*', default=['sqlite', 'mongodb'])
+    parser.add_argument('--processes', type=int, default=16)
+    parser.add_argument('--operations', type=int, default=1000, help='Operations per process')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        for backend in args.backends:
+            _run(backend, args.processes, args.operations, os.path.join(directory, 'sessions.sqlite3'))
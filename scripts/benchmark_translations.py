@@ -0,0 +1,59 @@
+"""Counts the `gettext` calls and measures the time per request for rendering
+all steps of the lotse flow. The first round starts with empty step caches,
+the following rounds show the steady state of a warm worker.
+
+Usage: python3 scripts/benchmark_translations.py [rounds]
+"""
+import os
+import sys
+import time
+
+curr_dir = os.path.dirname(os.path.abspath(__file__))
+parent_dir = os.path.dirname(curr_dir)
+sys.path.insert(0, parent_dir)
+os.chdir(parent_dir)
+
+import flask_babel
+
+from app import app
+from app.routes import _LOTSE_FLOW
+
+_GETTEXT_CALLS = 0
+_original_gettext = flask_babel.Domain.gettext
+
+
+def _counting_gettext(self, *args, **kwargs):
+    global _GETTEXT_CALLS
+    _GETTEXT_CALLS += 1
+    return _original_gettext(self, *args, **kwargs)
+
+
+def _run_round(client, session):
+    global _GETTEXT_CALLS
+    _GETTEXT_CALLS = 0
+
+    start_time = time.time()
+    for step_name in _LOTSE_FLOW.steps:
+        if step_name in ('sending', 'ack'):
+            continue  # these would talk to ELSTER
+        client.get('/lotse/step/%s?session=%s' % (step_name, session))
+    delta_time = time.time() - start_time
+
+    num_requests = len(_LOTSE_FLOW.steps) - 2
+    return _GETTEXT_CALLS / num_requests, delta_time * 1000 / num_requests
+
+
+if __name__ == "__main__":
+    rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    flask_babel.Domain.gettext = _counting_gettext
+
+    client = app.test_client()
+    location = client.get('/lotse/step/start').headers['Location']
+    session = location.split('session=')[1].split('&')[0]
+
+    calls, ms = _run_round(client, session)
+    print("cold: %5.1f gettext calls/request, %6.2fms/request" % (calls, ms))
+
+    for _ in range(rounds):
+        calls, ms = _run_round(client, session)
+    print("warm: %5.1f gettext calls/request, %6.2fms/request" % (calls, ms))
@@ -1,12 +1,21 @@
 import os
 os.environ["FLASK_ENV"] = 'testing'
 
+from tests.app.elster.admission import *
 from tests.app.elster.est_mapping import *
+from tests.app.elster.field_index import *
+from tests.app.elster.plausibility import *
 from tests.app.elster.elster_xml import *
 from tests.app.elster.elster_service import *
+from tests.app.elster.eric_results import *
 from tests.app.elster.pyeric_dispatcher import *
 from tests.app.elster.sample_data_validations import *
+from tests.app.elster.xml_schema import *
+
+from tests.app.content.render_cache import *
 
 from tests.app.forms.lotse.flow_lotse import *
+from tests.app.forms.multistep_flow import *
 from tests.app.forms.session_manager import *
 from tests.pyeric.eric import *
+from tests.pyeric.gateway import *
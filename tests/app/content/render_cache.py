@@ -0,0 +1,41 @@
+import unittest
+
+from app import app
+from app.content.render_cache import render_cached, _RENDER_CACHE
+
+
+class TestRenderCache(unittest.TestCase):
+
+    def setUp(self):
+        _RENDER_CACHE.clear()
+
+    def test_context_factory_only_called_once(self):
+        calls = []
+
+        def context_factory():
+            calls.append(1)
+            return {}
+
+        with app.test_request_context('/kontakt'):
+            first = render_cached('content/contact.html', context_factory=context_factory)
+            second = render_cached('content/contact.html', context_factory=context_factory)
+
+        self.assertEqual(1, len(calls))
+        self.assertEqual(first.get_data(), second.get_data())
+
+    def test_substitutions(self):
+        with app.test_request_context('/kontakt'):
+            render_cached('content/contact.html', substitutions={'session': 'Kontakt'})
+            response = render_cached('content/contact.html', substitutions={'session': 'OTHER_SESSION'})
+
+        self.assertIn('OTHER_SESSION', response.get_data(as_text=True))
+        self.assertNotIn('__render_cache_session__', response.get_data(as_text=True))
+
+    def test_etag_not_modified(self):
+        with app.test_request_context('/kontakt'):
+            etag = render_cached('content/contact.html').get_etag()[0]
+
+        with app.test_request_context('/kontakt', headers={'If-None-Match': '"%s"' % etag}):
+            response = render_cached('content/contact.html')
+
+        self.assertEqual(304, response.status_code)
@@ -0,0 +1,82 @@
+import tempfile
+import threading
+import time
+import unittest
+from unittest.mock import patch
+
+from app import app, metrics
+from app.elster.admission import eric_slot, SubmissionRejected
+
+
+class TestAdmission(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+
+        for patcher in (
+                patch('app.elster.admission._ADMISSION_FOLDER', directory.name),
+                patch.dict(app.config, {
+                    'ELSTER_MAX_CONCURRENT_RUNS': 1,
+                    'ELSTER_ADMISSION_QUEUE_SIZE': 1,
+                    'ELSTER_ADMISSION_WAIT_SECONDS': 0.1,
+                })):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_slot_is_released(self):
+        with eric_slot():
+            pass
+        with eric_slot(queue=False):
+            pass
+
+    def test_rejects_without_queue(self):
+        rejected = metrics.get('elster_admission_rejected')
+
+        with eric_slot():
+            with self.assertRaises(SubmissionRejected) as context:
+                with eric_slot(queue=False):
+                    pass
+
+        self.assertEqual(app.config['ELSTER_RETRY_AFTER_SECONDS'], context.exception.retry_after)
+        self.assertEqual(rejected + 1, metrics.get('elster_admission_rejected'))
+
+    def test_rejects_after_waiting(self):
+        with eric_slot():
+            with self.assertRaises(SubmissionRejected):
+                with eric_slot():
+                    pass
+        self.assertEqual(0, metrics.get('elster_admission_queue_depth'))
+
+    def test_counting_waiters_never_rejects_with_free_waiter_files(self):
+        # All threads join the queue at the same time, but there is a waiter file for each
+        threads = 8
+        app.config.update(ELSTER_ADMISSION_QUEUE_SIZE=threads, ELSTER_ADMISSION_WAIT_SECONDS=10)
+        rejected = metrics.get('elster_admission_rejected')
+
+        for _ in range(10):
+            barrier = threading.Barrier(threads + 1)
+
+            def run():
+                barrier.wait()
+                with eric_slot():
+                    pass
+
+            workers = [threading.Thread(target=run) for _ in range(threads)]
+            for worker in workers:
+                worker.start()
+            with eric_slot():
+                barrier.wait()
+                time.sleep(0.1)
+            for worker in workers:
+                worker.join()
+
+        self.assertEqual(rejected, metrics.get('elster_admission_rejected'))
+        self.assertEqual(0, metrics.get('elster_admission_queue_depth'))
+
+    def test_rejected_submission_returns_503(self):
+        with patch('app.routes._LOTSE_FLOW.handle', side_effect=SubmissionRejected(30)):
+            response = app.test_client().get('/lotse/step/sending')
+
+        self.assertEqual(503, response.status_code)
+        self.assertEqual('30', response.headers['Retry-After'])
@@ -1,12 +1,32 @@
+import os
+import shutil
+import tempfile
 import unittest
+from unittest.mock import patch
 
-from app.elster.elster_service import _t4g_vorsatz, send_with_elster
+from app import app
+from app.elster import eric_results, field_index, pyeric_dispatcher
+from app.elster.xml_schema import SchemaError
+from app.elster.elster_service import _t4g_vorsatz, send_with_elster, form_data_fingerprint, get_validation_result, \
+    print_with_elster, check_plausibility, generate_entries, validate_with_elster, OUTCOME_PLAUSIBILITY_ERROR, \
+    OUTCOME_SCHEMA_ERROR, OUTCOME_TIMEOUT
 from app.forms.lotse.flow_lotse import LotseMultiStepFlow, MultiStepFlow
 from app.utils import gen_random_key
 
+from pyeric import schema
+from pyeric.gateway import ThreadWorkerPool
+from tests.app.elster.xml_schema import _ENVELOPE_SCHEMA
+from tests.pyeric.gateway import FakeEricApi, start_fake_gateway
 from tests.utils import missing_cert, missing_pyeric_lib
 
 
+class InvalidTransferHeaderEricApi(FakeEricApi):
+    """Creates a <TransferHeader> that does not match the envelope schema."""
+
+    def create_th(self, xml, **kwargs):
+        return xml.replace('<DatenTeil>', '<TransferHeader version="11"/><DatenTeil>', 1).encode()
+
+
 class TestElsterService(unittest.TestCase):
 
     def test_t4g_vorsatz(self):
@@ -21,3 +41,131 @@ class TestElsterService(unittest.TestCase):
 
         response = send_with_elster(form_data, session_id)
         self.assertIsNotNone(response)
+
+    def test_fingerprint_only_depends_on_sent_data(self):
+        form_data = LotseMultiStepFlow(None).debug_data()[1]
+        fingerprint = form_data_fingerprint(form_data)
+
+        self.assertEqual(fingerprint, form_data_fingerprint(dict(form_data, confirm_send=True)))
+        self.assertNotEqual(fingerprint, form_data_fingerprint(dict(form_data, iban='DE02120300000000202051')))
+
+    def test_validation_result_matches_form_data(self):
+        form_data = LotseMultiStepFlow(None).debug_data()[1]
+        session_id = gen_random_key()
+        folder = pyeric_dispatcher._get_session_folder(session_id + '_validation')
+        os.makedirs(folder)
+        self.addCleanup(shutil.rmtree, folder)
+
+        pyeric_dispatcher.save_validation_result(session_id + '_validation', {
+            'fingerprint': form_data_fingerprint(form_data),
+            'result_code': 610301200,
+            'errors': [{'field_id': '0100001', 'text': 'Fehler'}],
+        })
+
+        result = get_validation_result(form_data, session_id)
+        self.assertEqual([pyeric_dispatcher.PlausibilityError('0100001', 'Fehler')], result.errors)
+        self.assertIsNone(get_validation_result(dict(form_data, iban='DE02120300000000202051'), session_id))
+
+    def test_print_requires_successful_submission(self):
+        self.assertIsNone(print_with_elster(gen_random_key()))
+
+    def test_timeout_is_classified_and_stored(self):
+        form_data = LotseMultiStepFlow(None).debug_data()[1]
+        session_id = gen_random_key()
+        folder = pyeric_dispatcher._get_session_folder(session_id)
+        os.makedirs(folder)
+        self.addCleanup(shutil.rmtree, folder)
+
+        with patch('app.elster.pyeric_dispatcher.run_pyeric', side_effect=pyeric_dispatcher.EricTimeoutError('send')):
+            self.assertEqual(OUTCOME_TIMEOUT, send_with_elster(form_data, session_id))
+        self.assertEqual(OUTCOME_TIMEOUT, pyeric_dispatcher.get_outcome(session_id))
+
+    def test_transient_failures_are_retried(self):
+        form_data = LotseMultiStepFlow(None).debug_data()[1]
+        session_id = gen_random_key()
+        folder = pyeric_dispatcher._get_session_folder(session_id)
+        os.makedirs(folder)
+        self.addCleanup(shutil.rmtree, folder)
+
+        timeout = pyeric_dispatcher.EricTimeoutError('create_th')
+        with patch('app.elster.pyeric_dispatcher.run_pyeric', side_effect=[timeout, timeout, timeout]) as run_pyeric, \
+                patch('time.sleep'):
+            self.assertEqual(OUTCOME_TIMEOUT, send_with_elster(form_data, session_id))
+        self.assertEqual(app.config['ELSTER_RETRY_MAX_ATTEMPTS'], run_pyeric.call_count)
+
+    def test_validations_are_not_retried(self):
+        form_data = LotseMultiStepFlow(None).debug_data()[1]
+        session_id = gen_random_key()
+        folder = pyeric_dispatcher._get_session_folder(session_id)
+        os.makedirs(folder)
+        self.addCleanup(shutil.rmtree, folder)
+        tokens = eric_results._RETRY_BUDGET.tokens
+
+        timeout = pyeric_dispatcher.EricTimeoutError('create_th')
+        with patch('app.elster.pyeric_dispatcher.run_pyeric', side_effect=[timeout, timeout]) as run_pyeric, \
+                patch('app.elster.eric_results.record_call') as record_call:
+            self.assertEqual(OUTCOME_TIMEOUT, validate_with_elster(form_data, session_id))
+        self.assertEqual(1, run_pyeric.call_count)
+        record_call.assert_not_called()
+        self.assertEqual(tokens, eric_results._RETRY_BUDGET.tokens)
+
+    def test_entries_are_generated_once_per_submission(self):
+        form_data = LotseMultiStepFlow(None).debug_data()[1]
+        session_id = gen_random_key()
+        folder = pyeric_dispatcher._get_session_folder(session_id)
+        os.makedirs(folder)
+        self.addCleanup(shutil.rmtree, folder)
+        entries = generate_entries(form_data)
+
+        with patch('app.elster.est_mapping._check_and_generate_entries') as check_and_generate_entries, \
+                patch('app.elster.pyeric_dispatcher.run_pyeric', side_effect=pyeric_dispatcher.EricTimeoutError('send')):
+            self.assertEqual([], check_plausibility(form_data, entries=entries))
+            self.assertIsNone(get_validation_result(form_data, session_id, entries=entries))
+            self.assertEqual(OUTCOME_TIMEOUT, send_with_elster(form_data, session_id, entries=entries))
+        check_and_generate_entries.assert_not_called()
+
+    def test_schema_errors_never_reach_eric(self):
+        form_data = LotseMultiStepFlow(None).debug_data()[1]
+        session_id = gen_random_key()
+        self.addCleanup(shutil.rmtree, pyeric_dispatcher._get_session_folder(session_id), True)
+
+        with patch('app.elster.xml_schema.check', return_value=[SchemaError(3, 'invalid')]), \
+                patch('app.elster.pyeric_dispatcher.run_pyeric') as run_pyeric:
+            self.assertEqual(OUTCOME_SCHEMA_ERROR, send_with_elster(form_data, session_id))
+        run_pyeric.assert_not_called()
+        self.assertEqual(OUTCOME_SCHEMA_ERROR, pyeric_dispatcher.get_outcome(session_id))
+
+    @unittest.skipIf(schema.etree is None, "skipped because lxml is not installed")
+    def test_envelope_errors_after_transfer_header(self):
+        form_data = LotseMultiStepFlow(None).debug_data()[1]
+        session_id = gen_random_key()
+        self.addCleanup(shutil.rmtree, pyeric_dispatcher._get_session_folder(session_id), True)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        with open(os.path.join(directory.name, 'Elster.xsd'), 'w') as f:
+            f.write(_ENVELOPE_SCHEMA)
+        address = start_fake_gateway(self, pool_class=ThreadWorkerPool, eric_factory=InvalidTransferHeaderEricApi,
+                                     schema_folder=directory.name)
+
+        with patch.dict(app.config, {'ELSTER_GATEWAY_ADDRESS': address, 'ELSTER_SCHEMA_FOLDER': directory.name}), \
+                patch.dict(schema._SCHEMAS, clear=True):
+            self.assertEqual(OUTCOME_SCHEMA_ERROR, send_with_elster(form_data, session_id))
+        self.assertEqual(OUTCOME_SCHEMA_ERROR, pyeric_dispatcher.get_outcome(session_id))
+
+    def test_unknown_religion_is_a_rule_error(self):
+        form_data = dict(LotseMultiStepFlow(None).debug_data()[1], person_a_religion='unknown')
+
+        errors = check_plausibility(form_data)
+
+        self.assertEqual(['0100402'], [error.field_id for error in errors])
+        self.assertEqual('person_a', field_index.lookup(errors[0].field_id).step.name)
+
+    def test_rule_errors_never_reach_eric(self):
+        form_data = dict(LotseMultiStepFlow(None).debug_data()[1], person_a_plz='1234')
+        session_id = gen_random_key()
+        self.addCleanup(shutil.rmtree, pyeric_dispatcher._get_session_folder(session_id), True)
+
+        self.assertIn('0100601', [error.field_id for error in check_plausibility(form_data)])
+        with patch('app.elster.pyeric_dispatcher.run_pyeric') as run_pyeric:
+            self.assertEqual(OUTCOME_PLAUSIBILITY_ERROR, send_with_elster(form_data, session_id))
+        run_pyeric.assert_not_called()
@@ -0,0 +1,31 @@
+import unittest
+
+from app import app
+from app.elster.eric_results import classify, backoff_delay, RetryBudget, CATEGORY_OK, CATEGORY_PERMANENT, \
+    CATEGORY_PLAUSIBILITY, CATEGORY_TRANSIENT, ERIC_GLOBAL_PRUEF_FEHLER, ERIC_TRANSFER_ERR_CONNECTSERVER, \
+    ERIC_TRANSFER_ERR_NORESPONSE
+
+
+class TestEricResults(unittest.TestCase):
+
+    def test_classify(self):
+        self.assertEqual(CATEGORY_OK, classify(0))
+        self.assertEqual(CATEGORY_PLAUSIBILITY, classify(ERIC_GLOBAL_PRUEF_FEHLER))
+        self.assertEqual(CATEGORY_TRANSIENT, classify(ERIC_TRANSFER_ERR_CONNECTSERVER))
+        self.assertEqual(CATEGORY_PERMANENT, classify(ERIC_TRANSFER_ERR_NORESPONSE))
+        self.assertEqual(CATEGORY_PERMANENT, classify(None))
+
+    def test_backoff_delay_is_bounded(self):
+        for attempt in range(10):
+            self.assertLessEqual(backoff_delay(attempt), app.config['ELSTER_RETRY_MAX_DELAY_SECONDS'])
+
+    def test_retry_budget(self):
+        budget = RetryBudget(ratio=0.5, max_tokens=1)
+
+        self.assertTrue(budget.withdraw())
+        self.assertFalse(budget.withdraw())
+
+        budget.deposit()
+        self.assertFalse(budget.withdraw())
+        budget.deposit()
+        self.assertTrue(budget.withdraw())
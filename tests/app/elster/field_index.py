@@ -0,0 +1,35 @@
+import unittest
+from unittest.mock import patch
+
+from app.elster import field_index
+from app.elster.field_index import FieldLocation
+from app.elster.pyeric_dispatcher import PlausibilityError
+from app.forms.lotse.subflow_02_personal_data import StepFamilienstand, StepPersonA
+from app.forms.lotse.subflow_03_steuerminderungen import StepHaushaltsnahe
+
+
+class TestFieldIndex(unittest.TestCase):
+
+    def test_index_is_built_at_startup(self):
+        self.assertEqual(FieldLocation('person_a_dob', StepPersonA), field_index.lookup('0100401'))
+        self.assertEqual(FieldLocation('familienstand_date', StepFamilienstand), field_index.lookup('0100701'))
+
+    def test_repeated_fields_are_found_by_their_number(self):
+        self.assertEqual(StepHaushaltsnahe, field_index.lookup('0107207-2').step)
+
+    def test_index_is_built_on_first_lookup(self):
+        with patch('app.elster.field_index._INDEX', {}):
+            self.assertEqual(StepPersonA, field_index.lookup('0100401').step)
+
+    def test_unknown_fields(self):
+        self.assertIsNone(field_index.lookup('9999999'))
+        self.assertIsNone(field_index.lookup(None))
+
+    def test_link_errors(self):
+        def url_for_step(step, _link_overview=False):
+            return '/%s?overview=%s' % (step.name, _link_overview)
+
+        errors = [PlausibilityError('0100401', 'falsch'), PlausibilityError('9999999', 'unbekannt')]
+
+        self.assertEqual([('falsch', '/person_a?overview=True'), ('unbekannt', None)],
+                         field_index.link_errors(errors, url_for_step))
@@ -0,0 +1,48 @@
+import unittest
+
+from app.elster import field_index, plausibility
+from app.elster.est_mapping import _check_and_generate_entries
+from app.forms.lotse.flow_lotse import LotseMultiStepFlow
+
+
+class TestPlausibility(unittest.TestCase):
+
+    def setUp(self):
+        self.fields = _check_and_generate_entries(LotseMultiStepFlow(None).debug_data()[1])
+
+    def test_debug_data_is_plausible(self):
+        self.assertEqual([], plausibility.check(self.fields))
+
+    def test_invalid_date(self):
+        self.fields['0100401'] = '31.02.1950'
+
+        errors = plausibility.check(self.fields)
+
+        self.assertEqual(['0100401'], [error.field_id for error in errors])
+        self.assertEqual('person_a', field_index.lookup(errors[0].field_id).step.name)
+
+    def test_invalid_plz_and_amount(self):
+        self.fields['0101701'] = '1234'
+        self.fields['0107207'] = '12,50'
+
+        errors = plausibility.check(self.fields)
+
+        self.assertEqual({('0101701', 'person_b'), ('0107207', 'haushaltsnahe')},
+                         {(error.field_id, field_index.lookup(error.field_id).step.name) for error in errors})
+
+    def test_unknown_religion(self):
+        self.fields['0100402'] = '99'
+        self.assertEqual(['0100402'], [error.field_id for error in plausibility.check(self.fields)])
+
+    def test_joint_assessment_requires_person_b(self):
+        del self.fields['0101001']
+        del self.fields['0100701']
+
+        errors = plausibility.check(self.fields)
+
+        self.assertEqual({('0101001', 'person_b'), ('0100701', 'familienstand')},
+                         {(error.field_id, field_index.lookup(error.field_id).step.name) for error in errors})
+
+    def test_only_rules_of_present_fields_run(self):
+        self.assertEqual([], plausibility.check({}))
+        self.assertNotIn('0102102', plausibility._RULES)  # IBANs are checked by the form
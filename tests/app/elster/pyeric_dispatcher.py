@@ -1,7 +1,14 @@
+import os
+import shutil
+import subprocess
+import sys
 import unittest
+from unittest.mock import patch
 
-from app import app
-from app.elster.pyeric_dispatcher import run_pyeric, clean_old_folders
+from app import app, metrics
+from app.elster.pyeric_dispatcher import run_pyeric, clean_old_folders, get_plausibility_errors, PlausibilityError, \
+    was_successful, _get_session_folder, _run_eric_client, EricTimeoutError, get_result_code, get_eric_response, \
+    is_ready, get_gateway_metrics
 from app.utils import gen_random_key
 
 from tests.utils import missing_cert, missing_pyeric_lib
@@ -23,3 +30,100 @@ class TestPyericDispatcher(unittest.TestCase):
     def test_clean_old_folders(self):
         # TODO: currently manual inspection; devise better testing method
         clean_old_folders(lifetime=10)
+
+    def test_get_plausibility_errors(self):
+        eric_response = """<EricBearbeiteVorgang>
+            <FehlerRegelpruefung>
+                <Feldidentifikator>0100001</Feldidentifikator>
+                <Text>Die Steuernummer fehlt.</Text>
+            </FehlerRegelpruefung>
+        </EricBearbeiteVorgang>"""
+
+        self.assertEqual([PlausibilityError('0100001', 'Die Steuernummer fehlt.')],
+                         get_plausibility_errors(eric_response))
+        self.assertEqual([], get_plausibility_errors(''))
+
+    def test_was_successful_does_not_need_pdf(self):
+        session = gen_random_key()
+        folder = _get_session_folder(session)
+        os.makedirs(folder)
+        self.addCleanup(shutil.rmtree, folder)
+        self.assertFalse(was_successful(session))
+
+        with open(os.path.join(folder, 'result_code.txt'), 'w') as f:
+            f.write('0')
+        self.assertFalse(was_successful(session))  # only validated
+
+        with open(os.path.join(folder, 'server_response.xml'), 'w') as f:
+            f.write('<Elster/>')
+        self.assertTrue(was_successful(session))
+        self.assertFalse(os.path.exists(os.path.join(folder, 'print.pdf')))
+
+
+class TestEricClientWatchdog(unittest.TestCase):
+
+    def setUp(self):
+        deadlines = {'initialise': 5, 'create_th': 5, 'validate': 5, 'send': 0.2, 'print': 5}
+        patcher = patch.dict(app.config, {'ELSTER_PHASE_TIMEOUT_SECONDS': deadlines})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _client(self, code):
+        return [sys.executable, '-c', 'import time; ' + code]
+
+    def test_finished_client(self):
+        _run_eric_client(self._client("print('phase:send', flush=True)"))
+
+    def test_stuck_client_is_killed(self):
+        timeouts = metrics.get('elster_timeouts_send')
+
+        with self.assertRaises(EricTimeoutError) as context:
+            _run_eric_client(self._client("print('phase:validate', flush=True); print('phase:send', flush=True); time.sleep(10)"))
+
+        self.assertEqual('send', context.exception.phase)
+        self.assertEqual(timeouts + 1, metrics.get('elster_timeouts_send'))
+
+    def test_failed_client(self):
+        with self.assertRaises(subprocess.CalledProcessError):
+            _run_eric_client(self._client("raise SystemExit(1)"))
+
+
+class TestGatewayDispatch(unittest.TestCase):
+
+    def test_results_are_stored_like_eric_client(self):
+        from tests.pyeric.gateway import start_fake_gateway
+        address = start_fake_gateway(self)
+
+        session = gen_random_key()
+        self.addCleanup(shutil.rmtree, _get_session_folder(session), True)
+        with patch.dict(app.config, {'ELSTER_GATEWAY_ADDRESS': address}):
+            run_pyeric('<Elster/>', session, app.config['CERT_PIN'], 'ESt_2019', only_validate=True, create_th=True)
+
+        self.assertEqual(0, get_result_code(session))
+        self.assertIn('EricBearbeiteVorgang', get_eric_response(session))
+        with open(os.path.join(_get_session_folder(session), 'input.xml'), 'r') as f:
+            self.assertEqual('<TransferHeader/><Elster/>', f.read())
+
+    def test_is_ready(self):
+        from tests.pyeric.gateway import start_fake_gateway
+        address = start_fake_gateway(self)
+
+        session = gen_random_key()
+        self.addCleanup(shutil.rmtree, _get_session_folder(session), True)
+        with patch.dict(app.config, {'ELSTER_GATEWAY_ADDRESS': address}):
+            # the run waits for the warm worker
+            run_pyeric('<Elster/>', session, app.config['CERT_PIN'], 'ESt_2019', only_validate=True)
+            self.assertTrue(is_ready())
+        with patch.dict(app.config, {'ELSTER_GATEWAY_ADDRESS': address + '.missing'}):
+            self.assertFalse(is_ready())
+        with patch.dict(app.config, {'ELSTER_GATEWAY_ADDRESS': None}):
+            self.assertTrue(is_ready())
+
+    def test_gateway_metrics(self):
+        from tests.pyeric.gateway import start_fake_gateway
+        address = start_fake_gateway(self)
+
+        with patch.dict(app.config, {'ELSTER_GATEWAY_ADDRESS': address}):
+            self.assertIn('workers_idle', get_gateway_metrics())
+        with patch.dict(app.config, {'ELSTER_GATEWAY_ADDRESS': None}):
+            self.assertEqual({}, get_gateway_metrics())
@@ -0,0 +1,141 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from app import app
+from app.elster import xml_schema
+from app.elster.elster_service import _t4g_vorsatz
+from app.elster.elster_xml import generate_xml_without_th
+from pyeric import schema
+
+_DECLARATION_SCHEMA = """<xs:schema xmlns:xs="http://www.w3.org/2001/XMLSchema"
+        targetNamespace="http://www.elster.de/elsterxml/schema/v11" elementFormDefault="qualified">
+    <xs:element name="Jahressteuererklaerung">
+        <xs:complexType>
+            <xs:sequence>
+                <xs:any processContents="skip" minOccurs="1" maxOccurs="1"/>
+                <xs:element name="Feld" minOccurs="0" maxOccurs="unbounded">
+                    <xs:complexType>
+                        <xs:attribute name="nr" type="xs:string" use="required"/>
+                        <xs:attribute name="wert" type="xs:string" use="required"/>
+                        <xs:attribute name="index" type="xs:string"/>
+                        <xs:attribute name="lfdNr" type="xs:string"/>
+                    </xs:complexType>
+                </xs:element>
+            </xs:sequence>
+            <xs:attribute name="version" type="xs:string"/>
+        </xs:complexType>
+    </xs:element>
+</xs:schema>
+"""
+
+
+_ENVELOPE_SCHEMA = """<xs:schema xmlns:xs="http://www.w3.org/2001/XMLSchema"
+        targetNamespace="http://www.elster.de/elsterxml/schema/v11" elementFormDefault="qualified">
+    <xs:element name="Elster">
+        <xs:complexType>
+            <xs:sequence>
+                <xs:element name="TransferHeader">
+                    <xs:complexType>
+                        <xs:sequence>
+                            <xs:element name="Verfahren" type="xs:string"/>
+                        </xs:sequence>
+                        <xs:attribute name="version" type="xs:string" use="required"/>
+                    </xs:complexType>
+                </xs:element>
+                <xs:any processContents="skip"/>
+            </xs:sequence>
+        </xs:complexType>
+    </xs:element>
+</xs:schema>
+"""
+
+
+_TRANSFER_HEADER = '<TransferHeader version="11"><Verfahren>ElsterErklaerung</Verfahren></TransferHeader>'
+
+
+def add_transfer_header(xml, transfer_header=_TRANSFER_HEADER):
+    return xml.replace('<DatenTeil>', transfer_header + '<DatenTeil>', 1)
+
+
+def missing_lxml():
+    return schema.etree is None
+
+
+class TestXmlSchema(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.folder = directory.name
+        with open(os.path.join(directory.name, 'ESt_2019.xsd'), 'w') as f:
+            f.write(_DECLARATION_SCHEMA)
+        with open(os.path.join(directory.name, 'Elster.xsd'), 'w') as f:
+            f.write(_ENVELOPE_SCHEMA)
+
+        for patcher in (patch.dict(app.config, {'ELSTER_SCHEMA_FOLDER': directory.name}),
+                        patch.dict(schema._SCHEMAS, clear=True)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def _xml(self, fields):
+        return generate_xml_without_th(_t4g_vorsatz(steuernummer='9198011310010', year=2019), fields)
+
+    @unittest.skipIf(missing_lxml(), "skipped because lxml is not installed")
+    def test_valid_xml(self):
+        self.assertEqual([], xml_schema.check(self._xml({'0100201': 'Mustername'}), 'ESt_2019'))
+
+    @unittest.skipIf(missing_lxml(), "skipped because lxml is not installed")
+    def test_invalid_xml(self):
+        xml = self._xml({'0100201': 'Mustername'}).replace('wert=', 'value=')
+
+        errors = xml_schema.check(xml, 'ESt_2019')
+
+        self.assertTrue(errors)
+        self.assertTrue(any('value' in error.message for error in errors))
+
+    @unittest.skipIf(missing_lxml(), "skipped because lxml is not installed")
+    def test_valid_envelope(self):
+        xml = add_transfer_header(self._xml({'0100201': 'Mustername'}))
+        self.assertEqual([], schema.check_envelope(xml, self.folder))
+
+    @unittest.skipIf(missing_lxml(), "skipped because lxml is not installed")
+    def test_invalid_envelope(self):
+        xml = add_transfer_header(self._xml({'0100201': 'Mustername'}), '<TransferHeader version="11"/>')
+
+        errors = schema.check_envelope(xml, self.folder)
+
+        self.assertEqual(1, len(errors))
+        self.assertIn('TransferHeader', errors[0].message)
+
+    @unittest.skipIf(missing_lxml(), "skipped because lxml is not installed")
+    def test_check_leaves_envelope_to_eric_client(self):
+        # The envelope schema requires a <TransferHeader>, which ERiC adds later
+        xml = self._xml({'0100201': 'Mustername'})
+        self.assertEqual([], xml_schema.check(xml, 'ESt_2019'))
+        self.assertTrue(schema.check_envelope(xml, self.folder))
+
+    @unittest.skipIf(missing_lxml(), "skipped because lxml is not installed")
+    def test_malformed_xml(self):
+        self.assertEqual(1, len(xml_schema.check('<Elster><DatenTeil></Elster>', 'ESt_2019')))
+
+    @unittest.skipIf(missing_lxml(), "skipped because lxml is not installed")
+    def test_missing_schema_is_skipped(self):
+        xml = self._xml({'0100201': 'Mustername'}).replace('wert=', 'value=')
+        self.assertEqual([], xml_schema.check(xml, 'ESt_2020'))
+
+    @unittest.skipIf(missing_lxml(), "skipped because lxml is not installed")
+    def test_schemas_are_compiled_once(self):
+        xml = add_transfer_header(self._xml({'0100201': 'Mustername'}))
+        with patch('lxml.etree.XMLSchema', wraps=schema.etree.XMLSchema) as compile_schema:
+            xml_schema.check(xml, 'ESt_2019')
+            xml_schema.check(xml, 'ESt_2019')
+            schema.check_envelope(xml, self.folder)
+            schema.check_envelope(xml, self.folder)
+        self.assertEqual(2, compile_schema.call_count)  # the envelope and the declaration schema
+
+    def test_check_is_skipped_without_lxml(self):
+        with patch('pyeric.schema.etree', None):
+            self.assertFalse(xml_schema.is_available())
+            self.assertEqual([], xml_schema.check('<Elster><DatenTeil></Elster>', 'ESt_2019'))
@@ -1,6 +1,7 @@
 import unittest
 
 from app.forms.lotse.flow_lotse import *
+from app import app
 
 class TestFlowLotse(unittest.TestCase):
     
@@ -9,4 +10,12 @@ class TestFlowLotse(unittest.TestCase):
         debug_data = flow.debug_data()
 
         self.assertIsNotNone(debug_data[0])
-        self.assertIsNotNone(debug_data[1])
\ No newline at end of file
+        self.assertIsNotNone(debug_data[1])
+
+    def test_summary_model_is_cached(self):
+        with app.test_request_context():
+            model = StepSummary._get_model()
+            self.assertIs(model, StepSummary._get_model())
+
+        section_steps = [section.step for section in model]
+        self.assertEqual([StepSectionEinwilligung, StepSectionMeineDaten, StepSectionSteuerminderung], section_steps)
@@ -0,0 +1,41 @@
+import unittest
+from unittest.mock import patch
+
+from app import app, babel
+from app.forms.flow_eligibility import EligibilityMultiStepFlow
+
+
+class TestMultiStepFlow(unittest.TestCase):
+
+    def test_translations_preloaded(self):
+        self.assertIn(('de', 'messages'), babel.domain_instance.cache)
+
+    def test_load_step_resolves_texts_once_per_locale(self):
+        flow = EligibilityMultiStepFlow(endpoint='eligibility')
+
+        with app.test_request_context():
+            first = flow._load_step('incomes')
+            with patch('flask_babel.Domain.gettext') as gettext:
+                second = flow._load_step('incomes')
+            gettext.assert_not_called()
+
+        self.assertIsNot(first, second)
+        self.assertEqual(first.title, second.title)
+        self.assertEqual(first._prev_step, second._prev_step)
+
+    def test_validate_returns_errors_of_submitted_fields(self):
+        client = app.test_client()
+
+        response = client.post('/lotse/step/iban/validate', data={'iban': 'DE00'})
+        self.assertEqual(200, response.status_code)
+        self.assertFalse(response.json['valid'])
+        self.assertEqual(['iban'], list(response.json['errors']))
+
+        response = client.post('/lotse/step/person_a/validate', data={'person_a_first_name': 'Manfred'})
+        self.assertEqual({}, response.json['errors'])
+
+    def test_validate_rejects_display_steps(self):
+        client = app.test_client()
+
+        self.assertEqual(404, client.post('/lotse/step/summary/validate').status_code)
+        self.assertEqual(404, client.post('/lotse/step/unknown/validate').status_code)
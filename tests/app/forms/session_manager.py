@@ -1,9 +1,15 @@
+import os
+import tempfile
 import unittest
+from unittest.mock import patch
 
-from app.forms.session_manager import SessionManager
+from app import app, metrics
+from app.forms.session_manager import SessionManager, InMemorySessionManager, MongoDbSessionManager, SqliteSessionManager, \
+    SignedTokenSessionManager, SessionKeyCollision, _SizedTTLCache
 
 from decimal import Decimal
-from datetime import date
+from datetime import date, datetime, timedelta
+from pymongo.errors import DuplicateKeyError
 
 
 class TestSessionMananger(unittest.TestCase):
@@ -21,3 +27,304 @@ class TestSessionMananger(unittest.TestCase):
         data_2 = sm._from_json(json)
 
         self.assertEqual(data, data_2)
+
+
+class TestSession(unittest.TestCase):
+
+    def test_load_unknown_returns_none(self):
+        sm = InMemorySessionManager()
+        self.assertIsNone(sm.load('unknown'))
+        self.assertIsNone(sm.load(None))
+
+    def test_create_and_load(self):
+        sm = InMemorySessionManager()
+        session = sm.create({'a': 1})
+
+        loaded = sm.load(session.identifier)
+        self.assertEqual(session.identifier, loaded.identifier)
+        self.assertEqual({'a': 1}, loaded.data)
+
+    def test_update_tracks_changed_keys_only(self):
+        sm = InMemorySessionManager()
+        session = sm.load(sm.create({'a': 1, 'b': 2}).identifier)
+
+        session.update({'a': 1, 'b': 3, 'c': 4})
+        self.assertEqual({'b', 'c'}, session.changed_keys)
+
+    def test_create_retries_on_key_collision(self):
+        sm = InMemorySessionManager()
+        existing = sm.create({'a': 1}).identifier
+        collisions = metrics.get('session_key_collisions')
+
+        with patch('app.forms.session_manager.gen_random_key', side_effect=[existing, 'new-key']):
+            session = sm.create({'a': 2})
+
+        self.assertEqual('new-key', session.identifier)
+        self.assertEqual({'a': 1}, sm.load(existing).data)
+        self.assertEqual(collisions + 1, metrics.get('session_key_collisions'))
+
+    def test_commit_writes_only_if_dirty(self):
+        sm = InMemorySessionManager()
+        session = sm.load(sm.create({'a': 1}).identifier)
+        writes = []
+        sm._save_session = lambda identifier, json: writes.append(json)
+
+        session.update({'a': 1})
+        session.commit()
+        self.assertEqual([], writes)
+
+        session.update({'a': 2})
+        session.commit()
+        self.assertEqual(1, len(writes))
+        self.assertFalse(session.is_dirty)
+
+
+class TestSqliteSessionManager(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.sm = SqliteSessionManager(path=os.path.join(self.directory.name, 'sessions.sqlite3'))
+        self.sm.ensure_database()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_create_load_update(self):
+        session = self.sm.create({'test_decimal': Decimal('42.00')})
+
+        session = self.sm.load(session.identifier)
+        self.assertEqual({'test_decimal': Decimal('42.00')}, session.data)
+
+        session.update({'test_date': date(2020, 1, 31)})
+        session.commit()
+        self.assertEqual(date(2020, 1, 31), self.sm.load(session.identifier).data['test_date'])
+
+    def test_patch_keeps_concurrent_changes(self):
+        identifier = self.sm.create({'a': 1, 'b': 1}).identifier
+        first, second = self.sm.load(identifier), self.sm.load(identifier)
+
+        first.update({'a': 2})
+        first.commit()
+        second.update({'b': 2})
+        second.commit()
+
+        self.assertEqual({'a': 2, 'b': 2}, self.sm.load(identifier).data)
+
+    def test_insert_rejects_duplicate_key(self):
+        identifier = self.sm.create({'a': 1}).identifier
+
+        with self.assertRaises(SessionKeyCollision):
+            self.sm._insert_session(identifier, '{}')
+
+    def test_expired_entries_are_ignored_and_cleaned(self):
+        identifier = self.sm.create({'a': 1}).identifier
+        self.sm.ttl = -1
+
+        self.assertIsNone(self.sm.load(identifier))
+        self.assertFalse(self.sm.has_session(identifier))
+
+        self.sm.clean_expired()
+        self.sm.ttl = 60
+        self.assertFalse(self.sm.has_session(identifier))
+
+
+class _FakeCollection(object):
+    """Minimal stand-in for the parts of a pymongo collection the session manager uses."""
+
+    def __init__(self):
+        self.documents = {}
+        self.full_reads = 0
+        self.bulk_writes = []
+        self.updates = []
+
+    def find_one(self, query, projection=None):
+        document = self.documents.get(query['_id'])
+        if document and projection:
+            return {key: document[key] for key in projection if key in document}
+        if document:
+            self.full_reads += 1
+        return document
+
+    def insert_one(self, document):
+        if document['_id'] in self.documents:
+            raise DuplicateKeyError('duplicate key')
+        self.documents[document['_id']] = dict(document, fields=dict(document['fields']))
+
+    def find_one_and_update(self, query, update, projection=None, upsert=False, return_document=None):
+        if query['_id'] not in self.documents and not upsert:
+            return None
+        self.updates.append(update)
+        document = self.documents.setdefault(query['_id'], {'_id': query['_id'], 'version': 0})
+        for key, value in update['$set'].items():
+            if key.startswith('fields.'):
+                document['fields'][key[len('fields.'):]] = value
+            else:
+                document[key] = dict(value) if key == 'fields' else value
+        for key in update.get('$unset', {}):
+            document['fields'].pop(key[len('fields.'):], None)
+        document['version'] += update['$inc']['version']
+        return {'version': document['version']}
+
+    def update_one(self, query, update):
+        self.documents[query['_id']].update(update['$set'])
+
+    def count_documents(self, query):
+        return 1 if query['_id'] in self.documents else 0
+
+    def bulk_write(self, requests, ordered=True):
+        self.bulk_writes.append(requests)
+        for request in requests:
+            document = self.documents[request._filter['_id']]
+            document['last_update'] = max(document['last_update'], request._doc['$max']['last_update'])
+
+
+class TestMongoDbSessionManagerCache(unittest.TestCase):
+
+    def setUp(self):
+        self.sm = MongoDbSessionManager(cache_max_bytes=1024)
+        self.sm.collection = _FakeCollection()
+
+    def test_cache_hit_skips_full_read(self):
+        identifier = self.sm.create({'a': 1}).identifier
+        hits = metrics.get('session_cache_hits')
+
+        self.assertEqual({'a': 1}, self.sm.load(identifier).data)
+        self.assertEqual(0, self.sm.collection.full_reads)
+        self.assertEqual(hits + 1, metrics.get('session_cache_hits'))
+
+    def test_stale_entry_is_reloaded(self):
+        identifier = self.sm.create({'a': 1}).identifier
+        other_worker = MongoDbSessionManager(cache_max_bytes=1024)
+        other_worker.collection = self.sm.collection
+        other_worker.update(identifier, {'a': 2})
+        stale = metrics.get('session_cache_stale')
+
+        self.assertEqual({'a': 2}, self.sm.load(identifier).data)
+        self.assertEqual(stale + 1, metrics.get('session_cache_stale'))
+
+    def test_cache_is_bounded_in_bytes(self):
+        for i in range(100):
+            self.sm.create({'a': 'x' * 100})
+        self.assertLessEqual(self.sm.cache.currsize, 1024)
+
+    def test_cached_data_is_not_shared(self):
+        identifier = self.sm.create({'a': 1}).identifier
+        session = self.sm.load(identifier)
+        session.data['a'] = 2
+
+        self.assertEqual({'a': 1}, self.sm.load(identifier).data)
+
+    def test_commit_only_sets_changed_fields(self):
+        session = self.sm.create({'a': 1, 'b': 'x' * 100})
+        session.update({'a': 2})
+        session.commit()
+
+        update = self.sm.collection.updates[-1]
+        self.assertEqual({'fields.a', 'last_update'}, set(update['$set']))
+        self.assertEqual({'a': 2, 'b': 'x' * 100}, self.sm.load(session.identifier).data)
+
+        other_worker = MongoDbSessionManager(cache_max_bytes=1024)
+        other_worker.collection = self.sm.collection
+        self.assertEqual({'a': 2, 'b': 'x' * 100}, other_worker.load(session.identifier).data)
+
+    def test_alternating_patches_of_two_workers(self):
+        identifier = self.sm.create({'a': 0, 'b': 0}).identifier
+        other_worker = MongoDbSessionManager(cache_max_bytes=1024)
+        other_worker.collection = self.sm.collection
+
+        for i in range(1, 4):
+            # Both workers load the session before either of them writes
+            session = self.sm.load(identifier)
+            other_session = other_worker.load(identifier)
+
+            session.update({'a': i})
+            session.commit()
+            other_session.update({'b': i})
+            other_session.commit()
+
+            expected = {'a': i, 'b': i}
+            self.assertEqual(expected, self.sm.load(identifier).data)
+            self.assertEqual(expected, other_worker.load(identifier).data)
+
+    def test_patch_unsets_removed_keys(self):
+        identifier = self.sm.create({'a': 1, 'b': 2}).identifier
+        self.sm.update(identifier, {'a': 1}, changed_keys={'b'})
+
+        self.assertEqual({'a': '1'}, self.sm.collection.documents[identifier]['fields'])
+
+    def test_patch_of_missing_entry_saves_full_data(self):
+        self.sm.update('missing', {'a': 1, 'b': 2}, changed_keys={'a'})
+
+        self.assertEqual({'a': '1', 'b': '2'}, self.sm.collection.documents['missing']['fields'])
+
+    def test_recent_session_does_not_refresh_ttl(self):
+        identifier = self.sm.create({'a': 1}).identifier
+        self.sm.load(identifier)
+
+        self.assertEqual({}, self.sm._pending_refreshes)
+
+    def test_ttl_refreshes_are_batched(self):
+        identifiers = [self.sm.create({'a': i}).identifier for i in range(3)]
+        old_update = datetime.utcnow() - timedelta(seconds=app.config['SESSION_TTL_SECONDS'])
+        for identifier in identifiers:
+            self.sm.collection.documents[identifier]['last_update'] = old_update
+            self.sm.load(identifier)
+
+        self.assertEqual([], self.sm.collection.bulk_writes)
+        self.sm.flush_ttl_refreshes()
+
+        self.assertEqual(1, len(self.sm.collection.bulk_writes))
+        for identifier in identifiers:
+            self.assertGreater(self.sm.collection.documents[identifier]['last_update'], old_update)
+
+
+class TestSignedTokenSessionManager(unittest.TestCase):
+
+    def setUp(self):
+        self.sm = SignedTokenSessionManager(secret_key='test')
+
+    def test_create_and_load(self):
+        session = self.sm.create({'test_decimal': Decimal('42.00'), 'test_date': date(2020, 1, 31)})
+
+        loaded = self.sm.load(session.identifier)
+        self.assertEqual(session.data, loaded.data)
+
+    def test_commit_changes_identifier(self):
+        session = self.sm.create({'other': 'no'})
+        old_identifier = session.identifier
+
+        session.update({'other': 'yes'})
+        session.commit()
+
+        self.assertNotEqual(old_identifier, session.identifier)
+        self.assertEqual('yes', self.sm.load(session.identifier).data['other'])
+
+    def test_tampered_or_expired_token(self):
+        identifier = self.sm.create({'other': 'no'}).identifier
+
+        self.assertIsNone(self.sm.load(identifier + 'x'))
+        self.assertIsNone(SignedTokenSessionManager(secret_key='other').load(identifier))
+        self.assertIsNone(SignedTokenSessionManager(secret_key='test', ttl=-1).load(identifier))
+
+
+class TestInMemorySessionManager(unittest.TestCase):
+
+    def setUp(self):
+        self.sm = InMemorySessionManager()
+        self.sm.cache = _SizedTTLCache(maxsize=1000, ttl=60, getsizeof=len)
+
+    def test_evicts_by_byte_budget(self):
+        evictions = metrics.get('session_memory_evictions')
+        for _ in range(20):
+            self.sm.create({'a': 'x' * 90})
+
+        self.assertLessEqual(self.sm.cache.currsize, 1000)
+        self.assertLess(len(self.sm.cache), 20)
+        self.assertGreater(metrics.get('session_memory_evictions'), evictions)
+
+    def test_compressed_entries(self):
+        self.sm.compress = True
+        session = self.sm.create({'a': 'x' * 500})
+
+        self.assertLess(self.sm.cache.currsize, 100)
+        self.assertEqual(session.data, self.sm.load(session.identifier).data)
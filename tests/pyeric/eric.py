@@ -1,6 +1,7 @@
+import threading
 import unittest
 
-from pyeric.eric import EricApi
+from pyeric.eric import EricApi, EricMtApi
 
 from tests.utils import missing_pyeric_lib
 
@@ -17,3 +18,35 @@ class TestEricBasicSanity(unittest.TestCase):
         api = EricApi(debug=False)
         buf = api.create_buffer()
         api.close_buffer(buf)
+
+
+class TestEricMtApi(unittest.TestCase):
+
+    @unittest.skipIf(missing_pyeric_lib(), "skipped because of missing eric lib; see pyeric/README.md")
+    def test_instance_create_buffer(self):
+        api = EricMtApi(debug=False)
+        api.initialise()
+        try:
+            buf = api.create_buffer()
+            api.close_buffer(buf)
+        finally:
+            api.shutdown()
+
+    @unittest.skipIf(missing_pyeric_lib(), "skipped because of missing eric lib; see pyeric/README.md")
+    def test_instances_in_parallel_threads(self):
+        apis = [EricMtApi(debug=False) for _ in range(4)]
+        results = []
+
+        def create_th(api):
+            api.initialise()
+            try:
+                results.append(api.create_th('<Elster xmlns="http://www.elster.de/elsterxml/schema/v11"/>'))
+            finally:
+                api.shutdown()
+
+        threads = [threading.Thread(target=create_th, args=(api,)) for api in apis]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(4, len(results))
@@ -0,0 +1,342 @@
+import json
+import os
+import socket
+import tempfile
+import threading
+import time
+import unittest
+
+from pyeric.eric import EricResponse
+from pyeric.gateway import GatewayClient, ThreadWorkerPool, WorkerPool, create_server, recv_frame, send_frame, \
+    _sample_resources
+
+
+class FakeEricApi(object):
+    """Stands in for `EricApi` in the gateway workers."""
+
+    def initialise(self, log_path=None):
+        pass
+
+    def shutdown(self):
+        pass
+
+    def create_th(self, xml, **kwargs):
+        return ('<TransferHeader/>' + xml).encode()
+
+    def validate(self, xml, data_type_version):
+        if 'hang' in xml:
+            time.sleep(10)
+        if 'fail' in xml:
+            raise RuntimeError('validation failed')
+        return EricResponse(0, b'<EricBearbeiteVorgang/>', None)
+
+    def get_error_text(self, result_code):
+        return 'error %d' % result_code
+
+
+class SlowWarmUpEricApi(FakeEricApi):
+    """Records the jobs it ran and blocks the warm-up until `warm_up_done` is set."""
+
+    warm_up_done = threading.Event()
+    calls = []
+
+    def create_th(self, xml, **kwargs):
+        self.calls.append(('create_th', 'warm_up' in xml))
+        return super(SlowWarmUpEricApi, self).create_th(xml, **kwargs)
+
+    def validate(self, xml, data_type_version):
+        self.calls.append(('validate', data_type_version))
+        if 'warm_up' in xml:
+            self.warm_up_done.wait(10)
+        return super(SlowWarmUpEricApi, self).validate(xml, data_type_version)
+
+
+class BrokenEricApi(FakeEricApi):
+
+    def initialise(self, log_path=None):
+        raise OSError("libericapi.so not found")
+
+
+def wait_until_ready(pool, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not pool.ready() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return pool.ready()
+
+
+def wait_for_metric(pool, name, value, timeout=10):
+    deadline = time.monotonic() + timeout
+    while pool.metrics().get(name) != value and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return pool.metrics().get(name)
+
+
+def start_fake_gateway(test_case, deadlines=None, pool_class=WorkerPool, eric_factory=FakeEricApi, **pool_args):
+    """Starts a gateway with a single fake worker and returns its address."""
+    directory = tempfile.TemporaryDirectory()
+    test_case.addCleanup(directory.cleanup)
+    address = 'unix:' + os.path.join(directory.name, 'eric.sock')
+
+    pool = pool_class(1, eric_factory=eric_factory, deadlines=deadlines, **pool_args)
+    server = create_server(address, pool)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    test_case.addCleanup(pool.close)
+    test_case.addCleanup(server.server_close)
+    test_case.addCleanup(server.shutdown)
+    return address
+
+
+class TestGateway(unittest.TestCase):
+
+    def test_frames(self):
+        left, right = socket.socketpair()
+        with left, right:
+            send_frame(left, b'')
+            send_frame(left, b'x' * 100000)
+            self.assertEqual(b'', recv_frame(right))
+            self.assertEqual(b'x' * 100000, recv_frame(right))
+
+    def test_status(self):
+        client = GatewayClient(start_fake_gateway(self), timeout=10)
+
+        deadline = time.monotonic() + 10
+        reply, _ = client.request({'op': 'status'})
+        while not reply['ready'] and time.monotonic() < deadline:
+            time.sleep(0.01)
+            reply, _ = client.request({'op': 'status'})
+        self.assertTrue(reply['ready'])
+        self.assertEqual(1, reply['metrics']['workers_idle'])
+
+    def test_validate_with_transfer_header(self):
+        client = GatewayClient(start_fake_gateway(self), timeout=10)
+
+        reply, parts = client.request({'op': 'validate', 'xml': '<Elster/>', 'verfahren': 'ESt_2019', 'create_th': True})
+
+        self.assertEqual(0, reply['result_code'])
+        self.assertEqual(b'<TransferHeader/><Elster/>', parts['xml'])
+        self.assertEqual(b'<EricBearbeiteVorgang/>', parts['eric_response'])
+
+    def test_stuck_worker_is_replaced(self):
+        client = GatewayClient(start_fake_gateway(self), timeout=10)
+
+        reply, _ = client.request({'op': 'validate', 'xml': 'hang', 'verfahren': 'ESt_2019',
+                                   'deadlines': {'validate': 0.2}})
+        self.assertEqual({'error': 'timeout', 'phase': 'validate', 'parts': []}, reply)
+
+        reply, _ = client.request({'op': 'validate', 'xml': '<Elster/>', 'verfahren': 'ESt_2019'})
+        self.assertEqual(0, reply['result_code'])
+
+
+    def test_invalid_jobs_get_an_error_reply(self):
+        address = start_fake_gateway(self)
+        client = GatewayClient(address, timeout=10)
+
+        reply, _ = client.request({'xml': '<Elster/>'})
+        self.assertEqual({'error': 'invalid job', 'phase': None, 'parts': []}, reply)
+
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(10)
+            sock.connect(address[len('unix:'):])
+            send_frame(sock, b'not json')
+            self.assertEqual('invalid job', json.loads(recv_frame(sock))['error'])
+
+    def test_failing_pool_gets_an_error_reply(self):
+        client = GatewayClient(start_fake_gateway(self), timeout=10)
+
+        reply, _ = client.request({'op': 'validate', 'xml': '<Elster/>', 'verfahren': 'ESt_2019', 'deadlines': 1})
+
+        self.assertEqual('validate', reply['phase'])
+        self.assertIn('TypeError', reply['error'])
+
+    def test_eric_debug_output_is_off_by_default(self):
+        self.assertEqual({'debug': False}, WorkerPool(0).eric_factory.keywords)
+        self.assertEqual({'debug': True}, WorkerPool(0, verbose=True).eric_factory.keywords)
+        self.assertEqual({'debug': False}, ThreadWorkerPool(0).eric_factory.keywords)
+        self.assertEqual({'debug': True}, ThreadWorkerPool(0, verbose=True).eric_factory.keywords)
+
+    def test_tcp_only_on_loopback(self):
+        with self.assertRaises(ValueError):
+            create_server('0.0.0.0:0', None)
+
+        server = create_server('127.0.0.1:0', None)
+        server.server_close()
+
+
+class TestThreadGateway(unittest.TestCase):
+
+    def test_validate_with_transfer_header(self):
+        client = GatewayClient(start_fake_gateway(self, pool_class=ThreadWorkerPool), timeout=10)
+
+        reply, parts = client.request({'op': 'validate', 'xml': '<Elster/>', 'verfahren': 'ESt_2019', 'create_th': True})
+
+        self.assertEqual(0, reply['result_code'])
+        self.assertEqual(b'<TransferHeader/><Elster/>', parts['xml'])
+
+    def test_stuck_worker_is_replaced(self):
+        client = GatewayClient(start_fake_gateway(self, pool_class=ThreadWorkerPool), timeout=10)
+
+        reply, _ = client.request({'op': 'validate', 'xml': 'hang', 'verfahren': 'ESt_2019',
+                                   'deadlines': {'validate': 0.2}})
+        self.assertEqual({'error': 'timeout', 'phase': 'validate', 'parts': []}, reply)
+
+        reply, _ = client.request({'op': 'validate', 'xml': '<Elster/>', 'verfahren': 'ESt_2019'})
+        self.assertEqual(0, reply['result_code'])
+
+    def test_failing_job_keeps_worker(self):
+        pool = ThreadWorkerPool(1, eric_factory=FakeEricApi)
+        self.addCleanup(pool.close)
+
+        reply, _ = pool.run({'op': 'validate', 'xml': 'fail', 'verfahren': 'ESt_2019'})
+        self.assertEqual('validate', reply['phase'])
+        self.assertIn('validation failed', reply['error'])
+
+        reply, _ = pool.run({'op': 'validate', 'xml': '<Elster/>', 'verfahren': 'ESt_2019'})
+        self.assertEqual(0, reply['result_code'])
+
+
+class TestCapacity(unittest.TestCase):
+
+    _JOB = {'op': 'validate', 'xml': '<Elster/>', 'verfahren': 'ESt_2019'}
+
+    def test_no_idle_worker(self):
+        pool = ThreadWorkerPool(1, eric_factory=FakeEricApi, acquire_timeout=0.2)
+        self.addCleanup(pool.close)
+        worker = pool._acquire()
+
+        reply, _ = pool.run(self._JOB)
+        self.assertEqual({'error': 'no_worker', 'phase': 'validate', 'parts': []}, reply)
+        self.assertEqual(1, pool.metrics()['jobs_without_worker'])
+
+        pool._release(worker)
+        reply, _ = pool.run(self._JOB)
+        self.assertEqual(0, reply['result_code'])
+
+    def test_lost_worker_is_started_again(self):
+        pool = ThreadWorkerPool(1, eric_factory=FakeEricApi)
+        self.addCleanup(pool.close)
+        self.assertTrue(wait_until_ready(pool))
+        pool.retry_delay = 0.05
+        pool.eric_factory = BrokenEricApi
+
+        pool.run({'op': 'validate', 'xml': 'hang', 'verfahren': 'ESt_2019', 'deadlines': {'validate': 0.2}})
+        deadline = time.monotonic() + 10
+        while pool.metrics().get('workers_failed', 0) < 2 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        pool.eric_factory = FakeEricApi
+
+        reply, _ = pool.run(self._JOB)
+        self.assertEqual(0, reply['result_code'])
+
+
+class TestWarmUp(unittest.TestCase):
+
+    def setUp(self):
+        SlowWarmUpEricApi.warm_up_done.clear()
+        del SlowWarmUpEricApi.calls[:]
+
+    def test_ready_once_warm(self):
+        pool = ThreadWorkerPool(2, eric_factory=SlowWarmUpEricApi, verfahren=['ESt_2019', 'ESt_2020'])
+        self.addCleanup(pool.close)
+        self.assertFalse(pool.ready())
+
+        SlowWarmUpEricApi.warm_up_done.set()
+        self.assertTrue(wait_until_ready(pool))
+        self.assertEqual(2, SlowWarmUpEricApi.calls.count(('validate', 'ESt_2019')))
+        self.assertEqual(2, SlowWarmUpEricApi.calls.count(('validate', 'ESt_2020')))
+        self.assertEqual(4, SlowWarmUpEricApi.calls.count(('create_th', True)))
+
+    def test_jobs_wait_for_warm_worker(self):
+        pool = ThreadWorkerPool(1, eric_factory=SlowWarmUpEricApi, verfahren=['ESt_2019'])
+        self.addCleanup(pool.close)
+        threading.Timer(0.2, SlowWarmUpEricApi.warm_up_done.set).start()
+
+        reply, _ = pool.run({'op': 'validate', 'xml': '<Elster/>', 'verfahren': 'ESt_2019'})
+
+        self.assertEqual(0, reply['result_code'])
+        self.assertEqual(('validate', 'ESt_2019'), SlowWarmUpEricApi.calls[-1])
+        self.assertEqual(2, SlowWarmUpEricApi.calls.count(('validate', 'ESt_2019')))
+
+    def test_replacement_is_warmed_up(self):
+        SlowWarmUpEricApi.warm_up_done.set()
+        pool = ThreadWorkerPool(1, eric_factory=SlowWarmUpEricApi, verfahren=['ESt_2019'])
+        self.addCleanup(pool.close)
+
+        pool.run({'op': 'validate', 'xml': 'hang', 'verfahren': 'ESt_2019', 'deadlines': {'validate': 0.2}})
+        pool.run({'op': 'validate', 'xml': '<Elster/>', 'verfahren': 'ESt_2019'})
+
+        self.assertEqual(2, SlowWarmUpEricApi.calls.count(('create_th', True)))
+
+
+class TestRecycling(unittest.TestCase):
+
+    _JOB = {'op': 'validate', 'xml': '<Elster/>', 'verfahren': 'ESt_2019'}
+
+    def test_sample_resources(self):
+        stats = _sample_resources()
+        self.assertGreater(stats['rss_kb'], 0)
+        self.assertGreater(stats['handles'], 0)
+
+    def test_recycle_after_max_jobs(self):
+        pool = ThreadWorkerPool(1, eric_factory=FakeEricApi, max_jobs=2)
+        self.addCleanup(pool.close)
+
+        pool.run(self._JOB)
+        self.assertNotIn('workers_recycled_jobs', pool.metrics())
+        pool.run(self._JOB)
+        self.assertEqual(1, pool.metrics()['workers_recycled_jobs'])
+        self.assertEqual(1, wait_for_metric(pool, 'workers_recycled', 1))
+
+        reply, _ = pool.run(self._JOB)
+        self.assertEqual(0, reply['result_code'])
+
+    def test_recycle_worker_process_above_rss(self):
+        pool = WorkerPool(1, eric_factory=FakeEricApi, max_rss_mb=1)
+        self.addCleanup(pool.close)
+
+        pool.run(self._JOB)
+        self.assertEqual(1, pool.metrics()['workers_recycled_rss'])
+        self.assertEqual(1, wait_for_metric(pool, 'workers_recycled', 1))
+
+        reply, _ = pool.run(self._JOB)
+        self.assertEqual(0, reply['result_code'])
+        # the replacement itself is recycled as well, as every process uses more than 1 MB
+        self.assertEqual(2, pool.metrics()['workers_recycled_rss'])
+
+    def test_recycled_worker_that_times_out_is_replaced_once(self):
+        pool = ThreadWorkerPool(1, eric_factory=FakeEricApi, verfahren=['ESt_2019'], max_jobs=1)
+        self.addCleanup(pool.close)
+        self.assertTrue(wait_until_ready(pool))
+        SlowWarmUpEricApi.warm_up_done.clear()
+        pool.eric_factory = SlowWarmUpEricApi  # the replacement stays cold until `warm_up_done`
+
+        pool.run(self._JOB)
+        self.assertEqual(1, pool.metrics()['workers_recycled_jobs'])
+        reply, _ = pool.run({'op': 'validate', 'xml': 'hang', 'verfahren': 'ESt_2019', 'deadlines': {'validate': 0.2}})
+        self.assertEqual('timeout', reply['error'])
+
+        SlowWarmUpEricApi.warm_up_done.set()
+        self.assertEqual(1, wait_for_metric(pool, 'workers_recycled', 1))
+        time.sleep(0.2)
+        self.assertEqual(1, pool.metrics()['workers_idle'])
+
+    def test_workers_are_not_forked_from_request_threads(self):
+        pool = WorkerPool(1, eric_factory=FakeEricApi)
+        self.addCleanup(pool.close)
+
+        worker = pool._acquire()
+        self.assertEqual('forkserver', worker.process._start_method)
+        pool._release(worker)
+
+    def test_worker_keeps_running_without_replacement(self):
+        pool = WorkerPool(1, eric_factory=FakeEricApi, max_handles=1)
+        self.addCleanup(pool.close)
+        self.assertTrue(wait_until_ready(pool))
+        pool.eric_factory = BrokenEricApi  # the replacement cannot be started
+
+        reply, _ = pool.run(self._JOB)
+        self.assertEqual(0, reply['result_code'])
+        self.assertEqual(1, wait_for_metric(pool, 'workers_failed', 1))
+
+        reply, _ = pool.run(self._JOB)
+        self.assertEqual(0, reply['result_code'])
+        self.assertEqual(2, pool.metrics()['workers_recycled_handles'])